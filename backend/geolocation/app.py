@@ -8,11 +8,13 @@ import os
 import sys
 import logging
 import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 from flask import Flask, request, jsonify
 from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-import tempfile
 import traceback
 import numpy as np
 
@@ -56,61 +58,183 @@ CORS(app, origins=ALLOWED_ORIGINS, supports_credentials=True)
 # Configuration
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
+MAX_BATCH_IMAGES = int(os.environ.get('GEO_MAX_BATCH_IMAGES', 64))
+
+# Batch image URLs are fetched in parallel on a bounded pool shared by all
+# requests, and all of a request's fetches must finish within one deadline
+URL_FETCH_WORKERS = int(os.environ.get('GEO_URL_FETCH_WORKERS', 8))
+URL_FETCH_DEADLINE = float(os.environ.get('GEO_URL_FETCH_DEADLINE', 30))
+_url_pool = ThreadPoolExecutor(max_workers=max(1, URL_FETCH_WORKERS), thread_name_prefix='url-fetch')
+
+# Micro-batching of concurrent single-image requests (0 disables)
+BATCH_WINDOW_MS = float(os.environ.get('GEO_BATCH_WINDOW_MS', 10))
+BATCH_MAX_SIZE = int(os.environ.get('GEO_BATCH_MAX_SIZE', 16))
+
+# Run GeoCLIP's image tower from the CLIP backbone shared with PortugalEmbedder
+SHARE_BACKBONE = os.environ.get('GEO_SHARE_BACKBONE', '1') == '1'
+
+# Opt-in dynamic int8 quantization of the vision tower (CPU only); validate
+# with `python model_tools.py check-quantization` before enabling
+QUANTIZE = os.environ.get('GEO_QUANTIZE') or None
+QUANTIZED_DIR = os.environ.get('GEO_QUANTIZED_DIR', str(Path(__file__).parent / 'data' / 'models'))
+
+# Inference backend for the vision tower: eager, torchscript or onnx. Exports
+# are built with `python model_tools.py export` and checked with `parity`;
+# a missing export falls back to eager
+INFERENCE_BACKEND = os.environ.get('GEO_INFERENCE_BACKEND', 'eager')
+EXPORT_DIR = os.environ.get('GEO_EXPORT_DIR', QUANTIZED_DIR)
+
+# Encoded GeoCLIP GPS gallery, cached so later starts skip encoding it
+GALLERY_CACHE_DIR = os.environ.get('GEO_GALLERY_CACHE_DIR', QUANTIZED_DIR)
+
+# Precomputed Portugal-only location gallery for the coarse stage (built with
+# `python model_tools.py build-gallery`); GeoCLIP's worldwide gallery is used
+# when it is missing
+LOCATION_GALLERY = os.environ.get(
+    'GEO_LOCATION_GALLERY', str(Path(__file__).parent / 'data' / 'models' / 'portugal_gallery'))
+
+# Persistent embedding cache keyed by image content (0 MB disables it)
+EMBED_CACHE_DIR = os.environ.get(
+    'GEO_EMBED_CACHE_DIR', str(Path(__file__).parent / 'data' / 'cache' / 'embeddings'))
+EMBED_CACHE_MB = float(os.environ.get('GEO_EMBED_CACHE_MB', 256))
+
+# CPU execution profile ('latency' or 'throughput'): thread pools are sized
+# from the cores available and the number of gunicorn workers sharing them
+EXEC_PROFILE = os.environ.get('GEO_EXEC_PROFILE', 'latency')
+WORKERS = int(os.environ.get('WEB_CONCURRENCY', 1))
+BF16 = os.environ.get('GEO_BF16', '0')
+
+# Memory-map FAISS indexes read-only so workers share one page-cached copy
+# and start without reading the whole file
+INDEX_MMAP = os.environ.get('GEO_INDEX_MMAP', '1') == '1'
+
+# Candidates a compressed index rescores against its exact float16 vectors,
+# keeping similarities calibrated to a flat index (0 disables re-ranking)
+INDEX_RERANK = int(os.environ.get('GEO_INDEX_RERANK', 200))
+
+# Region-sharded retrieval index; used instead of indexes/portugal.faiss when
+# its shards.json exists. Shards load on first use, at most GEO_INDEX_MAX_LOADED
+# stay resident, and GEO_INDEX_SHARD_WORKERS shards are searched in parallel
+INDEX_SHARD_DIR = os.environ.get(
+    'GEO_INDEX_SHARD_DIR', str(Path(__file__).parent / 'data' / 'indexes' / 'shards'))
+INDEX_MAX_LOADED = int(os.environ.get('GEO_INDEX_MAX_LOADED', 8))
+INDEX_SHARD_WORKERS = int(os.environ.get('GEO_INDEX_SHARD_WORKERS', 4))
+
+# Location-prototype index (one to a few centroids per place); used when its
+# prototypes.json exists. With GEO_INDEX_DRILL_DOWN=1 each place is scored by
+# its best-matching photo
+INDEX_PROTOTYPE_DIR = os.environ.get(
+    'GEO_INDEX_PROTOTYPE_DIR', str(Path(__file__).parent / 'data' / 'indexes' / 'prototypes'))
+INDEX_DRILL_DOWN = os.environ.get('GEO_INDEX_DRILL_DOWN', '1') == '1'
+
+# Comma-separated index_server.py URLs; when set, retrieval fans out to these
+# shard servers instead of loading an index here. A shard slower than
+# GEO_INDEX_SERVER_TIMEOUT seconds is left out of that query's results
+INDEX_SERVERS = [url.strip() for url in os.environ.get('GEO_INDEX_SERVERS', '').split(',') if url.strip()]
+INDEX_SERVER_TIMEOUT = float(os.environ.get('GEO_INDEX_SERVER_TIMEOUT', 2.0))
 
 # Initialize components (lazy loading)
 _pipeline = None
+_pipeline_lock = threading.Lock()
 _initialization_error = None
+_execution_profile = None
 
 
 def get_pipeline():
     """Lazy load the geolocation pipeline"""
-    global _pipeline, _initialization_error
+    global _pipeline, _initialization_error, _execution_profile
 
-    if _initialization_error:
-        raise _initialization_error
+    if _pipeline is not None:
+        return _pipeline
 
-    if _pipeline is None:
-        logger.info("Initializing geolocation pipeline...")
+    # gunicorn threads share this process: only the first request loads the models
+    with _pipeline_lock:
+        if _initialization_error:
+            raise _initialization_error
 
-        try:
-            from models.coarse_locator import CoarseLocator
-            from models.portugal_embedder import PortugalEmbedder
-            from retrieval.faiss_index import PortugalImageIndex
-            from gis.building_snapper import BuildingSnapper
-            from pipeline.hybrid_predictor import HybridGeoLocator
-
-            # Initialize components
-            coarse = CoarseLocator()
-            embedder = PortugalEmbedder()
-
-            # Load index if exists
-            data_dir = Path(__file__).parent / 'data'
-            index_path = data_dir / 'indexes' / 'portugal.faiss'
-            meta_path = data_dir / 'indexes' / 'portugal_meta.json'
-
-            if index_path.exists() and meta_path.exists():
-                image_index = PortugalImageIndex(str(index_path), str(meta_path))
-                logger.info("FAISS index loaded")
-            else:
-                logger.warning("No FAISS index found - retrieval disabled")
-                image_index = PortugalImageIndex()  # Empty index
-
-            snapper = BuildingSnapper(cache_dir=str(data_dir / 'gis_cache'))
-
-            _pipeline = HybridGeoLocator(
-                coarse_locator=coarse,
-                portugal_embedder=embedder,
-                image_index=image_index,
-                building_snapper=snapper
-            )
-
-            logger.info("Geolocation pipeline initialized successfully")
+        if _pipeline is None:
+            logger.info("Initializing geolocation pipeline...")
 
-        except Exception as e:
-            logger.error(f"Failed to initialize pipeline: {e}")
-            logger.error(traceback.format_exc())
-            _initialization_error = e
-            raise
+            try:
+                from models.coarse_locator import CoarseLocator
+                from models.portugal_embedder import PortugalEmbedder
+                from retrieval.faiss_index import PortugalImageIndex
+                from retrieval.sharded_index import ShardedImageIndex
+                from retrieval.prototype_index import PrototypeImageIndex
+                from retrieval.remote_index import RemoteShardIndex
+                from gis.building_snapper import BuildingSnapper
+                from pipeline.hybrid_predictor import HybridGeoLocator
+                from models.backbone import configure_backbones
+                from models.execution_profiles import apply_profile
+
+                # Runs in each worker after the fork, before any model work
+                _execution_profile = apply_profile(EXEC_PROFILE, workers=WORKERS, bf16=BF16)
+
+                configure_backbones(
+                    quantize=QUANTIZE,
+                    quantized_dir=QUANTIZED_DIR,
+                    backend=INFERENCE_BACKEND,
+                    export_dir=EXPORT_DIR,
+                    bf16_autocast=_execution_profile['bf16_autocast'],
+                    channels_last=_execution_profile['channels_last']
+                )
+
+                # Initialize components
+                coarse = CoarseLocator(
+                    batch_window_ms=BATCH_WINDOW_MS,
+                    max_batch_size=BATCH_MAX_SIZE,
+                    share_backbone=SHARE_BACKBONE,
+                    gallery_cache_dir=GALLERY_CACHE_DIR,
+                    location_gallery=LOCATION_GALLERY
+                )
+                embedder = PortugalEmbedder(
+                    batch_window_ms=BATCH_WINDOW_MS,
+                    max_batch_size=BATCH_MAX_SIZE,
+                    cache_dir=EMBED_CACHE_DIR,
+                    cache_mb=EMBED_CACHE_MB
+                )
+
+                # Load index if exists
+                data_dir = Path(__file__).parent / 'data'
+                index_path = data_dir / 'indexes' / 'portugal.faiss'
+                meta_path = data_dir / 'indexes' / 'portugal_meta.json'
+
+                if INDEX_SERVERS:
+                    image_index = RemoteShardIndex(INDEX_SERVERS, timeout=INDEX_SERVER_TIMEOUT)
+                    logger.info(f"Using {len(INDEX_SERVERS)} remote index servers")
+                elif ShardedImageIndex.exists(INDEX_SHARD_DIR):
+                    image_index = ShardedImageIndex(INDEX_SHARD_DIR, max_loaded=INDEX_MAX_LOADED,
+                                                    max_workers=INDEX_SHARD_WORKERS, mmap=INDEX_MMAP,
+                                                    rerank=INDEX_RERANK)
+                    logger.info(f"Sharded FAISS index found ({len(image_index.manifest['shards'])} shards)")
+                elif PrototypeImageIndex.exists(INDEX_PROTOTYPE_DIR):
+                    image_index = PrototypeImageIndex(INDEX_PROTOTYPE_DIR, mmap=INDEX_MMAP, rerank=INDEX_RERANK,
+                                                      drill_down=INDEX_DRILL_DOWN)
+                    logger.info(f"Prototype FAISS index found ({image_index.manifest['prototypes']} prototypes)")
+                elif index_path.exists() and (meta_path.exists() or meta_path.with_suffix('.cols').exists()):
+                    image_index = PortugalImageIndex(str(index_path), str(meta_path), mmap=INDEX_MMAP,
+                                                     rerank=INDEX_RERANK)
+                    logger.info("FAISS index loaded")
+                else:
+                    logger.warning("No FAISS index found - retrieval disabled (build one with build_index.py)")
+                    image_index = PortugalImageIndex()  # Empty index
+
+                snapper = BuildingSnapper(cache_dir=str(data_dir / 'gis_cache'))
+
+                _pipeline = HybridGeoLocator(
+                    coarse_locator=coarse,
+                    portugal_embedder=embedder,
+                    image_index=image_index,
+                    building_snapper=snapper
+                )
+
+                logger.info("Geolocation pipeline initialized successfully")
+
+            except Exception as e:
+                logger.error(f"Failed to initialize pipeline: {e}")
+                logger.error(traceback.format_exc())
+                _initialization_error = e
+                raise
 
     return _pipeline
 
@@ -196,6 +320,12 @@ def health_check():
             'image_index': pipeline.image_index.is_available if pipeline.image_index else False,
             'building_snapper': pipeline.building_snapper.is_available if pipeline.building_snapper else False
         }
+        status['execution_profile'] = _execution_profile
+        status['coarse_gallery'] = getattr(pipeline.coarse_locator, 'gallery_source', None)
+        status['micro_batching'] = _batching_stats(pipeline)
+
+        from models.backbone import loaded_backbones
+        status['backbones'] = loaded_backbones()
     except Exception as e:
         status['pipeline'] = 'error'
         status['error'] = str(e)
@@ -203,105 +333,153 @@ def health_check():
     return jsonify(status)
 
 
-@app.route('/api/geolocation/analyze', methods=['POST'])
-@app.route('/api/geoclip/predict', methods=['POST'])
-def analyze_image():
-    """
-    Main geolocation endpoint.
-    Accepts image file or image URL.
-    """
-    image_path = None
+def _batching_stats(pipeline):
+    """Micro-batcher metrics for each model component"""
+    return {
+        'window_ms': BATCH_WINDOW_MS,
+        'max_batch_size': BATCH_MAX_SIZE,
+        'coarse_locator': getattr(pipeline.coarse_locator, 'batching_stats', None),
+        'portugal_embedder': getattr(pipeline.portugal_embedder, 'batching_stats', None)
+    }
+
 
+@app.route('/api/geolocation/metrics', methods=['GET'])
+def metrics():
+    """Runtime metrics for monitoring"""
     try:
         pipeline = get_pipeline()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 503
 
-        # Handle file upload
-        if 'image' in request.files:
-            file = request.files['image']
-            if file.filename == '':
-                return jsonify({'error': 'No file selected'}), 400
+    return jsonify({
+        'micro_batching': _batching_stats(pipeline),
+        'embedding_cache': getattr(pipeline.portugal_embedder, 'cache_stats', None),
+        'index_shards': getattr(pipeline.image_index, 'shard_stats', None),
+        'index_memory': getattr(pipeline.image_index, 'memory_stats', None)
+    })
 
-            if not allowed_file(file.filename):
-                return jsonify({'error': 'Invalid file type'}), 400
 
-            # Save to temp file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp:
-                file.save(tmp.name)
-                image_path = tmp.name
+def _load_upload(file):
+    """Decode an uploaded file in memory"""
+    if file.filename == '':
+        raise ValueError('No file selected')
 
-        # Handle URL
-        elif request.json and 'image_url' in request.json:
-            import requests as req
-            from PIL import Image
-            from io import BytesIO
+    if not allowed_file(file.filename):
+        raise ValueError('Invalid file type')
 
-            image_url = request.json['image_url']
+    return _decode(file.read())
 
-            # SSRF Protection - validate URL before fetching
-            try:
-                validate_url_ssrf(image_url)
-            except ValueError as e:
-                return jsonify({'error': f'Invalid image URL: {str(e)}'}), 400
 
-            response = req.get(image_url, timeout=30)
-            response.raise_for_status()
+def _load_image_url(image_url, timeout=30):
+    """Fetch an image URL (SSRF-checked) and decode it in memory"""
+    import requests as req
 
-            img = Image.open(BytesIO(response.content))
+    # SSRF Protection - validate URL before fetching
+    try:
+        validate_url_ssrf(image_url)
+    except ValueError as e:
+        raise ValueError(f'Invalid image URL: {str(e)}')
 
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp:
-                img.save(tmp.name)
-                image_path = tmp.name
+    response = req.get(image_url, timeout=timeout)
+    response.raise_for_status()
 
-        # Handle base64
-        elif request.json and 'image_base64' in request.json:
-            import base64
-            from PIL import Image
-            from io import BytesIO
+    return _decode(response.content)
 
-            image_data = base64.b64decode(request.json['image_base64'])
-            img = Image.open(BytesIO(image_data))
 
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp:
-                img.save(tmp.name)
-                image_path = tmp.name
+def _load_image_base64(image_base64):
+    """Decode a base64 image in memory"""
+    import base64
+    import binascii
 
-        else:
-            return jsonify({'error': 'No image provided'}), 400
+    try:
+        image_data = base64.b64decode(image_base64)
+    except (binascii.Error, TypeError) as e:
+        raise ValueError(f'Invalid base64 image: {str(e)}')
 
-        # Run prediction
-        logger.info(f"Processing image: {image_path}")
-        result = pipeline.predict(image_path)
+    return _decode(image_data)
 
-        # Format response
-        response = {
-            'success': True,
-            'coordinates': None,
-            'confidence': result['confidence'],
-            'method': result['method'],
-            'building': result.get('building_match'),
-            'candidates': []
-        }
 
-        if result['best_prediction']:
-            response['coordinates'] = {
-                'lat': result['best_prediction']['lat'],
-                'lon': result['best_prediction']['lon']
+def _decode(image_data):
+    """Decode image bytes once, reporting bad data as a client error"""
+    from PIL import UnidentifiedImageError
+    from models.image_io import load_image
+
+    try:
+        return load_image(image_data)
+    except (UnidentifiedImageError, OSError) as e:
+        raise ValueError(f'Could not decode image: {str(e)}')
+
+
+def _format_prediction(result):
+    """Shape a pipeline result into the API response format"""
+    response = {
+        'success': True,
+        'coordinates': None,
+        'confidence': result['confidence'],
+        'method': result['method'],
+        'building': result.get('building_match'),
+        'candidates': []
+    }
+
+    if result['best_prediction']:
+        response['coordinates'] = {
+            'lat': result['best_prediction']['lat'],
+            'lon': result['best_prediction']['lon']
+        }
+        response['prediction_source'] = result['best_prediction'].get('source')
+
+    if result.get('retrieval_error'):
+        response['warning'] = result['retrieval_error']
+
+    # Add top candidates
+    if result['predictions']:
+        response['candidates'] = [
+            {
+                'lat': p['lat'],
+                'lon': p['lon'],
+                'cluster_size': p.get('cluster_size', 1),
+                'similarity': p.get('avg_similarity', 0)
             }
-            response['prediction_source'] = result['best_prediction'].get('source')
-
-        # Add top candidates
-        if result['predictions']:
-            response['candidates'] = [
-                {
-                    'lat': p['lat'],
-                    'lon': p['lon'],
-                    'cluster_size': p.get('cluster_size', 1),
-                    'similarity': p.get('avg_similarity', 0)
-                }
-                for p in result['predictions'][:5]
-            ]
-
-        return jsonify(response)
+            for p in result['predictions'][:5]
+        ]
+
+    return response
+
+
+@app.route('/api/geolocation/analyze', methods=['POST'])
+@app.route('/api/geoclip/predict', methods=['POST'])
+def analyze_image():
+    """
+    Main geolocation endpoint.
+    Accepts image file or image URL.
+    """
+    try:
+        pipeline = get_pipeline()
+        payload = request.get_json(silent=True) or {}
+
+        try:
+            # Handle file upload
+            if 'image' in request.files:
+                image = _load_upload(request.files['image'])
+
+            # Handle URL
+            elif 'image_url' in payload:
+                image = _load_image_url(payload['image_url'])
+
+            # Handle base64
+            elif 'image_base64' in payload:
+                image = _load_image_base64(payload['image_base64'])
+
+            else:
+                return jsonify({'error': 'No image provided'}), 400
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Run prediction
+        logger.info(f"Processing image: {image.width}x{image.height}")
+        result = pipeline.predict(image)
+
+        return jsonify(_format_prediction(result))
 
     except Exception as e:
         logger.error(f"Analysis failed: {e}")
@@ -311,13 +489,94 @@ def analyze_image():
             'error': str(e)
         }), 500
 
-    finally:
-        # Clean up temp file
-        if image_path:
-            try:
-                os.unlink(image_path)
-            except Exception:
-                pass
+
+@app.route('/api/geolocation/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """
+    Batch geolocation endpoint.
+    Accepts several image files (multipart field 'images') or a JSON body
+    with 'image_urls' and/or 'images_base64' lists of strings. URLs are
+    fetched concurrently within one deadline (GEO_URL_FETCH_DEADLINE). All
+    images run through one batched pipeline call; results are returned in
+    input order.
+    """
+    try:
+        pipeline = get_pipeline()
+        payload = request.get_json(silent=True) or {}
+        if not isinstance(payload, dict):
+            return jsonify({'error': 'JSON body must be an object'}), 400
+        for field in ('image_urls', 'images_base64'):
+            values = payload.get(field, [])
+            if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+                return jsonify({'error': f"'{field}' must be a list of strings"}), 400
+
+        # Collect (loader, source) pairs in request order
+        sources = [(_load_upload, f) for f in request.files.getlist('images')]
+        sources += [(_load_image_url, url) for url in payload.get('image_urls', [])]
+        sources += [(_load_image_base64, data) for data in payload.get('images_base64', [])]
+
+        if not sources:
+            return jsonify({'error': 'No images provided'}), 400
+
+        if len(sources) > MAX_BATCH_IMAGES:
+            return jsonify({'error': f'Too many images (max {MAX_BATCH_IMAGES})'}), 400
+
+        # Start the URL fetches, then decode the other images meanwhile; a
+        # bad item fails on its own without failing the batch
+        deadline = time.monotonic() + URL_FETCH_DEADLINE
+        loads = {slot: _url_pool.submit(loader, source, timeout=URL_FETCH_DEADLINE)
+                 for slot, (loader, source) in enumerate(sources) if loader is _load_image_url}
+        outcomes = {}
+        for slot, (loader, source) in enumerate(sources):
+            if slot not in loads:
+                try:
+                    outcomes[slot] = loader(source)
+                except Exception as e:
+                    outcomes[slot] = e
+        _, late = wait(loads.values(), timeout=max(0.0, deadline - time.monotonic()))
+        for slot, future in loads.items():
+            if future in late:
+                future.cancel()
+                outcomes[slot] = TimeoutError(f'Timed out fetching image URL '
+                                              f'(batch deadline {URL_FETCH_DEADLINE:g}s)')
+            else:
+                outcomes[slot] = future.exception() or future.result()
+
+        responses = [None] * len(sources)
+        images = []
+        valid_slots = []
+        for slot in range(len(sources)):
+            if isinstance(outcomes[slot], Exception):
+                logger.warning(f"Batch item {slot} rejected: {outcomes[slot]}")
+                responses[slot] = {'success': False, 'error': str(outcomes[slot])}
+            else:
+                images.append(outcomes[slot])
+                valid_slots.append(slot)
+
+        logger.info(f"Processing batch of {len(images)} images")
+        results = pipeline.predict_many(images)
+
+        for slot, result in zip(valid_slots, results):
+            if result.get('error'):
+                # A pipeline failure for this image, not a located result
+                responses[slot] = {'success': False, 'error': result['error']}
+            else:
+                responses[slot] = _format_prediction(result)
+
+        return jsonify({
+            'success': True,
+            'count': len(responses),
+            'failed': sum(1 for response in responses if not response['success']),
+            'results': responses
+        })
+
+    except Exception as e:
+        logger.error(f"Batch analysis failed: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
 
 @app.route('/api/geolocation/feedback', methods=['POST'])
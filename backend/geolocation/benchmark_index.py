@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+ProprScout Geolocation retrieval benchmark
+Measures what each index configuration costs and how much recall it loses:
+recall@1/10/20 against exact search, single-query p50/p99 latency, batch
+throughput, build time and memory, written as JSON
+
+Every index type is built once per build setting (nlist, HNSW M, PQ bytes,
+PCA dimension) and searched once per search setting (nprobe, efSearch).
+
+With --prototypes, per-photo and location-prototype indexes are also
+compared on geolocation accuracy (top-1 distance to the query's true
+location), size and latency; this needs locations (synthetic, or
+--locations for real embeddings).
+
+Examples:
+  python benchmark_index.py --n 200000 --dim 512 --output bench.json
+  python benchmark_index.py --embeddings vectors.npy --types hnsw,ivf_sq8 --nprobe 8,32,128
+  python benchmark_index.py --embeddings vectors.npy --types flat --pca-dim 0,128,256
+  python benchmark_index.py --embeddings vectors.npy --locations latlon.npy --types flat --prototypes 1,3
+"""
+
+import sys
+import json
+import time
+import logging
+import argparse
+import itertools
+from pathlib import Path
+
+import numpy as np
+
+# Add this directory to path for imports (same layout as app.py)
+sys.path.insert(0, str(Path(__file__).parent))
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('benchmark_index')
+
+RECALL_AT = (1, 10, 20)
+
+# Portugal mainland bounding box for synthetic locations
+PORTUGAL_BOUNDS = (36.9, 42.2, -9.6, -6.2)
+
+
+def synthetic_embeddings(n: int, dim: int, clusters: int, seed: int = 0) -> tuple:
+    """
+    Clustered, L2-normalized vectors with locations, shaped like image embeddings.
+
+    Uniform random vectors are an unrealistically hard case for ANN indexes;
+    points drawn around cluster centres behave more like photos of the same
+    places.
+
+    Returns:
+        (float32 embeddings of shape (n, dim), float32 lat, float32 lon)
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    assignment = rng.integers(0, clusters, n)
+    vectors = centers[assignment] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    lat_min, lat_max, lon_min, lon_max = PORTUGAL_BOUNDS
+    lat = rng.uniform(lat_min, lat_max, clusters)[assignment].astype(np.float32)
+    lon = rng.uniform(lon_min, lon_max, clusters)[assignment].astype(np.float32)
+    return vectors, lat, lon
+
+
+def load_embeddings(path: str, queries: int, seed: int = 0, locations: str = None) -> tuple:
+    """
+    Real embeddings from a .npy file, split into database and held-out queries.
+
+    Args:
+        locations: .npy of (lat, lon) rows aligned with the embeddings
+
+    Returns:
+        (database vectors, query vectors, database locations, query
+        locations); vectors are L2-normalized float32, locations are
+        (n, 2) float32 or None
+    """
+    vectors = np.load(path, mmap_mode='r')
+    order = np.random.default_rng(seed).permutation(len(vectors))
+    vectors = np.asarray(vectors[np.sort(order)], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    held_out = np.zeros(len(vectors), dtype=bool)
+    held_out[order[:queries]] = True
+    if locations is None:
+        return vectors[~held_out], vectors[held_out], None, None
+
+    coords = np.load(locations).astype(np.float32)
+    if len(coords) != len(vectors):
+        raise SystemExit(f"{locations} has {len(coords)} rows for {len(vectors)} embeddings")
+    return vectors[~held_out], vectors[held_out], coords[~held_out], coords[held_out]
+
+
+def ground_truth(database: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Exact top-k row ids of every query, from a flat inner-product index"""
+    import faiss
+
+    index = faiss.IndexFlatIP(database.shape[1])
+    index.add(database)
+    _, ids = index.search(queries, k)
+    return ids
+
+
+def recall(found: np.ndarray, truth: np.ndarray, k: int) -> float:
+    """Mean share of the true top-k found among the returned top-k"""
+    hits = [len(np.intersect1d(f[:k], t[:k])) for f, t in zip(found, truth)]
+    return float(np.mean(hits) / k)
+
+
+def serialized_mb(index) -> float:
+    import faiss
+
+    return len(faiss.serialize_index(index)) / (1024 * 1024)
+
+
+def measure(index, queries: np.ndarray, truth: np.ndarray, latency_queries: int, **search_params) -> dict:
+    """Recall, single-query latency and batch throughput at one search setting"""
+    top_k = max(RECALL_AT)
+
+    started = time.perf_counter()
+    hits = index.search_batch(queries, top_k=top_k, **search_params)
+    batch_seconds = time.perf_counter() - started
+
+    latencies = []
+    for query in queries[:latency_queries]:
+        started = time.perf_counter()
+        index.search(query, top_k=top_k, **search_params)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    result = {f'recall@{k}': round(recall(hits.ids, truth, k), 4) for k in RECALL_AT}
+    result.update({
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+        'batch_qps': round(len(queries) / batch_seconds, 1)
+    })
+    return result
+
+
+def measure_locations(index, queries: np.ndarray, lat: np.ndarray, lon: np.ndarray,
+                      latency_queries: int, **search_params) -> dict:
+    """Top-1 geolocation error, single-query latency and batch throughput"""
+    from retrieval.geo_filter import haversine_km
+
+    started = time.perf_counter()
+    hits = index.search_batch(queries, top_k=max(RECALL_AT), **search_params)
+    batch_seconds = time.perf_counter() - started
+
+    latencies = []
+    for query in queries[:latency_queries]:
+        started = time.perf_counter()
+        index.search(query, top_k=max(RECALL_AT), **search_params)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    # Queries without a located hit count as infinitely wrong
+    errors = np.nan_to_num(haversine_km(hits.lat[:, 0], hits.lon[:, 0], lat, lon), nan=np.inf)
+    return {
+        'median_error_km': round(float(np.median(errors)), 3),
+        'acc@1km': round(float(np.mean(errors <= 1)), 4),
+        'acc@25km': round(float(np.mean(errors <= 25)), 4),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+        'batch_qps': round(len(queries) / batch_seconds, 1)
+    }
+
+
+def prototype_tradeoff(database: np.ndarray, metadata, queries: np.ndarray, query_lat: np.ndarray,
+                       query_lon: np.ndarray, args) -> list:
+    """Per-photo vs location-prototype indexes, per index type and prototype count"""
+    from retrieval import PortugalImageIndex, PrototypeImageIndex
+
+    results = []
+    for index_type in args.types:
+        photos = PortugalImageIndex()
+        photos.create_index(database, metadata, index_type=index_type)
+        entry = {'type': index_type, 'mode': 'photos', 'vectors': photos.ntotal,
+                 'index_mb': round(serialized_mb(photos.index), 1),
+                 **measure_locations(photos, queries, query_lat, query_lon, args.latency_queries)}
+        results.append(entry)
+        logger.info(f"{index_type} photos: median error {entry['median_error_km']} km, "
+                    f"{entry['vectors']} vectors, p50 {entry['p50_ms']} ms")
+        del photos
+
+        for max_prototypes in args.prototypes:
+            index = PrototypeImageIndex.build(database, metadata, decimals=args.prototype_decimals,
+                                              max_prototypes=max_prototypes, index_type=index_type)
+            for drill_down in (False, True):
+                entry = {'type': index_type, 'mode': 'prototypes', 'max_prototypes': max_prototypes,
+                         'drill_down': drill_down, 'places': index.manifest['places'],
+                         'vectors': index.manifest['prototypes'],
+                         'index_mb': round(serialized_mb(index.prototypes.index), 1),
+                         **measure_locations(index, queries, query_lat, query_lon, args.latency_queries,
+                                             drill_down=drill_down)}
+                results.append(entry)
+                logger.info(f"{index_type} prototypes (max {max_prototypes}, drill-down {drill_down}): "
+                            f"median error {entry['median_error_km']} km, {entry['vectors']} vectors, "
+                            f"p50 {entry['p50_ms']} ms")
+            del index
+    return results
+
+
+def build_settings(index_type: str, args) -> list:
+    """Build-time parameter combinations to try for an index type"""
+    if index_type == 'hnsw':
+        settings = [{'hnsw_m': m} for m in args.hnsw_m]
+    elif index_type == 'ivf_pq':
+        settings = [{'nlist': nlist, 'pq_m': m} for nlist, m in itertools.product(args.nlist or [None], args.pq_m)]
+    elif index_type.startswith('ivf'):
+        settings = [{'nlist': nlist} for nlist in args.nlist or [None]]
+    else:
+        settings = [{}]
+    return [{**setting, 'pca_dim': pca_dim or None, 'whiten': args.whiten}
+            for setting, pca_dim in itertools.product(settings, args.pca_dim)]
+
+
+def search_settings(spec: dict, args) -> list:
+    """Search-time parameter combinations to try for a built index"""
+    if spec['type'] == 'hnsw':
+        return [{'ef_search': ef} for ef in args.ef_search]
+    if spec['type'].startswith('ivf'):
+        return [{'nprobe': p} for p in args.nprobe if p <= spec['nlist']]
+    return [{}]
+
+
+def run(args) -> dict:
+    import faiss
+    from retrieval import PortugalImageIndex
+    from retrieval.faiss_index import process_rss_mb
+    from retrieval.metadata_store import ColumnarMetadata
+
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+
+    if args.embeddings:
+        database, queries, locations, query_locations = load_embeddings(args.embeddings, args.queries,
+                                                                        args.seed, args.locations)
+        if locations is None:
+            lat = lon = np.full(len(database), np.nan, dtype=np.float32)
+            query_lat = query_lon = None
+        else:
+            lat, lon = locations[:, 0].copy(), locations[:, 1].copy()
+            query_lat, query_lon = query_locations[:, 0], query_locations[:, 1]
+        source = args.embeddings
+    else:
+        vectors, lat, lon = synthetic_embeddings(args.n + args.queries, args.dim, args.clusters, args.seed)
+        database, queries = vectors[:args.n], vectors[args.n:]
+        query_lat, query_lon = lat[args.n:], lon[args.n:]
+        lat, lon = lat[:args.n], lon[:args.n]
+        source = 'synthetic'
+    if args.prototypes and query_lat is None:
+        raise SystemExit("--prototypes needs locations (--locations with --embeddings)")
+
+    n, d = database.shape
+    metadata = ColumnarMetadata({'lat': lat, 'lon': lon}, {'lat': 'float32', 'lon': 'float32'}, n)
+    logger.info(f"Benchmarking {n} vectors of dimension {d} with {len(queries)} queries ({source})")
+
+    started = time.perf_counter()
+    truth = ground_truth(database, queries, max(RECALL_AT))
+    logger.info(f"Exact ground truth in {time.perf_counter() - started:.1f}s")
+
+    results = []
+    for index_type in args.types:
+        for build in build_settings(index_type, args):
+            index = PortugalImageIndex()
+            rss_before = process_rss_mb()
+            started = time.perf_counter()
+            index.create_index(database, metadata, index_type=index_type, **build)
+            build_seconds = time.perf_counter() - started
+            rss_after = process_rss_mb()
+
+            spec = index.spec
+            memory = {
+                'index_mb': round(serialized_mb(index.index), 1),
+                'estimated_mb': spec['estimated_memory_mb'],
+                'rss_growth_mb': round(rss_after - rss_before, 1) if rss_before is not None else None
+            }
+            for search in search_settings(spec, args):
+                entry = {
+                    'type': spec['type'],
+                    'factory': spec['factory'],
+                    'nlist': spec['nlist'],
+                    'hnsw_m': spec['hnsw_m'],
+                    'pq_m': spec['pq_m'],
+                    'pca_dim': spec['pca_dim'],
+                    'retained_variance': (spec.get('pca') or {}).get('retained_variance'),
+                    **search,
+                    'build_seconds': round(build_seconds, 2),
+                    **memory,
+                    **measure(index, queries, truth, args.latency_queries, **search)
+                }
+                results.append(entry)
+                logger.info(f"{spec['factory']} {search or ''}: recall@10 {entry['recall@10']}, "
+                            f"p50 {entry['p50_ms']} ms, {memory['index_mb']} MB")
+            del index
+
+    report = {
+        'dataset': {'source': source, 'n': n, 'dimension': d, 'queries': len(queries),
+                    'clusters': None if args.embeddings else args.clusters, 'seed': args.seed},
+        'threads': faiss.omp_get_max_threads(),
+        'results': results
+    }
+    if args.prototypes:
+        report['prototypes'] = prototype_tradeoff(database, metadata, queries, query_lat, query_lon, args)
+    return report
+
+
+def int_list(value: str) -> list:
+    return [int(v) for v in value.split(',') if v]
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    group = parser.add_argument_group('data')
+    group.add_argument('--embeddings', default=None, help='.npy of real embeddings (default: synthetic)')
+    group.add_argument('--n', type=int, default=100_000, help='Synthetic database size')
+    group.add_argument('--dim', type=int, default=512, help='Synthetic vector dimension')
+    group.add_argument('--clusters', type=int, default=1000, help='Synthetic cluster count')
+    group.add_argument('--queries', type=int, default=1000, help='Held-out query vectors')
+    group.add_argument('--locations', default=None, help='.npy of (lat, lon) rows for --embeddings')
+    group.add_argument('--seed', type=int, default=0)
+
+    group = parser.add_argument_group('sweep')
+    group.add_argument('--types', type=lambda v: v.split(','), default=['flat', 'hnsw', 'ivf_sq8', 'ivf_pq'],
+                       help='Comma-separated index types (flat, hnsw, ivf_fp16, ivf_sq8, ivf_pq)')
+    group.add_argument('--nlist', type=int_list, default=None, help='IVF list counts (default: from n)')
+    group.add_argument('--nprobe', type=int_list, default=[4, 16, 64, 256], help='IVF lists scanned')
+    group.add_argument('--hnsw-m', type=int_list, default=[16, 32], help='HNSW links per node')
+    group.add_argument('--ef-search', type=int_list, default=[32, 64, 128, 256], help='HNSW search breadth')
+    group.add_argument('--pq-m', type=int_list, default=[32, 64], help='PQ bytes per vector')
+    group.add_argument('--pca-dim', type=int_list, default=[0], help='PCA dimensions (0: no reduction)')
+    group.add_argument('--whiten', action='store_true', help='Whiten the PCA components')
+    group.add_argument('--prototypes', type=int_list, default=[],
+                       help='Also compare location-prototype indexes with at most this many centroids per place')
+    group.add_argument('--prototype-decimals', type=int, default=4, help='Coordinate rounding of a place')
+
+    parser.add_argument('--latency-queries', type=int, default=200, help='Queries timed one at a time')
+    parser.add_argument('--threads', type=int, default=None, help='FAISS OpenMP threads (default: all cores)')
+    parser.add_argument('--output', default=None, help='Write the JSON report here (default: stdout)')
+    return parser
+
+
+def main(args) -> int:
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+        logger.info(f"Wrote {len(report['results'])} results to {args.output}")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(build_parser().parse_args()))
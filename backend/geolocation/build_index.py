@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+"""
+ProprScout Geolocation index builder
+Builds data/indexes/portugal.faiss and its metadata from a manifest of
+geotagged images (CSV or JSONL with an image path or URL plus lat/lon)
+
+The build runs in two resumable stages:
+
+  embed  Worker processes stream the manifest, each embedding its share of
+         fixed-size row chunks; every finished chunk is written to the work
+         directory, so a crashed or interrupted run continues where it stopped
+  index  The chunks are merged: the index type is chosen from the collection
+         size, trained on a sample, and filled chunk by chunk with periodic
+         checkpoints; with --dedup-threshold, near-duplicate photos are
+         collapsed into one vector as they are added
+
+Example:
+  python build_index.py --manifest photos.csv --workers 4 --work-dir data/indexes/build
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import argparse
+import multiprocessing
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+
+# Add this directory to path for imports (same layout as app.py)
+sys.path.insert(0, str(Path(__file__).parent))
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(processName)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('build_index')
+
+DATA_DIR = Path(__file__).parent / 'data'
+SOURCE_FIELDS = ('image_path', 'image_url', 'path', 'url', 'image')
+CHUNKS_DIR = 'chunks'
+CONFIG_FILE = 'build.json'
+PARTIAL_INDEX = 'index.partial.faiss'
+PROGRESS_FILE = 'index.progress.json'
+TRAINED_INDEX = 'index.trained.faiss'
+DEDUP_STATE = 'dedup.{:07d}.npz'
+DEDUP_VECTORS = 'dedup.vectors.f16'
+
+
+class RemoteImage:
+    """
+    Image URL fetched when first read.
+
+    read_bytes() calls .read(), so downloads happen on the embedder's
+    decode threads rather than in the process streaming the manifest.
+    """
+
+    def __init__(self, url: str, timeout: float = 30):
+        self.url = url
+        self.timeout = timeout
+
+    def read(self) -> bytes:
+        import requests
+
+        response = requests.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+
+def read_manifest(path: str):
+    """
+    Stream manifest rows.
+
+    Yields:
+        (row number, record dict) for every row of a .csv or .jsonl manifest
+    """
+    path = Path(path)
+    with open(path, newline='' if path.suffix == '.csv' else None) as f:
+        if path.suffix == '.csv':
+            for row, record in enumerate(csv.DictReader(f)):
+                yield row, record
+        else:
+            row = 0
+            for line in f:
+                if line.strip():
+                    yield row, json.loads(line)
+                    row += 1
+
+
+def parse_record(record: dict, image_root: Path) -> tuple:
+    """
+    Image source and index metadata of one manifest record.
+
+    Returns:
+        (source, metadata), or (None, None) for rows without an image or location
+    """
+    field = next((name for name in SOURCE_FIELDS if record.get(name)), None)
+    try:
+        lat, lon = float(record['lat']), float(record['lon'])
+    except (KeyError, TypeError, ValueError):
+        return None, None
+    if field is None:
+        return None, None
+
+    value = str(record[field])
+    metadata = {k: v for k, v in record.items() if k not in SOURCE_FIELDS and v not in (None, '')}
+    metadata.update({'lat': lat, 'lon': lon})
+
+    if value.startswith(('http://', 'https://')):
+        metadata['image_url'] = value
+        return RemoteImage(value), metadata
+
+    path = Path(value) if Path(value).is_absolute() else image_root / value
+    metadata['image_path'] = value
+    return path, metadata
+
+
+def chunk_path(work_dir: Path, chunk: int) -> Path:
+    return work_dir / CHUNKS_DIR / f"chunk-{chunk:07d}.npz"
+
+
+def write_chunk(path: Path, rows: list, vectors: list, records: list, failed: int, dimension: int):
+    """
+    Persist one embedded chunk atomically (its presence marks it done).
+
+    A chunk where every row failed is still written, with a (0, dimension)
+    vector array, so resuming does not retry it forever.
+    """
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        np.savez(
+            f,
+            rows=np.asarray(rows, dtype=np.int64),
+            vectors=(np.asarray(vectors, dtype=np.float16) if vectors
+                     else np.zeros((0, dimension), dtype=np.float16)),
+            metadata=np.array(json.dumps(records)),
+            failed=np.array(failed)
+        )
+    os.replace(tmp_path, path)
+
+
+def read_chunk(path: Path) -> tuple:
+    """(vectors as float32, metadata records) of a finished chunk"""
+    with np.load(path) as data:
+        return data['vectors'].astype(np.float32), json.loads(str(data['metadata']))
+
+
+def embed_worker(worker: int, config: dict):
+    """
+    Embed the chunks assigned to one worker (chunk % workers == worker).
+
+    Every worker streams the whole manifest but only decodes images of its
+    own chunks; chunks already on disk are skipped.
+    """
+    from models.backbone import configure_backbones
+    from models.execution_profiles import apply_profile
+    from models.portugal_embedder import PortugalEmbedder
+    from retrieval.dedup import dhash
+
+    # One forward pass at a time per worker, using all of the worker's cores
+    profile = apply_profile('latency', workers=config['workers'], bf16=config['bf16'])
+    configure_backbones(bf16_autocast=profile['bf16_autocast'], channels_last=profile['channels_last'])
+    embedder = PortugalEmbedder(model_path=config['weights'], device='cpu',
+                                cache_dir=config['cache_dir'], cache_mb=config['cache_mb'])
+    if embedder.backbone is None:
+        raise RuntimeError("Embedding model failed to load")
+
+    work_dir = Path(config['work_dir'])
+    image_root = Path(config['image_root'])
+    chunk_size = config['chunk_size']
+
+    def own_rows():
+        for row, record in read_manifest(config['manifest']):
+            chunk = row // chunk_size
+            if chunk % config['workers'] == worker and not chunk_path(work_dir, chunk).exists():
+                yield row, record
+
+    current, rows, vectors, records, failed = None, [], [], [], 0
+    started = time.time()
+    done = 0
+
+    def flush():
+        nonlocal rows, vectors, records, failed, done
+        if current is not None:
+            write_chunk(chunk_path(work_dir, current), rows, vectors, records, failed, embedder.embedding_dim)
+            done += 1
+            logger.info(f"Chunk {current} done: {len(rows)} embedded, {failed} failed "
+                        f"({done} chunks in {time.time() - started:.0f}s)")
+        rows, vectors, records, failed = [], [], [], 0
+
+    def sources():
+        # Parsed rows for the embedder; unusable rows are counted, not embedded
+        streaming = None  # runs ahead of `current`, which follows the results
+        for row, record in own_rows():
+            chunk = row // chunk_size
+            if chunk != streaming:
+                pending.append(('flush', chunk))
+                streaming = chunk
+            source, metadata = parse_record(record, image_root)
+            if source is None:
+                pending.append(('skip', row))
+                continue
+            pending.append(('row', (row, metadata)))
+            yield source
+
+    # Bookkeeping events in manifest order, consumed as embeddings come back
+    pending = deque()
+
+    def drain_until_row():
+        nonlocal current, failed
+        while pending:
+            kind, value = pending.popleft()
+            if kind == 'flush':
+                flush()
+                current = value
+            elif kind == 'skip':
+                failed += 1
+            else:
+                return value
+        return None
+
+    for _, source, embedding in embedder.iter_embeddings(sources(), batch_size=config['batch_size'],
+                                                         num_workers=config['decode_threads']):
+        row, metadata = drain_until_row()
+        if embedding is None:
+            failed += 1
+            continue
+        if config.get('phash') and isinstance(source, Path) and not metadata.get('phash'):
+            try:
+                metadata['phash'] = dhash(source)
+            except OSError as e:
+                logger.warning(f"Could not hash {source}: {e}")
+        rows.append(row)
+        vectors.append(embedding)
+        records.append(metadata)
+
+    # Trailing skipped rows and chunk boundaries after the last embedding
+    while drain_until_row() is not None:
+        pass
+    flush()
+
+    if embedder.cache is not None:
+        embedder.cache.flush()
+    logger.info(f"Worker {worker} finished {done} chunks")
+
+
+def _run_worker(worker: int, config: dict):
+    try:
+        embed_worker(worker, config)
+    except Exception:
+        logger.exception(f"Worker {worker} failed")
+        sys.exit(1)
+
+
+def count_chunks(manifest: str, chunk_size: int) -> int:
+    rows = sum(1 for _ in read_manifest(manifest))
+    return (rows + chunk_size - 1) // chunk_size
+
+
+def stage_embed(args, work_dir: Path) -> int:
+    """Run (or resume) the embedding stage; returns the number of chunks"""
+    config = {
+        'manifest': str(args.manifest),
+        'image_root': str(args.image_root or Path(args.manifest).parent),
+        'work_dir': str(work_dir),
+        'workers': max(1, args.workers),
+        'chunk_size': args.chunk_size,
+        'batch_size': args.batch_size,
+        'decode_threads': args.decode_threads,
+        'weights': args.weights,
+        'bf16': args.bf16,
+        'cache_dir': args.cache_dir,
+        'cache_mb': args.cache_mb if args.cache_dir else 0,
+        'phash': args.phash
+    }
+
+    # Chunk numbering depends on the manifest and chunk size; refuse to mix
+    config_path = work_dir / CONFIG_FILE
+    if config_path.exists():
+        previous = json.loads(config_path.read_text())
+        for key in ('manifest', 'chunk_size'):
+            if previous[key] != config[key]:
+                raise SystemExit(f"{work_dir} was started with {key}={previous[key]!r}; "
+                                 f"use a new --work-dir or the same {key}")
+    (work_dir / CHUNKS_DIR).mkdir(parents=True, exist_ok=True)
+    config_path.write_text(json.dumps(config, indent=2))
+
+    total = count_chunks(args.manifest, args.chunk_size)
+    remaining = sum(1 for chunk in range(total) if not chunk_path(work_dir, chunk).exists())
+    logger.info(f"{total} chunks of {args.chunk_size} rows, {remaining} left to embed")
+    if not remaining:
+        return total
+
+    if args.workers <= 1:
+        embed_worker(0, {**config, 'workers': 1})
+    else:
+        context = multiprocessing.get_context('spawn')
+        processes = [
+            context.Process(target=_run_worker, args=(worker, config), name=f"embed-{worker}")
+            for worker in range(args.workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        failed = [p.name for p in processes if p.exitcode != 0]
+        if failed:
+            raise SystemExit(f"Workers failed: {', '.join(failed)} - rerun the same command to resume")
+
+    missing = [chunk for chunk in range(total) if not chunk_path(work_dir, chunk).exists()]
+    if missing:
+        raise SystemExit(f"{len(missing)} chunks missing after embedding (first: {missing[0]})")
+    return total
+
+
+def training_sample(work_dir: Path, total: int, size: int, seed: int) -> tuple:
+    """(vector count, dimension, random sample of up to size vectors) over all chunks"""
+    rng = np.random.default_rng(seed)
+    counts = []
+    for chunk in range(total):
+        with np.load(chunk_path(work_dir, chunk)) as data:
+            counts.append(len(data['rows']))
+    n = sum(counts)
+
+    picked = np.sort(rng.choice(n, min(size, n), replace=False))
+    sample, offset, dimension = [], 0, None
+    for chunk, count in enumerate(counts):
+        local = picked[(picked >= offset) & (picked < offset + count)] - offset
+        if count:
+            vectors, _ = read_chunk(chunk_path(work_dir, chunk))
+            dimension = vectors.shape[1]
+            sample.append(vectors[local])
+        offset += count
+
+    if dimension is None:
+        raise SystemExit("No images were embedded - nothing to index")
+    return n, dimension, np.vstack(sample)
+
+
+def write_exact_vectors(work_dir: Path, total: int, path: Path, keep: np.ndarray = None) -> int:
+    """
+    Stream every chunk into the float16 vector file used for exact re-ranking.
+
+    Args:
+        keep: Mask over all embedded rows of the vectors in the index
+            (default: all of them)
+    """
+    from retrieval.vector_store import normalized_f16
+
+    counts, dimension = [], None
+    for chunk in range(total):
+        with np.load(chunk_path(work_dir, chunk)) as data:
+            counts.append(len(data['rows']))
+            if len(data['rows']):
+                dimension = data['vectors'].shape[1]
+    if keep is None:
+        keep = np.ones(sum(counts), dtype=bool)
+
+    tmp_path = path.with_name(path.name + '.tmp')
+    vectors = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float16,
+                                        shape=(int(keep.sum()), dimension or 0))
+    row = offset = 0
+    for chunk, count in enumerate(counts):
+        chunk_keep = keep[row:row + count]
+        if chunk_keep.any():
+            chunk_vectors, _ = read_chunk(chunk_path(work_dir, chunk))
+            kept = int(chunk_keep.sum())
+            vectors[offset:offset + kept] = normalized_f16(chunk_vectors[chunk_keep])
+            offset += kept
+        row += count
+    vectors.flush()
+    del vectors
+    os.replace(tmp_path, path)
+    return offset
+
+
+def stage_index(args, work_dir: Path, total: int) -> dict:
+    """Merge the chunks into the final index, resuming from the last checkpoint"""
+    import faiss
+    from retrieval.faiss_index import PortugalImageIndex
+    from retrieval.index_factory import choose_index, trained_index, pca_report, search_parameters
+    from retrieval.metadata_store import ColumnarMetadata, concat_metadata
+    from retrieval.vector_store import vectors_path
+    from retrieval.dedup import DuplicateCollapser
+
+    progress_path = work_dir / PROGRESS_FILE
+    progress = json.loads(progress_path.read_text()) if progress_path.exists() else None
+
+    if progress and (work_dir / PARTIAL_INDEX).exists():
+        spec = progress['spec']
+        index = faiss.read_index(str(work_dir / PARTIAL_INDEX))
+        logger.info(f"Resuming index build at chunk {progress['chunks_added']} ({index.ntotal} vectors)")
+    else:
+        n, d, sample = training_sample(work_dir, total, args.train_size, args.seed)
+        spec = choose_index(n, d, memory_budget_mb=args.memory_budget_mb,
+                            target_recall=args.target_recall, index_type=args.index_type,
+                            pca_dim=args.pca_dim, whiten=args.whiten)
+        if (work_dir / TRAINED_INDEX).exists() and progress and progress.get('spec') == spec:
+            index = faiss.read_index(str(work_dir / TRAINED_INDEX))
+        else:
+            index = trained_index(spec, sample)
+            faiss.write_index(index, str(work_dir / TRAINED_INDEX))
+        progress = {'spec': spec, 'chunks_added': 0, 'ntotal': 0, 'dedup_state': None}
+        progress_path.write_text(json.dumps(progress, indent=2))
+
+    # Near-duplicate candidates are looked up in the index built so far and
+    # confirmed against the kept vectors on disk; the collapser state is
+    # checkpointed with the partial index
+    collapser = None
+    if progress.get('dedup_state'):
+        collapser = DuplicateCollapser.load(work_dir / progress['dedup_state'],
+                                            vectors_file=work_dir / DEDUP_VECTORS)
+    elif args.dedup_threshold and not progress['chunks_added']:
+        collapser = DuplicateCollapser(args.dedup_threshold, args.dedup_hash_distance,
+                                       vectors_file=work_dir / DEDUP_VECTORS)
+    search_params = search_parameters(index, **{name: spec['search_params'].get(name)
+                                                for name in ('nprobe', 'ef_search')})
+
+    def search_kept(vectors, k):
+        return index.search(vectors, k, params=search_params)
+
+    rows_seen = 0
+    next_id = 0
+    for chunk in range(total):
+        vectors, records = read_chunk(chunk_path(work_dir, chunk))
+        if collapser is not None and chunk >= progress['chunks_added']:
+            collapser.add_batch(vectors, records, search=search_kept)
+        keep = collapser.keep[rows_seen:rows_seen + len(vectors)] if collapser is not None else np.ones(len(vectors), bool)
+        rows_seen += len(vectors)
+
+        kept = int(keep.sum())
+        if chunk >= progress['chunks_added'] and kept:
+            index.add_with_ids(vectors[keep], np.arange(next_id, next_id + kept, dtype=np.int64))
+        next_id += kept
+
+        if chunk + 1 > progress['chunks_added'] and (chunk + 1) % args.checkpoint_every == 0:
+            previous_state = progress.get('dedup_state')
+            if collapser is not None:
+                progress['dedup_state'] = DEDUP_STATE.format(chunk + 1)
+                collapser.save(work_dir / progress['dedup_state'])
+            faiss.write_index(index, str(work_dir / (PARTIAL_INDEX + '.tmp')))
+            os.replace(work_dir / (PARTIAL_INDEX + '.tmp'), work_dir / PARTIAL_INDEX)
+            progress.update({'chunks_added': chunk + 1, 'ntotal': int(index.ntotal)})
+            progress_path.write_text(json.dumps(progress, indent=2))
+            if previous_state and previous_state != progress['dedup_state']:
+                (work_dir / previous_state).unlink(missing_ok=True)
+            logger.info(f"Checkpoint: {chunk + 1}/{total} chunks, {index.ntotal} vectors")
+
+    # Metadata of the kept vectors; a group's record is final only once every
+    # chunk has been compared, so this is a second pass
+    metadata_parts = []
+    rows_seen = kept_id = 0
+    for chunk in range(total):
+        with np.load(chunk_path(work_dir, chunk)) as data:
+            records = json.loads(str(data['metadata']))
+        if collapser is not None:
+            keep = collapser.keep[rows_seen:rows_seen + len(records)]
+            records = [collapser.merged(record, kept_id + i)
+                       for i, record in enumerate(r for r, k in zip(records, keep) if k)]
+            rows_seen += len(keep)
+            kept_id += len(records)
+        if records:
+            metadata_parts.append(ColumnarMetadata.from_records(records))
+
+    image_index = PortugalImageIndex()
+    image_index.index = index
+    image_index.dimension = index.d
+    image_index.spec = {**spec, 'n': int(index.ntotal)}
+    if spec.get('pca_dim'):
+        image_index.spec['pca'] = pca_report(index)
+    image_index.metadata = concat_metadata(metadata_parts) if metadata_parts else ColumnarMetadata.from_records([])
+
+    Path(args.output_index).parent.mkdir(parents=True, exist_ok=True)
+    metadata_path = Path(args.output_meta)
+    image_index.save(str(args.output_index), str(metadata_path if args.legacy_json else
+                                                 metadata_path.with_suffix('.cols')),
+                     legacy_json=args.legacy_json)
+
+    # Full-precision copies let a compressed index re-rank its candidates exactly
+    exact_vectors = (spec['type'] != 'flat' or bool(spec.get('pca_dim')) if args.exact_vectors == 'auto'
+                     else args.exact_vectors == '1')
+    if exact_vectors:
+        written = write_exact_vectors(work_dir, total, vectors_path(args.output_index),
+                                      keep=collapser.keep if collapser is not None else None)
+        logger.info(f"Wrote {written} exact vectors to {vectors_path(args.output_index)}")
+
+    for name in (PARTIAL_INDEX, PROGRESS_FILE, TRAINED_INDEX, progress.get('dedup_state'), DEDUP_VECTORS):
+        if name:
+            (work_dir / name).unlink(missing_ok=True)
+
+    return {
+        'index': str(args.output_index),
+        'metadata': str(metadata_path if args.legacy_json else metadata_path.with_suffix('.cols')),
+        'vectors': int(index.ntotal),
+        'type': spec['type'],
+        'factory': spec['factory'],
+        'search_params': spec['search_params'],
+        'pca': image_index.spec.get('pca'),
+        'exact_vectors': str(vectors_path(args.output_index)) if exact_vectors else None,
+        'dedup': collapser.stats if collapser is not None else None
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--manifest', required=True, help='CSV or JSONL with image_path/image_url, lat, lon')
+    parser.add_argument('--image-root', default=None, help='Base for relative image paths (default: manifest dir)')
+    parser.add_argument('--work-dir', default=str(DATA_DIR / 'indexes' / 'build'),
+                        help='Chunks and checkpoints; rerun with the same dir to resume')
+    parser.add_argument('--output-index', default=str(DATA_DIR / 'indexes' / 'portugal.faiss'))
+    parser.add_argument('--output-meta', default=str(DATA_DIR / 'indexes' / 'portugal_meta.json'))
+    parser.add_argument('--legacy-json', action='store_true',
+                        help='Also write the metadata as a JSON list (columnar store is always written)')
+    parser.add_argument('--weights', default=None, help='Fine-tuned PortugalEmbedder weights')
+
+    group = parser.add_argument_group('embedding')
+    group.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 4),
+                       help='Embedding processes (CPU cores are split between them)')
+    group.add_argument('--chunk-size', type=int, default=4096, help='Manifest rows per checkpointed chunk')
+    group.add_argument('--batch-size', type=int, default=32, help='Images per forward pass')
+    group.add_argument('--decode-threads', type=int, default=4, help='Download/decode threads per worker')
+    group.add_argument('--bf16', default='0', choices=['auto', '1', '0'], help='bf16 autocast')
+    group.add_argument('--cache-dir', default=None, help='Embedding cache shared with the service')
+    group.add_argument('--cache-mb', type=float, default=256)
+    group.add_argument('--phash', action='store_true',
+                       help='Store a perceptual hash of local images to confirm near-duplicates')
+
+    group = parser.add_argument_group('index')
+    group.add_argument('--index-type', default=None,
+                       choices=['flat', 'hnsw', 'ivf_fp16', 'ivf_sq8', 'ivf_pq'],
+                       help='Force an index type (default: chosen from size, budget and recall)')
+    group.add_argument('--memory-budget-mb', type=float, default=None, help='RAM the index may use')
+    group.add_argument('--target-recall', type=float, default=0.95)
+    group.add_argument('--pca-dim', type=int, default=None,
+                       help='Reduce vectors to this many principal components (e.g. 256)')
+    group.add_argument('--whiten', action='store_true', help='Whiten the principal components')
+    group.add_argument('--exact-vectors', default='auto', choices=['auto', '1', '0'],
+                       help='Write float16 vectors for exact re-ranking (auto: for compressed indexes)')
+    group.add_argument('--dedup-threshold', type=float, default=None,
+                       help='Collapse photos whose embeddings are at least this similar (e.g. 0.97)')
+    group.add_argument('--dedup-hash-distance', type=int, default=10,
+                       help='Max perceptual hash distance (of 64 bits) for hashed near-duplicates')
+    group.add_argument('--train-size', type=int, default=100_000, help='Vectors sampled for training')
+    group.add_argument('--checkpoint-every', type=int, default=16, help='Chunks added between checkpoints')
+    group.add_argument('--seed', type=int, default=0)
+    return parser
+
+
+def main(args) -> int:
+    work_dir = Path(args.work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    started = time.time()
+    total = stage_embed(args, work_dir)
+    embedded = time.time()
+    report = stage_index(args, work_dir, total)
+    report.update({
+        'chunks': total,
+        'embed_seconds': round(embedded - started, 1),
+        'index_seconds': round(time.time() - embedded, 1)
+    })
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(build_parser().parse_args()))
@@ -0,0 +1,95 @@
+"""
+Portugal GPS grid
+Regular grid of points over mainland Portugal, Madeira and the Azores
+"""
+
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Try to import GIS libraries, allow graceful fallback
+try:
+    import geopandas as gpd
+    from shapely import contains_xy
+    GIS_AVAILABLE = True
+except ImportError:
+    GIS_AVAILABLE = False
+
+METERS_PER_DEGREE_LAT = 111_320.0
+
+# Bounding boxes as (lat_min, lat_max, lon_min, lon_max)
+PORTUGAL_REGIONS = {
+    'mainland': (36.95, 42.16, -9.53, -6.18),
+    'madeira': (32.38, 33.13, -17.28, -16.25),
+    'azores': (36.91, 39.74, -31.30, -24.76)
+}
+
+
+def region_grid(bounds: tuple, spacing_m: float) -> np.ndarray:
+    """
+    Points spaced roughly spacing_m apart inside a bounding box.
+
+    Longitude steps widen with latitude so spacing stays metric.
+
+    Returns:
+        float64 array of shape (n, 2) with (lat, lon) rows
+    """
+    lat_min, lat_max, lon_min, lon_max = bounds
+    lat_step = spacing_m / METERS_PER_DEGREE_LAT
+
+    rows = []
+    for lat in np.arange(lat_min, lat_max + lat_step / 2, lat_step):
+        lon_step = spacing_m / (METERS_PER_DEGREE_LAT * np.cos(np.radians(lat)))
+        lons = np.arange(lon_min, lon_max + lon_step / 2, lon_step)
+        rows.append(np.column_stack([np.full(len(lons), lat), lons]))
+
+    return np.vstack(rows) if rows else np.empty((0, 2))
+
+
+def load_land_mask(path: str):
+    """Union of the land polygons in a vector file (GeoJSON, shapefile, ...)"""
+    if not GIS_AVAILABLE:
+        raise RuntimeError("GIS libraries not available - cannot apply a land mask")
+
+    land = gpd.read_file(path).to_crs('EPSG:4326')
+    return land.geometry.union_all() if hasattr(land.geometry, 'union_all') else land.unary_union
+
+
+def portugal_grid(spacing_m: float = 250, regions: list = None, land_path: str = None,
+                  allow_unmasked: bool = False) -> np.ndarray:
+    """
+    GPS grid over Portugal.
+
+    Args:
+        spacing_m: Distance between neighbouring points in meters
+        regions: Region names from PORTUGAL_REGIONS (all by default)
+        land_path: Land polygon file; points outside it are dropped
+        allow_unmasked: Build without land_path, keeping every point of the
+            bounding boxes - mostly sea around the islands, plus the Spanish
+            side of the border - which then competes for coarse probability
+
+    Returns:
+        float32 array of shape (n, 2) with (lat, lon) rows
+    """
+    regions = regions or list(PORTUGAL_REGIONS)
+    unknown = [name for name in regions if name not in PORTUGAL_REGIONS]
+    if unknown:
+        raise ValueError(f"Unknown regions: {', '.join(unknown)}")
+
+    if not land_path and not allow_unmasked:
+        raise ValueError("A land mask is required to keep sea and Spanish points out of the grid "
+                         "(pass allow_unmasked=True to build without one)")
+    land = load_land_mask(land_path) if land_path else None
+    if land is None:
+        logger.warning("No land mask given - grid covers whole bounding boxes")
+
+    grids = []
+    for name in regions:
+        points = region_grid(PORTUGAL_REGIONS[name], spacing_m)
+        if land is not None:
+            points = points[contains_xy(land, points[:, 1], points[:, 0])]
+        logger.info(f"{name}: {len(points)} grid points at {spacing_m:g} m")
+        grids.append(points)
+
+    return np.vstack(grids).astype(np.float32)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+ProprScout Geolocation index server
+Serves one retrieval shard over HTTP so the geolocation app can fan queries
+out to several processes or machines (GEO_INDEX_SERVERS) and merge their
+top-k, instead of holding the whole index in one process
+
+  GET  /health  vector count, index type and location bounds of the shard
+  POST /search  {"queries": {"data": base64 float32, "shape": [n, d]},
+                 "top_k", "nprobe", "ef_search", "rerank", "geo_filters"}
+
+Examples (three shards of a ShardedImageIndex on one box):
+  python index_server.py --shard-dir data/indexes/shards --shard grid_38.00_-10.00 --port 8101 &
+  python index_server.py --shard-dir data/indexes/shards --shard grid_38.00_-9.00 --port 8102 &
+  python index_server.py --index other.faiss --meta other_meta.cols --port 8103 &
+  GEO_INDEX_SERVERS=http://127.0.0.1:8101,http://127.0.0.1:8102,http://127.0.0.1:8103 python app.py
+"""
+
+import sys
+import json
+import logging
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+
+# Add this directory to path for imports (same layout as app.py)
+sys.path.insert(0, str(Path(__file__).parent))
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('index_server')
+
+# Largest request body accepted (a few thousand 768-dim queries)
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+
+def shard_health(name: str, index) -> dict:
+    """What clients need to route queries: size, type and location bounds"""
+    metadata = index.metadata
+    lat = np.asarray(metadata.lat, dtype=np.float64)
+    lon = np.asarray(metadata.lon, dtype=np.float64)
+    located = np.isfinite(lat) & np.isfinite(lon)
+    return {
+        'shard': name,
+        'vectors': index.ntotal if index.is_available else 0,
+        'type': index.spec.get('type'),
+        'dimension': int(index.dimension),
+        'bounds': ([float(lat[located].min()), float(lat[located].max()),
+                    float(lon[located].min()), float(lon[located].max())] if located.any() else None)
+    }
+
+
+class IndexRequestHandler(BaseHTTPRequestHandler):
+    """Requests against the server's index; threads share one loaded index"""
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/health':
+            self._send_json(404, {'error': 'Not found'})
+            return
+        self._send_json(200, self.server.health)
+
+    def do_POST(self):
+        from retrieval.remote_index import decode_queries, decode_filter
+
+        if self.path != '/search':
+            self._send_json(404, {'error': 'Not found'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            if length < 0:
+                raise ValueError(f"Content-Length {length}")
+            if length > MAX_BODY_BYTES:
+                self._send_json(413, {'error': f'Request body over {MAX_BODY_BYTES} bytes'})
+                return
+            request = json.loads(self.rfile.read(length))
+            queries = decode_queries(request['queries'])
+            dimension = self.server.health['dimension']
+            if queries.ndim != 2 or queries.shape[1] != dimension:
+                raise ValueError(f"queries of shape {list(queries.shape)} for a {dimension}-dimensional index")
+            filters = [decode_filter(f) for f in request.get('geo_filters') or [None] * len(queries)]
+            if len(filters) != len(queries):
+                raise ValueError(f"{len(filters)} geo filters for {len(queries)} queries")
+            top_k = int(request.get('top_k') or 20)
+        except (KeyError, TypeError, ValueError) as e:
+            self._send_json(400, {'error': f'Invalid search request: {e}'})
+            return
+
+        try:
+            results = self.server.index.search_many(
+                queries, top_k=top_k, nprobe=request.get('nprobe'),
+                ef_search=request.get('ef_search'), geo_filter=filters, rerank=request.get('rerank'))
+        except Exception as e:
+            logger.exception("Search failed")
+            self._send_json(500, {'error': str(e)})
+            return
+
+        self._send_json(200, {
+            'shard': self.server.health['shard'],
+            'results': [{'ids': [int(i) for i in hits.ids], 'hits': hits.to_dicts()} if len(hits)
+                        else {'ids': [], 'hits': []} for hits in results]
+        })
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def load_index(args):
+    """(shard name, PortugalImageIndex) from the command line"""
+    from retrieval.faiss_index import PortugalImageIndex
+
+    if args.shard_dir:
+        if not args.shard:
+            raise SystemExit("--shard-dir needs --shard")
+        shard_dir = Path(args.shard_dir) / args.shard
+        index_path, meta_path = shard_dir / 'index.faiss', shard_dir / 'meta.cols'
+        name = args.name or args.shard
+    elif args.index:
+        index_path, meta_path = Path(args.index), Path(args.meta) if args.meta else None
+        name = args.name or index_path.stem
+    else:
+        raise SystemExit("Give --index (and --meta) or --shard-dir and --shard")
+
+    if not index_path.exists():
+        raise SystemExit(f"No index at {index_path}")
+    index = PortugalImageIndex(str(index_path), str(meta_path) if meta_path else None,
+                               mmap=args.mmap, rerank=args.rerank)
+    return name, index
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    group = parser.add_argument_group('index')
+    group.add_argument('--index', default=None, help='FAISS index file')
+    group.add_argument('--meta', default=None, help='Metadata (.json or columnar .cols)')
+    group.add_argument('--shard-dir', default=None, help='ShardedImageIndex directory')
+    group.add_argument('--shard', default=None, help='Shard name within --shard-dir')
+    group.add_argument('--name', default=None, help='Shard name reported to clients')
+    group.add_argument('--mmap', default='1', choices=['1', '0'], help='Memory-map the index read-only')
+    group.add_argument('--rerank', type=int, default=200, help='Candidates rescored exactly (0: off)')
+
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=8101)
+    return parser
+
+
+def main(args) -> int:
+    args.mmap = args.mmap == '1'
+    name, index = load_index(args)
+
+    server = ThreadingHTTPServer((args.host, args.port), IndexRequestHandler)
+    server.daemon_threads = True
+    server.index = index
+    server.health = shard_health(name, index)
+    logger.info(f"Serving shard {name} ({server.health['vectors']} vectors) on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(build_parser().parse_args()))
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+ProprScout Geolocation model tools
+Offline commands for preparing and validating the CLIP vision tower
+"""
+
+import sys
+import json
+import random
+import logging
+import argparse
+from pathlib import Path
+
+# Add this directory to path for imports (same layout as app.py)
+sys.path.insert(0, str(Path(__file__).parent))
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('model_tools')
+
+DATA_DIR = Path(__file__).parent / 'data'
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.webp'}
+
+
+def sample_images(image_dir: str, sample: int, seed: int = 0) -> list:
+    """Decode a reproducible random sample of images from a directory tree"""
+    from models.image_io import load_image
+
+    paths = sorted(p for p in Path(image_dir).rglob('*') if p.suffix.lower() in IMAGE_SUFFIXES)
+    if not paths:
+        raise SystemExit(f"No images found under {image_dir}")
+
+    random.Random(seed).shuffle(paths)
+    images = []
+    for path in paths:
+        if len(images) >= sample:
+            break
+        try:
+            images.append(load_image(path))
+        except Exception as e:
+            logger.warning(f"Skipping {path}: {e}")
+
+    logger.info(f"Loaded {len(images)} sample images from {image_dir}")
+    return images
+
+
+def cmd_quantize(args):
+    """Build and persist the int8 vision tower"""
+    from models.backbone import configure_backbones, get_backbone
+
+    configure_backbones(quantize=args.mode, quantized_dir=args.output_dir)
+    backbone, head = get_backbone(args.arch, args.pretrained, 'cpu', weights_path=args.weights)
+    print(json.dumps({'fingerprint': backbone.fingerprint, 'head': head,
+                      'output_dir': str(args.output_dir)}, indent=2))
+
+
+def cmd_check_quantization(args):
+    """Report embedding drift of the int8 tower against fp32 on sample images"""
+    import torch
+    from models.backbone import ClipBackbone, configure_backbones, get_backbone
+    from models.quantization import check_quantization
+
+    images = sample_images(args.images, args.sample, seed=args.seed)
+
+    configure_backbones(quantize=None)
+    reference, head = get_backbone(args.arch, args.pretrained, 'cpu', weights_path=args.weights)
+    state_dict = torch.load(args.weights, map_location='cpu') if args.weights else None
+    quantized = ClipBackbone(args.arch, args.pretrained, 'cpu', state_dict=state_dict,
+                             fingerprint=reference.fingerprint,
+                             quantize=args.mode, quantized_dir=args.output_dir)
+    if head != 'base':
+        quantized.add_head(head, reference.heads[head])
+
+    report = check_quantization(reference, quantized, images, head=head, top_k=args.top_k)
+    report['passed'] = (report['cosine_min'] >= args.min_cosine and
+                        (report['top_k_overlap_mean'] is None or
+                         report['top_k_overlap_mean'] >= args.min_overlap))
+    print(json.dumps(report, indent=2))
+    return 0 if report['passed'] else 1
+
+
+def _eager_backbone(args):
+    """The eager (optionally quantized) backbone an export is taken from"""
+    from models.backbone import configure_backbones, get_backbone
+
+    configure_backbones(quantize=getattr(args, 'quantize', None),
+                        quantized_dir=getattr(args, 'quantized_dir', None), backend='eager')
+    return get_backbone(args.arch, args.pretrained, 'cpu', weights_path=args.weights)
+
+
+def cmd_export(args):
+    """Export the vision tower for the TorchScript or ONNX Runtime backend"""
+    from models.inference_backends import export_backend, exported_model_path
+
+    if args.quantize and args.backend == 'onnx':
+        raise SystemExit("Dynamically quantized towers cannot be exported to ONNX; "
+                         "use --backend torchscript or drop --quantize")
+
+    backbone, head = _eager_backbone(args)
+    path = exported_model_path(args.output_dir, backbone.fingerprint, args.backend)
+    export_backend(backbone.trunk, args.backend, path, image_size=backbone.trunk.image_size[0])
+    print(json.dumps({'fingerprint': backbone.fingerprint, 'head': head,
+                      'backend': args.backend, 'path': str(path)}, indent=2))
+
+
+def cmd_parity(args):
+    """Check an exported backend against eager PyTorch on the same inputs"""
+    import torch
+    from models.inference_backends import (
+        EagerBackend, TorchScriptBackend, OnnxRuntimeBackend, exported_model_path, check_parity
+    )
+
+    backbone, _ = _eager_backbone(args)
+    path = exported_model_path(args.output_dir, backbone.fingerprint, args.backend)
+    if not path.exists():
+        raise SystemExit(f"No {args.backend} export at {path} (run the export command first)")
+
+    if args.images:
+        images = sample_images(args.images, args.sample, seed=args.seed)
+        pixel_values = torch.stack([backbone.preprocess(image) for image in images])
+    else:
+        size = backbone.trunk.image_size[0]
+        pixel_values = torch.randn(args.sample, 3, size, size,
+                                   generator=torch.Generator().manual_seed(args.seed))
+
+    if args.backend == 'torchscript':
+        candidate = TorchScriptBackend(path)
+    else:
+        candidate = OnnxRuntimeBackend(path)
+
+    report = check_parity(EagerBackend(backbone.trunk), candidate, pixel_values)
+    report.update({'backend': args.backend, 'path': str(path)})
+    report['passed'] = (report['cosine_min'] >= args.min_cosine and
+                        report['max_abs_diff'] <= args.max_abs_diff)
+    print(json.dumps(report, indent=2))
+    return 0 if report['passed'] else 1
+
+
+def cmd_build_gallery(args):
+    """Encode a Portugal-only GPS grid into a memory-mappable location gallery"""
+    from gis.portugal_grid import portugal_grid
+    from models.coarse_locator import geoclip_without_clip
+    from models.location_gallery import build_location_gallery
+
+    regions = [name.strip() for name in args.regions.split(',') if name.strip()]
+    if not args.land and not args.no_land_mask:
+        raise SystemExit("Give --land with a land polygon file (or --no-land-mask to keep sea points)")
+    coords = portugal_grid(args.spacing_m, regions=regions, land_path=args.land,
+                           allow_unmasked=args.no_land_mask)
+
+    # Only the location encoder is needed
+    model = geoclip_without_clip()
+
+    info = build_location_gallery(
+        model.location_encoder, coords, args.output_dir, batch_size=args.batch_size,
+        info={'spacing_m': args.spacing_m, 'regions': regions, 'land_mask': args.land}
+    )
+    print(json.dumps(info, indent=2))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--arch', default='ViT-L-14', help='OpenCLIP architecture')
+    parser.add_argument('--pretrained', default='openai', help='OpenCLIP pretrained tag')
+    parser.add_argument('--weights', default=None, help='Fine-tuned PortugalEmbedder weights')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('quantize', help='Quantize the vision tower and persist it')
+    p.add_argument('--mode', default='int8', choices=['int8'])
+    p.add_argument('--output-dir', default=str(DATA_DIR / 'models'))
+    p.set_defaults(func=cmd_quantize)
+
+    p = sub.add_parser('check-quantization', help='Compare int8 against fp32 embeddings')
+    p.add_argument('--images', required=True, help='Directory of sample images')
+    p.add_argument('--sample', type=int, default=200, help='Number of images to compare')
+    p.add_argument('--top-k', type=int, default=10, help='Neighbours compared per query')
+    p.add_argument('--mode', default='int8', choices=['int8'])
+    p.add_argument('--output-dir', default=None, help='Reuse a persisted quantized tower')
+    p.add_argument('--min-cosine', type=float, default=0.98, help='Fail below this worst-case cosine')
+    p.add_argument('--min-overlap', type=float, default=0.8, help='Fail below this mean top-k overlap')
+    p.add_argument('--seed', type=int, default=0)
+    p.set_defaults(func=cmd_check_quantization)
+
+    p = sub.add_parser('export', help='Export the vision tower for a non-eager backend')
+    p.add_argument('--backend', default='onnx', choices=['torchscript', 'onnx'])
+    p.add_argument('--quantize', default=None, choices=['int8'], help='Export the int8 tower (torchscript only)')
+    p.add_argument('--quantized-dir', default=None, help='Reuse a persisted quantized tower')
+    p.add_argument('--output-dir', default=str(DATA_DIR / 'models'))
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser('parity', help='Compare an exported backend against eager PyTorch')
+    p.add_argument('--backend', default='onnx', choices=['torchscript', 'onnx'])
+    p.add_argument('--quantize', default=None, choices=['int8'])
+    p.add_argument('--quantized-dir', default=None)
+    p.add_argument('--output-dir', default=str(DATA_DIR / 'models'), help='Where the export lives')
+    p.add_argument('--images', default=None, help='Directory of sample images (random inputs if omitted)')
+    p.add_argument('--sample', type=int, default=16, help='Number of inputs to compare')
+    p.add_argument('--min-cosine', type=float, default=0.9999, help='Fail below this worst-case cosine')
+    p.add_argument('--max-abs-diff', type=float, default=1e-3, help='Fail above this absolute difference')
+    p.add_argument('--seed', type=int, default=0)
+    p.set_defaults(func=cmd_parity)
+
+    p = sub.add_parser('build-gallery', help='Build the Portugal-only coarse location gallery')
+    p.add_argument('--spacing-m', type=float, default=1000, help='Grid spacing in meters (e.g. 250)')
+    p.add_argument('--regions', default='mainland,madeira,azores', help='Comma-separated regions')
+    p.add_argument('--land', default=None, help='Land polygon file (GeoJSON, shapefile) to drop sea points')
+    p.add_argument('--no-land-mask', action='store_true',
+                   help='Build without --land, keeping sea and Spanish points')
+    p.add_argument('--batch-size', type=int, default=8192, help='Locations encoded per forward pass')
+    p.add_argument('--output-dir', default=str(DATA_DIR / 'models' / 'portugal_gallery'))
+    p.set_defaults(func=cmd_build_gallery)
+
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    sys.exit(args.func(args) or 0)
@@ -1,5 +1,8 @@
 """Geolocation Models"""
 from .coarse_locator import CoarseLocator
 from .portugal_embedder import PortugalEmbedder
+from .micro_batcher import MicroBatcher
+from .image_io import load_image
+from .backbone import get_backbone, configure_backbones
 
-__all__ = ['CoarseLocator', 'PortugalEmbedder']
+__all__ = ['CoarseLocator', 'PortugalEmbedder', 'MicroBatcher', 'load_image', 'get_backbone', 'configure_backbones']
@@ -0,0 +1,343 @@
+"""
+Shared CLIP vision backbone registry
+Lets every component that needs the same OpenCLIP vision tower reuse one copy
+"""
+
+import hashlib
+import threading
+import weakref
+import logging
+from pathlib import Path
+
+import torch
+import torch.nn.functional as F
+
+from .inference_backends import create_backend
+from .quantization import (
+    QUANTIZATION_MODES, quantize_trunk, quantized_model_path, save_quantized, load_quantized
+)
+
+logger = logging.getLogger(__name__)
+
+# (arch, pretrained, device, quantization, backend, bf16, channels-last[, weights fingerprint])
+#   -> ClipBackbone
+_registry = {}
+_registry_lock = threading.Lock()
+
+# Loading options set by configure_backbones()
+_options = {
+    'quantize': None,
+    'quantized_dir': None,
+    'backend': 'eager',
+    'export_dir': None,
+    'bf16_autocast': False,
+    'channels_last': False
+}
+
+
+def weights_fingerprint(weights_path: str) -> str:
+    """Content hash of a weights file, used to key shared models and caches"""
+    digest = hashlib.sha256()
+    with open(weights_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+class ClipBackbone:
+    """
+    One OpenCLIP vision tower plus named projection heads.
+
+    The tower runs without its output projection; projections are kept as
+    separate heads so that fine-tuned variants that only change the head
+    share the trunk, and a single forward pass can feed every head.
+    Pooled trunk features are remembered per decoded image object, so a
+    second component asking about the same image gets them for free.
+    """
+
+    def __init__(self, arch: str, pretrained: str, device: str, state_dict: dict = None,
+                 fingerprint: str = None, quantize: str = None, quantized_dir: str = None,
+                 backend: str = 'eager', export_dir: str = None, bf16_autocast: bool = False,
+                 channels_last: bool = False):
+        """
+        Args:
+            arch: OpenCLIP architecture name
+            pretrained: OpenCLIP pretrained tag
+            device: Torch device
+            state_dict: Optional fine-tuned CLIP weights applied on top
+            fingerprint: Identity of the weights (defaults to arch:pretrained)
+            quantize: None for fp32, or 'int8' for dynamic quantization (CPU only)
+            quantized_dir: Directory where quantized towers are persisted and reused
+            backend: Inference backend for the tower ('eager', 'torchscript', 'onnx')
+            export_dir: Directory holding exported towers for non-eager backends
+            bf16_autocast: Run the eager fp32 tower under CPU bf16 autocast
+            channels_last: Feed the eager tower channels-last pixel batches
+        """
+        import open_clip
+
+        self.arch = arch
+        self.pretrained = pretrained
+        self.device = device
+        self.fingerprint = fingerprint or f"{arch}:{pretrained}"
+
+        if quantize and str(device) != 'cpu':
+            logger.warning(f"{quantize} quantization is CPU-only - running fp32 on {device}")
+            quantize = None
+        if quantize and quantize not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode: {quantize}")
+        self.quantize = quantize
+
+        saved_path = None
+        if quantize and quantized_dir:
+            saved_path = quantized_model_path(quantized_dir, self.fingerprint, quantize)
+
+        if saved_path is not None and saved_path.exists():
+            # Persisted quantized tower: skip loading the fp32 weights entirely
+            model, _, self.preprocess = open_clip.create_model_and_transforms(arch, pretrained=None)
+            model.visual.proj = None
+            self.trunk, heads, self.checksums = load_quantized(saved_path, model.visual)
+            self.heads = {name: head.to(device) for name, head in heads.items()}
+        else:
+            model, _, self.preprocess = open_clip.create_model_and_transforms(arch, pretrained=pretrained)
+            if state_dict is not None:
+                model.visual.load_state_dict(_visual_state(state_dict), strict=False)
+
+            # Keep only the vision tower; the text tower is never used
+            self.trunk = model.visual
+            self.heads = {'base': self.trunk.proj.detach().clone().to(device)}
+            self.trunk.proj = None
+            self.checksums = _tensor_checksums(self.trunk.state_dict())
+
+            if quantize:
+                self.trunk = quantize_trunk(self.trunk)
+                if saved_path is not None:
+                    save_quantized(saved_path, self.trunk, self.heads, self.checksums)
+
+        del model
+        self.trunk.to(device)
+        self.trunk.eval()
+
+        if quantize:
+            self.fingerprint = f"{self.fingerprint}:{quantize}"
+
+        self.backend = create_backend(backend, self.trunk, self.fingerprint,
+                                      export_dir=export_dir, device=device)
+        if self.backend.name != 'eager':
+            # The exported graph carries its own weights
+            self.trunk = None
+
+        # Numeric format options only apply to the eager fp32 tower on CPU
+        eager_fp32_cpu = self.backend.name == 'eager' and not quantize and str(device) == 'cpu'
+        self.bf16_autocast = bool(bf16_autocast) and eager_fp32_cpu
+        self.channels_last = bool(channels_last) and self.backend.name == 'eager'
+        if self.channels_last:
+            self.trunk.to(memory_format=torch.channels_last)
+        if self.bf16_autocast:
+            # bf16 embeddings differ from fp32 ones, so caches keyed on the
+            # fingerprint must not mix them
+            self.fingerprint = f"{self.fingerprint}:bf16"
+
+        # id(image) -> (weakref to image, pooled features); PIL images are
+        # unhashable, so entries are keyed by identity and dropped when the
+        # image is garbage collected
+        self._features = {}
+
+    @property
+    def width(self) -> int:
+        """Dimension of pooled trunk features"""
+        return self.heads['base'].shape[0]
+
+    def add_head(self, name: str, projection: torch.Tensor):
+        """Register an extra projection head on top of the shared trunk"""
+        self.heads[name] = projection.detach().to(self.device, dtype=self.heads['base'].dtype)
+
+    def pooled(self, images: list) -> torch.Tensor:
+        """
+        Pooled trunk features for decoded images, one forward pass for all
+        images not seen before.
+
+        Args:
+            images: List of decoded RGB images
+
+        Returns:
+            Tensor of shape (n_images, width)
+        """
+        cached = [self._recall(image) for image in images]
+
+        missing = [i for i, features in enumerate(cached) if features is None]
+        if missing:
+            features = self.forward(torch.stack([self.preprocess(images[i]) for i in missing]))
+
+            for i, row in zip(missing, features):
+                cached[i] = row
+                self._remember(images[i], row)
+
+        return torch.stack(cached)
+
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        """Pooled trunk features for a batch of preprocessed images"""
+        batch = pixel_values.to(self.device)
+        if self.channels_last:
+            batch = batch.contiguous(memory_format=torch.channels_last)
+
+        with torch.autocast('cpu', dtype=torch.bfloat16, enabled=self.bf16_autocast):
+            features = self.backend(batch)
+        return features.float()
+
+    def _recall(self, image):
+        """Pooled features computed earlier for this exact image object"""
+        entry = self._features.get(id(image))
+        if entry is not None and entry[0]() is image:
+            return entry[1]
+        return None
+
+    def _remember(self, image, features: torch.Tensor):
+        """Keep pooled features for as long as the image object is alive"""
+        key = id(image)
+        features_by_id = self._features
+
+        def forget(ref):
+            entry = features_by_id.get(key)
+            if entry is not None and entry[0] is ref:
+                features_by_id.pop(key, None)
+
+        try:
+            features_by_id[key] = (weakref.ref(image, forget), features)
+        except TypeError:
+            # Object does not support weak references; nothing to share
+            pass
+
+    def encode(self, images: list, head: str = 'base', normalize: bool = True) -> torch.Tensor:
+        """
+        Image embeddings through one projection head.
+
+        Args:
+            images: List of decoded RGB images
+            head: Name of the projection head
+            normalize: L2-normalize the embeddings
+
+        Returns:
+            Tensor of shape (n_images, embedding_dim)
+        """
+        return self.project(self.pooled(images), head=head, normalize=normalize)
+
+    def project(self, pooled: torch.Tensor, head: str = 'base', normalize: bool = True) -> torch.Tensor:
+        """Embeddings from pooled trunk features through one projection head"""
+        embeddings = pooled @ self.heads[head]
+        return F.normalize(embeddings, p=2, dim=-1) if normalize else embeddings
+
+
+def _tensor_checksums(state: dict) -> dict:
+    """Per-tensor content hashes, so weights can be compared after quantization"""
+    return {
+        name: hashlib.blake2b(tensor.detach().cpu().contiguous().numpy().tobytes(),
+                              digest_size=8).hexdigest()
+        for name, tensor in state.items()
+        if isinstance(tensor, torch.Tensor) and tensor.dtype.is_floating_point
+    }
+
+
+def configure_backbones(quantize: str = None, quantized_dir: str = None,
+                        backend: str = 'eager', export_dir: str = None,
+                        bf16_autocast: bool = False, channels_last: bool = False):
+    """
+    Set how backbones are loaded from now on.
+
+    Args:
+        quantize: None for fp32, or 'int8' for dynamic int8 quantization
+        quantized_dir: Directory to persist quantized towers in and load them from
+        backend: Inference backend ('eager', 'torchscript' or 'onnx')
+        export_dir: Directory holding exported towers (see model_tools.py export)
+        bf16_autocast: Run fp32 eager towers under CPU bf16 autocast
+        channels_last: Use the channels-last memory format for eager towers
+    """
+    with _registry_lock:
+        _options['quantize'] = quantize or None
+        _options['quantized_dir'] = quantized_dir
+        _options['backend'] = backend or 'eager'
+        _options['export_dir'] = export_dir
+        _options['bf16_autocast'] = bool(bf16_autocast)
+        _options['channels_last'] = bool(channels_last)
+
+
+def _visual_state(state_dict: dict) -> dict:
+    """Vision-tower entries of a CLIP state dict, keyed without the 'visual.' prefix"""
+    prefixed = {k[len('visual.'):]: v for k, v in state_dict.items() if k.startswith('visual.')}
+    return prefixed or state_dict
+
+
+def get_backbone(arch: str = 'ViT-L-14', pretrained: str = 'openai', device: str = 'cpu',
+                 weights_path: str = None):
+    """
+    Get (or create) the shared backbone for an architecture and weights.
+
+    Fine-tuned weights that only change the output projection are attached
+    as an extra head on the shared base trunk; weights that change the
+    trunk itself get their own backbone.
+
+    Args:
+        arch: OpenCLIP architecture name
+        pretrained: OpenCLIP pretrained tag
+        device: Torch device
+        weights_path: Optional fine-tuned CLIP state dict
+
+    Returns:
+        (ClipBackbone, head name) tuple
+    """
+    with _registry_lock:
+        options = dict(_options)
+        key = (arch, pretrained, str(device), options['quantize'], options['backend'],
+               options['bf16_autocast'], options['channels_last'])
+
+        if key not in _registry:
+            logger.info(f"Loading shared backbone {arch} ({pretrained}) on {device} "
+                        f"[{options['backend']}{', ' + options['quantize'] if options['quantize'] else ''}]")
+            _registry[key] = ClipBackbone(arch, pretrained, device, **options)
+        backbone = _registry[key]
+
+        if not weights_path or not Path(weights_path).exists():
+            return backbone, 'base'
+
+        fingerprint = weights_fingerprint(weights_path)
+        if fingerprint in backbone.heads:
+            return backbone, fingerprint
+        if key + (fingerprint,) in _registry:
+            return _registry[key + (fingerprint,)], 'base'
+
+        state_dict = torch.load(weights_path, map_location='cpu')
+        visual = _visual_state(state_dict)
+        tuned_checksums = _tensor_checksums({k: v for k, v in visual.items() if k != 'proj'})
+        changed = [
+            name for name, checksum in tuned_checksums.items()
+            if backbone.checksums.get(name) != checksum
+        ]
+
+        if not changed:
+            if 'proj' not in visual:
+                logger.info(f"Fine-tuned weights {fingerprint} match the base model")
+                return backbone, 'base'
+            logger.info(f"Fine-tuned weights {fingerprint} only change the head - sharing trunk")
+            backbone.add_head(fingerprint, visual['proj'])
+            return backbone, fingerprint
+
+        logger.info(f"Fine-tuned weights {fingerprint} change {len(changed)} trunk tensors - "
+                    f"loading a separate backbone")
+        tuned = ClipBackbone(arch, pretrained, device, state_dict=state_dict,
+                             fingerprint=f"{arch}:{pretrained}:{fingerprint}", **options)
+        _registry[key + (fingerprint,)] = tuned
+        return tuned, 'base'
+
+
+def loaded_backbones() -> list:
+    """Backbones currently held in memory"""
+    with _registry_lock:
+        return [
+            {
+                'fingerprint': backbone.fingerprint,
+                'backend': backbone.backend.name,
+                'bf16_autocast': backbone.bf16_autocast,
+                'channels_last': backbone.channels_last,
+                'heads': sorted(backbone.heads)
+            }
+            for backbone in _registry.values()
+        ]
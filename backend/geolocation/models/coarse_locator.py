@@ -3,15 +3,96 @@ Coarse Locator using GeoCLIP
 Provides initial region-level prediction for any image
 """
 
+import sys
+import hashlib
+import warnings
 import torch
 import torch.nn.functional as F
-from PIL import Image
 import numpy as np
 from pathlib import Path
 import logging
 
+from .backbone import get_backbone
+from .image_io import load_image
+from .location_gallery import LocationGallery, module_fingerprint
+from .micro_batcher import MicroBatcher
+
 logger = logging.getLogger(__name__)
 
+# Gallery rows scored per matmul; bounds the logits held for a mapped gallery
+GALLERY_CHUNK = 65536
+
+# Probability is summed over gallery cells about this wide before ranking: a
+# dense grid spreads one place's probability over many neighbouring points,
+# so single-point probabilities would understate how sure the model is
+CELL_KM = 25.0
+
+# Highest-probability points kept per image to place each ranked cell
+POINT_POOL = 64
+
+KM_PER_DEGREE = 111.32
+
+
+def gallery_cells(coords: np.ndarray, cell_km: float = CELL_KM) -> tuple:
+    """
+    Group gallery points into cells roughly cell_km wide.
+
+    Returns:
+        (cell index per point, (n_cells, 2) mean (lat, lon) of each cell)
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    lat_step = cell_km / KM_PER_DEGREE
+    rows = np.floor(coords[:, 0] / lat_step)
+    # Longitude cells widen with latitude so cells stay about cell_km across
+    lon_step = lat_step / np.maximum(np.cos(np.radians((rows + 0.5) * lat_step)), 1e-3)
+    cols = np.floor(coords[:, 1] / lon_step)
+    _, cells = np.unique(np.column_stack([rows, cols]), axis=0, return_inverse=True)
+    cells = cells.reshape(-1)
+
+    counts = np.bincount(cells)
+    centers = np.column_stack([np.bincount(cells, weights=coords[:, 0]) / counts,
+                               np.bincount(cells, weights=coords[:, 1]) / counts])
+    return cells.astype(np.int64), centers
+
+
+class _SkippedPretrained:
+    """Stands in for a transformers loader whose weights would go unused"""
+
+    @staticmethod
+    def from_pretrained(*args, **kwargs):
+        return torch.nn.Module()
+
+
+def geoclip_without_clip():
+    """
+    GeoCLIP with its image MLP head, location encoder, GPS gallery and
+    weights, but without its private CLIP ViT-L/14.
+
+    geoclip's ImageEncoder always loads the Hugging Face CLIP model in its
+    constructor (GeoCLIP has no option to skip it), so the transformers
+    loaders it uses are stubbed while the model is built. Releases laid out
+    differently get a full GeoCLIP() with its CLIP dropped afterwards.
+    """
+    import geoclip
+    from geoclip import GeoCLIP
+
+    encoder_class = getattr(geoclip, 'ImageEncoder', None)
+    module = sys.modules.get(encoder_class.__module__) if encoder_class is not None else None
+    if module is None or not (hasattr(module, 'CLIPModel') and hasattr(module, 'AutoProcessor')):
+        logger.warning("Unrecognised geoclip layout - loading GeoCLIP with its own CLIP weights")
+        model = GeoCLIP()
+    else:
+        originals = module.CLIPModel, module.AutoProcessor
+        module.CLIPModel = module.AutoProcessor = _SkippedPretrained
+        try:
+            model = GeoCLIP()
+        finally:
+            module.CLIPModel, module.AutoProcessor = originals
+
+    model.image_encoder.CLIP = None
+    model.image_encoder.image_processor = None
+    return model
+
 
 class CoarseLocator:
     """
@@ -19,125 +100,363 @@ class CoarseLocator:
     Returns approximate lat/lon with confidence.
     """
 
-    def __init__(self, device: str = None):
+    def __init__(self, device: str = None, batch_window_ms: float = 0, max_batch_size: int = 16,
+                 share_backbone: bool = True, gallery_cache_dir: str = None,
+                 location_gallery: str = None):
+        """
+        Args:
+            device: Torch device (auto-detected if omitted)
+            batch_window_ms: If > 0, concurrent predict calls arriving within
+                this window are merged into one predict_many call
+            max_batch_size: Maximum images per merged call
+            share_backbone: Run the CLIP ViT-L-14 image tower from the shared
+                registry (see models.backbone) instead of a private copy
+            gallery_cache_dir: Directory to persist the encoded GPS gallery in
+                (float16 .npy), so later starts skip encoding it
+            location_gallery: Directory of a precomputed location gallery
+                (see model_tools.py build-gallery) scored instead of
+                GeoCLIP's worldwide GPS gallery
+        """
         self.device = device or ('cuda' if torch.cuda.is_available() else
                                   'mps' if torch.backends.mps.is_available() else 'cpu')
         self.model = None
-        self.preprocess = None
+        self.backbone = None
+        self.share_backbone = share_backbone
+        self.gallery_cache_dir = gallery_cache_dir
+        self.location_gallery = location_gallery
+        self.gallery_source = None
+        self._gallery_coords = None
+        self._gallery_features = None
+        self._gallery_cells = None
+        self._cell_centers = None
+        self._batcher = None
         self._load_model()
 
+        if batch_window_ms > 0 and (self.model is not None or self.backbone is not None):
+            self._batcher = MicroBatcher(
+                self.predict_many,
+                max_batch_size=max_batch_size,
+                max_wait_ms=batch_window_ms,
+                name='coarse_locator'
+            )
+
+    @property
+    def batching_stats(self) -> dict:
+        """Micro-batching metrics, or None when batching is disabled"""
+        return self._batcher.stats() if self._batcher else None
+
     def _load_model(self):
         """Load GeoCLIP model"""
         try:
             # Try official GeoCLIP package first
             from geoclip import GeoCLIP
-            self.model = GeoCLIP()
+
+            if self.share_backbone:
+                # GeoCLIP's image tower is OpenAI CLIP ViT-L/14, the same
+                # weights PortugalEmbedder uses: run it from the shared
+                # registry and never load GeoCLIP's private copy
+                self.model = geoclip_without_clip()
+                self.backbone, _ = get_backbone('ViT-L-14', 'openai', self.device)
+            else:
+                self.model = GeoCLIP()
+
             self.model.to(self.device)
             self.model.eval()
             self.use_geoclip = True
-            logger.info(f"GeoCLIP loaded on {self.device}")
+            self._load_gallery()
+            cells, self._cell_centers = gallery_cells(self._gallery_coords)
+            self._gallery_cells = torch.from_numpy(cells).to(self.device)
+            logger.info(f"GeoCLIP loaded on {self.device} (shared backbone: {self.share_backbone})")
         except ImportError:
             # Fallback to OpenCLIP with geo-trained weights
             logger.warning("GeoCLIP package not found, using OpenCLIP fallback")
             try:
-                import open_clip
-                self.model, _, self.preprocess = open_clip.create_model_and_transforms(
-                    'ViT-L-14', pretrained='openai'
-                )
-                self.model.to(self.device)
-                self.model.eval()
+                self.backbone, _ = get_backbone('ViT-L-14', 'openai', self.device)
                 self.use_geoclip = False
                 logger.info(f"OpenCLIP fallback loaded on {self.device}")
             except Exception as e:
                 logger.error(f"Failed to load any model: {e}")
-                self.model = None
+                self.backbone = None
                 self.use_geoclip = False
 
-    def predict(self, image_path: str) -> dict:
+    def _image_features(self, images: list) -> torch.Tensor:
+        """GeoCLIP image features (before normalization) for decoded images"""
+        image_encoder = self.model.image_encoder
+        if self.backbone is not None:
+            # CLIP image embedding from the shared tower, then GeoCLIP's head
+            return image_encoder.mlp(self.backbone.encode(images, normalize=False))
+
+        pixel_values = image_encoder.preprocess_image(images).to(self.device)
+        return image_encoder(pixel_values)
+
+    def _load_gallery(self):
+        """
+        Encode the GPS gallery once and keep the normalized location features.
+
+        GeoCLIP's own predict() re-encodes the whole gallery for every image;
+        the gallery and location encoder never change after loading, so the
+        features are computed (or read from the cache file) exactly once.
+        A precomputed location gallery, when configured, replaces it.
+        """
+        if self.location_gallery and self._load_location_gallery():
+            return
+
+        gps_gallery = self.model.gps_gallery.detach().cpu()
+        self._gallery_coords = gps_gallery.numpy().astype(np.float32)
+
+        cache_path = None
+        if self.gallery_cache_dir:
+            cache_path = Path(self.gallery_cache_dir) / f"geoclip_gallery_{self._gallery_fingerprint()}.f16.npy"
+            if cache_path.exists():
+                features = torch.from_numpy(np.load(cache_path).astype(np.float32))
+                self._gallery_features = features.to(self.device)
+                self.gallery_source = 'geoclip'
+                logger.info(f"Loaded encoded GPS gallery ({len(features)} locations) from {cache_path}")
+                return
+
+        with torch.no_grad():
+            features = self.model.location_encoder(gps_gallery.to(self.device))
+            self._gallery_features = F.normalize(features.float(), dim=1)
+        self.gallery_source = 'geoclip'
+        logger.info(f"Encoded GPS gallery ({len(gps_gallery)} locations)")
+
+        if cache_path is not None:
+            try:
+                cache_path.parent.mkdir(parents=True, exist_ok=True)
+                np.save(cache_path, self._gallery_features.cpu().numpy().astype(np.float16))
+                logger.info(f"Saved encoded GPS gallery to {cache_path}")
+            except OSError as e:
+                logger.warning(f"Could not cache encoded GPS gallery: {e}")
+
+    def _load_location_gallery(self) -> bool:
+        """Memory-map a precomputed location gallery; False if unusable"""
+        if not LocationGallery.exists(self.location_gallery):
+            logger.warning(f"No location gallery at {self.location_gallery} - using GeoCLIP's GPS gallery")
+            return False
+
+        try:
+            gallery = LocationGallery(self.location_gallery)
+        except Exception as e:
+            logger.error(f"Failed to load location gallery {self.location_gallery}: {e}")
+            return False
+
+        if gallery.encoder_fingerprint != module_fingerprint(self.model.location_encoder):
+            logger.warning(f"Location gallery {self.location_gallery} was built with other "
+                           f"location encoder weights - using GeoCLIP's GPS gallery")
+            return False
+
+        self._gallery_coords = gallery.coords
+        self._gallery_features = gallery.features
+        if self.device != 'cpu':
+            # Moved to the accelerator once rather than chunk by chunk per query
+            self._gallery_features = torch.from_numpy(np.ascontiguousarray(gallery.features)).to(self.device)
+        self.gallery_source = str(self.location_gallery)
+        logger.info(f"Memory-mapped location gallery ({len(gallery)} locations) from {self.location_gallery}")
+        return True
+
+    def _gallery_fingerprint(self) -> str:
+        """Hash of the gallery coordinates and location encoder weights"""
+        digest = hashlib.sha256(self.model.gps_gallery.detach().cpu().numpy().tobytes())
+        digest.update(module_fingerprint(self.model.location_encoder).encode())
+        return digest.hexdigest()[:16]
+
+    def _gallery_chunks(self):
+        """(offset, float32 features) chunks of the gallery on the model device"""
+        features = self._gallery_features
+        if isinstance(features, torch.Tensor):
+            yield 0, features
+            return
+
+        # float32 rows of the mapped file, scored in place (read only)
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', message='.*not writable.*')
+            for start in range(0, len(features), GALLERY_CHUNK):
+                yield start, torch.from_numpy(features[start:start + GALLERY_CHUNK])
+
+    def _geoclip_top_k(self, images: list, top_k: int = 5) -> list:
+        """
+        Top-k gallery cells for each decoded image, scored in one matmul per gallery chunk.
+
+        A cell's confidence is the softmax probability summed over its
+        points (see CELL_KM); it is placed at its most probable point, or at
+        the cell's centre when none of its points made the point pool.
+        """
+        image_features = F.normalize(self._image_features(images).float(), dim=1)
+        scale = self.model.logit_scale.exp().float()
+        n_cells = len(self._cell_centers)
+        pool = min(POINT_POOL, len(self._gallery_coords))
+
+        # Running point pool, per-cell log-mass and log-partition over the
+        # chunks, so the full probability matrix is never materialized
+        top_logits = top_indices = log_norm = None
+        cell_log_mass = torch.full((len(images), n_cells), -float('inf'), device=image_features.device)
+        for offset, chunk in self._gallery_chunks():
+            chunk = chunk.to(image_features.device)
+            logits = scale * (image_features @ chunk.t())
+            chunk_logits, chunk_indices = torch.topk(logits, min(pool, logits.shape[1]), dim=1)
+            chunk_norm = torch.logsumexp(logits, dim=1, keepdim=True)
+
+            chunk_max = logits.max(dim=1, keepdim=True).values
+            cells = self._gallery_cells[offset:offset + logits.shape[1]].to(logits.device)
+            mass = torch.zeros_like(cell_log_mass).index_add_(1, cells, (logits - chunk_max).exp())
+            cell_log_mass = torch.logaddexp(cell_log_mass, mass.log() + chunk_max)
+
+            if top_logits is None:
+                top_logits, top_indices, log_norm = chunk_logits, chunk_indices + offset, chunk_norm
+                continue
+
+            merged_logits = torch.cat([top_logits, chunk_logits], dim=1)
+            merged_indices = torch.cat([top_indices, chunk_indices + offset], dim=1)
+            top_logits, order = torch.topk(merged_logits, min(pool, merged_logits.shape[1]), dim=1)
+            top_indices = torch.gather(merged_indices, 1, order)
+            log_norm = torch.logaddexp(log_norm, chunk_norm)
+
+        cell_probs, ranked_cells = torch.topk((cell_log_mass - log_norm).exp(), min(top_k, n_cells), dim=1)
+        cell_probs, ranked_cells = cell_probs.cpu().numpy(), ranked_cells.cpu().numpy()
+        point_probs = (top_logits - log_norm).exp().cpu().numpy()
+        top_indices = top_indices.cpu().numpy()
+
+        coords = self._gallery_coords
+        point_cells = self._gallery_cells.cpu().numpy()
+        results = []
+        for cells, probs, indices, values in zip(ranked_cells, cell_probs, top_indices, point_probs):
+            pool_cells = point_cells[indices]
+            ranked = []
+            for cell, prob in zip(cells, probs):
+                # Pool points are sorted, so the first one in the cell is its peak
+                in_cell = np.flatnonzero(pool_cells == cell)
+                if len(in_cell):
+                    lat, lon = coords[indices[in_cell[0]]]
+                    peak = float(values[in_cell[0]])
+                else:
+                    lat, lon = self._cell_centers[cell]
+                    peak = None
+                ranked.append({'lat': float(lat), 'lon': float(lon), 'confidence': float(prob),
+                               'point_confidence': peak})
+            results.append(ranked)
+        return results
+
+    def predict(self, image) -> dict:
         """
         Predict coarse location from image.
 
         Args:
-            image_path: Path to image file
+            image: Image path, encoded bytes, or decoded image (see load_image)
 
         Returns:
             dict with lat, lon, confidence, region
         """
-        if self.model is None:
-            return {
-                'lat': 38.7223,  # Portugal center
-                'lon': -9.1393,
-                'confidence': 0.1,
-                'top_k': [],
-                'source': 'fallback_no_model',
-                'warning': 'No model loaded - returning Portugal center'
-            }
+        if self._batcher is not None:
+            return self._batcher.submit(image)
 
-        try:
-            image = Image.open(image_path).convert('RGB')
-
-            with torch.no_grad():
-                if self.use_geoclip and hasattr(self.model, 'predict'):
-                    # GeoCLIP native method
-                    top_pred = self.model.predict(image, top_k=5)
-
-                    return {
-                        'lat': float(top_pred[0]['lat']),
-                        'lon': float(top_pred[0]['lon']),
-                        'confidence': float(top_pred[0]['confidence']),
-                        'top_k': [
-                            {'lat': float(p['lat']), 'lon': float(p['lon']), 'confidence': float(p['confidence'])}
-                            for p in top_pred
-                        ],
+        return self.predict_batch([image])[0]
+
+    def predict_batch(self, images: list, top_k: int = 5) -> list:
+        """
+        Predict coarse locations for a batch of images with one forward pass
+        and one similarity matmul against the cached GPS gallery.
+
+        Args:
+            images: List of image paths, encoded bytes, or decoded images
+            top_k: Gallery locations returned per image
+
+        Returns:
+            List of prediction dicts, one per image, in input order
+        """
+        if self.model is None and self.backbone is None:
+            return [
+                {
+                    'lat': 38.7223,  # Portugal center
+                    'lon': -9.1393,
+                    'confidence': 0.1,
+                    'top_k': [],
+                    'source': 'fallback_no_model',
+                    'warning': 'No model loaded - returning Portugal center'
+                }
+                for _ in images
+            ]
+
+        if not self.use_geoclip:
+            # OpenCLIP fallback - return Portugal center as default
+            return [
+                {
+                    'lat': 38.7223,  # Portugal approximate center
+                    'lon': -9.1393,
+                    'confidence': 0.3,
+                    'top_k': [],
+                    'source': 'openclip_fallback',
+                    'warning': 'Using fallback model - predictions are approximate'
+                }
+                for _ in images
+            ]
+
+        results = [None] * len(images)
+        decoded = []
+        slots = []
+        for slot, image in enumerate(images):
+            try:
+                decoded.append(load_image(image))
+                slots.append(slot)
+            except Exception as e:
+                results[slot] = self._error_result(e)
+
+        if decoded:
+            try:
+                with torch.no_grad():
+                    # GeoCLIP: score the images against the GPS gallery
+                    batch_top_k = self._geoclip_top_k(decoded, top_k=top_k)
+
+                for slot, ranked in zip(slots, batch_top_k):
+                    results[slot] = {
+                        'lat': ranked[0]['lat'],
+                        'lon': ranked[0]['lon'],
+                        'confidence': ranked[0]['confidence'],
+                        'top_k': ranked,
                         'source': 'geoclip'
                     }
-                else:
-                    # OpenCLIP fallback - return Portugal center as default
-                    return {
-                        'lat': 38.7223,  # Portugal approximate center
-                        'lon': -9.1393,
-                        'confidence': 0.3,
-                        'top_k': [],
-                        'source': 'openclip_fallback',
-                        'warning': 'Using fallback model - predictions are approximate'
-                    }
+            except Exception as e:
+                for slot in slots:
+                    results[slot] = self._error_result(e)
 
-        except Exception as e:
-            logger.error(f"Coarse prediction failed: {e}")
-            return {
-                'lat': 38.7223,
-                'lon': -9.1393,
-                'confidence': 0.1,
-                'source': 'error_fallback',
-                'error': str(e)
-            }
-
-    def get_embedding(self, image_path: str) -> np.ndarray:
+        return results
+
+    def _error_result(self, error: Exception) -> dict:
+        logger.error(f"Coarse prediction failed: {error}")
+        return {
+            'lat': 38.7223,
+            'lon': -9.1393,
+            'confidence': 0.1,
+            'source': 'error_fallback',
+            'error': str(error)
+        }
+
+    def predict_many(self, images: list) -> list:
+        """
+        Predict coarse locations for several images.
+
+        Args:
+            images: List of image paths, encoded bytes, or decoded images
+
+        Returns:
+            List of prediction dicts, one per image, in input order
+        """
+        return self.predict_batch(images)
+
+    def get_embedding(self, image) -> np.ndarray:
         """
         Get image embedding for retrieval.
 
         Args:
-            image_path: Path to image file
+            image: Image path, encoded bytes, or decoded image
 
         Returns:
             numpy array of embeddings
         """
-        if self.model is None:
+        if self.backbone is None:
             return np.zeros(768)  # Return zero vector if no model
 
-        image = Image.open(image_path).convert('RGB')
+        image = load_image(image)
 
         with torch.no_grad():
-            if hasattr(self.model, 'encode_image'):
-                if self.preprocess:
-                    image_tensor = self.preprocess(image).unsqueeze(0).to(self.device)
-                else:
-                    # GeoCLIP handles preprocessing internally
-                    image_tensor = image
-
-                embedding = self.model.encode_image(image_tensor)
-                embedding = F.normalize(embedding, p=2, dim=-1)
-                return embedding.cpu().numpy().flatten()
-            else:
-                logger.warning("Model does not support encode_image")
-                return np.zeros(768)
+            embedding = self.backbone.encode([image])
+            return embedding.cpu().numpy().flatten()
@@ -0,0 +1,168 @@
+"""
+Persistent content-addressed embedding cache
+Embeddings keyed by image content hash, stored in memory-mapped float16
+arrays that every worker process shares through the page cache
+"""
+
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DIGEST_SIZE = 16
+INFO_FILE = 'cache.json'
+
+
+class EmbeddingCache:
+    """
+    Fixed-size, set-associative embedding cache on disk.
+
+    Each content digest maps to one bucket of `ways` slots; a full bucket
+    evicts its least recently used slot, so the cache never grows past the
+    size it was created with. The key index is the memory-mapped key array
+    itself, so entries written by one worker are visible to the others
+    without any in-process index.
+
+    A cache directory belongs to one model fingerprint; callers give each
+    model (backbone weights + head) its own directory.
+    """
+
+    def __init__(self, cache_dir: str, dim: int, max_mb: float = 256, ways: int = 8,
+                 fingerprint: str = None):
+        """
+        Args:
+            cache_dir: Directory holding the cache arrays
+            dim: Embedding dimension
+            max_mb: Size budget for the stored vectors
+            ways: Slots per bucket
+            fingerprint: Model fingerprint recorded with the cache
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.ways = ways
+        self.buckets = max(1, int(max_mb * 1024 * 1024) // (dim * 2 * ways))
+        self.fingerprint = fingerprint
+
+        self._lock = threading.Lock()
+        self._lock_file = open(self.cache_dir / '.lock', 'a+')
+        self._counters = {'hits': 0, 'misses': 0, 'puts': 0, 'evictions': 0}
+
+        with self._exclusive():
+            self._open()
+
+    def _open(self):
+        """
+        Map the cache arrays, recreating them if the layout changed.
+
+        New arrays are written beside the old ones and renamed over them, so
+        workers that still have the old files mapped keep reading complete
+        (if stale) arrays instead of a truncated file.
+        """
+        layout = {'dim': self.dim, 'ways': self.ways, 'buckets': self.buckets,
+                  'fingerprint': self.fingerprint}
+        info_path = self.cache_dir / INFO_FILE
+        existing = json.loads(info_path.read_text()) if info_path.exists() else None
+        shapes = {
+            'keys.npy': (np.uint8, (self.buckets, self.ways, DIGEST_SIZE)),
+            'stamps.npy': (np.float64, (self.buckets, self.ways)),
+            'vectors.f16.npy': (np.float16, (self.buckets, self.ways, self.dim))
+        }
+
+        if existing != layout:
+            if existing is not None:
+                logger.info(f"Embedding cache layout changed - resetting {self.cache_dir}")
+            for name, (dtype, shape) in shapes.items():
+                tmp_path = self.cache_dir / (name + '.tmp')
+                array = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=shape)
+                array.flush()
+                del array
+                os.replace(tmp_path, self.cache_dir / name)
+            tmp_path = self.cache_dir / (INFO_FILE + '.tmp')
+            tmp_path.write_text(json.dumps(layout, indent=2))
+            os.replace(tmp_path, info_path)
+
+        self._keys, self._stamps, self._vectors = (
+            np.lib.format.open_memmap(self.cache_dir / name, mode='r+') for name in shapes)
+
+    @contextmanager
+    def _exclusive(self):
+        """Lock held while writing: threads in this process and other workers"""
+        with self._lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _locate(self, digest: bytes) -> tuple:
+        """(bucket, slot or None) for a digest"""
+        key = np.frombuffer(digest[:DIGEST_SIZE], dtype=np.uint8)
+        bucket = int.from_bytes(digest[:8], 'little') % self.buckets
+        matches = np.flatnonzero((self._keys[bucket] == key).all(axis=1) & (self._stamps[bucket] > 0))
+        return bucket, (int(matches[0]) if len(matches) else None)
+
+    def get(self, digest: bytes):
+        """
+        Cached embedding for an image digest.
+
+        Returns:
+            float32 embedding, or None on a miss
+        """
+        bucket, slot = self._locate(digest)
+        if slot is None:
+            self._counters['misses'] += 1
+            return None
+
+        vector = self._vectors[bucket, slot].astype(np.float32)
+
+        # Writers clear the key before overwriting a vector, so a key that
+        # still matches after the copy means the copy is not torn
+        if bytes(self._keys[bucket, slot]) != digest[:DIGEST_SIZE]:
+            self._counters['misses'] += 1
+            return None
+
+        self._stamps[bucket, slot] = time.time()
+        self._counters['hits'] += 1
+        return vector
+
+    def put(self, digest: bytes, embedding: np.ndarray):
+        """Store an embedding, evicting the bucket's least recently used entry if full"""
+        with self._exclusive():
+            bucket, slot = self._locate(digest)
+            if slot is None:
+                slot = int(np.argmin(self._stamps[bucket]))
+                if self._stamps[bucket, slot] > 0:
+                    self._counters['evictions'] += 1
+
+            self._keys[bucket, slot] = 0
+            self._vectors[bucket, slot] = np.asarray(embedding, dtype=np.float16)
+            self._keys[bucket, slot] = np.frombuffer(digest[:DIGEST_SIZE], dtype=np.uint8)
+            self._stamps[bucket, slot] = time.time()
+            self._counters['puts'] += 1
+
+    def flush(self):
+        """Write dirty pages back to disk"""
+        for array in (self._keys, self._stamps, self._vectors):
+            array.flush()
+
+    def stats(self) -> dict:
+        """Hit/miss counters for this process and overall occupancy"""
+        lookups = self._counters['hits'] + self._counters['misses']
+        return {
+            **self._counters,
+            'hit_rate': self._counters['hits'] / lookups if lookups else None,
+            'entries': int((self._stamps > 0).sum()),
+            'capacity': self.buckets * self.ways,
+            'size_mb': round(self._vectors.nbytes / (1024 * 1024), 1),
+            'path': str(self.cache_dir),
+            'pid': os.getpid()
+        }
@@ -0,0 +1,124 @@
+"""
+CPU execution profiles
+Size the PyTorch and FAISS thread pools per worker process and pick the
+numeric format for inference, so several workers share the CPU cleanly
+"""
+
+import os
+import logging
+from pathlib import Path
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Try to import FAISS, but allow graceful fallback
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+# latency: every core a worker owns goes to one forward pass at a time
+# throughput: smaller per-op pools so concurrent requests (gunicorn threads,
+#   micro-batches) overlap without oversubscribing the worker's cores
+PROFILES = {
+    'latency': {'intra_op_share': 1.0, 'inter_op_threads': 1, 'faiss_share': 1.0, 'channels_last': False},
+    'throughput': {'intra_op_share': 0.5, 'inter_op_threads': 2, 'faiss_share': 0.0, 'channels_last': True}
+}
+
+
+def available_cores() -> int:
+    """CPU cores this process may use, honouring affinity masks and cgroup quotas"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+
+    # Containers (Docker, Render, HF Spaces) often cap CPU with a cgroup v2 quota
+    try:
+        quota, period = Path('/sys/fs/cgroup/cpu.max').read_text().split()
+        if quota != 'max':
+            cores = min(cores, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+
+    return max(1, cores)
+
+
+def cpu_supports_bf16() -> bool:
+    """Whether the CPU has native bf16 matmul support (AVX512-BF16 or AMX)"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def resolve_profile(name: str, workers: int = 1, cores: int = None, bf16: str = '0') -> dict:
+    """
+    Concrete thread counts and formats for a profile.
+
+    Args:
+        name: Profile name from PROFILES
+        workers: Worker processes sharing the machine (gunicorn -w)
+        cores: Available cores (detected if omitted)
+        bf16: '0' for fp32 (default), 'auto' to use bf16 autocast where supported, '1' to force
+
+    Returns:
+        dict describing the resolved profile
+    """
+    if name not in PROFILES:
+        raise ValueError(f"Unknown execution profile: {name} (choose from {', '.join(PROFILES)})")
+
+    profile = PROFILES[name]
+    cores = cores or available_cores()
+    workers = max(1, workers)
+    per_worker = max(1, cores // workers)
+
+    if bf16 == 'auto':
+        use_bf16 = cpu_supports_bf16()
+    else:
+        use_bf16 = bf16 == '1'
+
+    return {
+        'name': name,
+        'cores': cores,
+        'workers': workers,
+        'cores_per_worker': per_worker,
+        'torch_intra_op_threads': max(1, int(per_worker * profile['intra_op_share'])),
+        'torch_inter_op_threads': profile['inter_op_threads'],
+        'faiss_threads': max(1, int(per_worker * profile['faiss_share'])),
+        'bf16_autocast': use_bf16,
+        'channels_last': profile['channels_last']
+    }
+
+
+def apply_profile(name: str, workers: int = 1, bf16: str = '0') -> dict:
+    """
+    Resolve a profile and apply its thread settings to this process.
+
+    Call once per worker before any model runs. The numeric format settings
+    are returned for configure_backbones().
+
+    Returns:
+        The resolved profile (see resolve_profile)
+    """
+    profile = resolve_profile(name, workers=workers, bf16=bf16)
+
+    torch.set_num_threads(profile['torch_intra_op_threads'])
+    try:
+        torch.set_num_interop_threads(profile['torch_inter_op_threads'])
+    except RuntimeError:
+        # Only settable before the first inter-op parallel work in the process
+        profile['torch_inter_op_threads'] = torch.get_num_interop_threads()
+        logger.warning("Inter-op thread pool already started - keeping its size")
+
+    if FAISS_AVAILABLE:
+        faiss.omp_set_num_threads(profile['faiss_threads'])
+
+    logger.info(f"Execution profile '{name}': {profile['torch_intra_op_threads']} intra-op / "
+                f"{profile['torch_inter_op_threads']} inter-op torch threads, "
+                f"{profile['faiss_threads']} FAISS threads, bf16 autocast "
+                f"{'on' if profile['bf16_autocast'] else 'off'} "
+                f"({profile['cores']} cores, {profile['workers']} workers)")
+    return profile
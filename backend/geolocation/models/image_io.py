@@ -0,0 +1,104 @@
+"""
+Image decoding shared by every pipeline stage
+Decodes an image once into an RGB PIL image that all models can reuse
+"""
+
+from io import BytesIO
+from pathlib import Path
+import os
+import hashlib
+import logging
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Opt-in (GEO_DRAFT_DECODE=1): JPEGs are decoded at a reduced DCT scale that
+# still covers this size. CLIP resizes to 224px anyway, but the scaled DCT
+# output differs from a full decode plus resize, so embeddings of the same
+# photo would drift from those already in the index; full-resolution
+# decoding stays the default
+DRAFT_SIZE = (448, 448) if os.environ.get('GEO_DRAFT_DECODE', '0') == '1' else None
+
+# Key under which load_image records the content hash in image.info
+DIGEST_KEY = 'content_digest'
+
+
+def load_image(source, draft_size: tuple = DRAFT_SIZE, digest: bytes = None) -> Image.Image:
+    """
+    Decode an image source into an RGB PIL image.
+
+    Already-decoded RGB images are returned unchanged, so a caller can decode
+    once and hand the same object to every stage. Images decoded from encoded
+    data carry a hash of that data in image.info (see content_digest).
+
+    Args:
+        source: File path, raw encoded bytes, a binary file-like object,
+            a PIL image, or an (H, W, 3) uint8 array
+        draft_size: Minimum size for reduced-scale JPEG decoding (None for full
+            size; the default follows GEO_DRAFT_DECODE)
+        digest: content_digest of the source when the caller already has it
+
+    Returns:
+        RGB PIL image
+    """
+    if isinstance(source, Image.Image):
+        return source if source.mode == 'RGB' else source.convert('RGB')
+
+    if isinstance(source, np.ndarray):
+        return Image.fromarray(source.astype(np.uint8, copy=False)).convert('RGB')
+
+    data = read_bytes(source)
+    image = Image.open(BytesIO(data))
+    if draft_size and image.format == 'JPEG':
+        image.draft('RGB', draft_size)
+
+    image = image.convert('RGB')
+    image.info[DIGEST_KEY] = digest if digest is not None else _digest(data)
+    return image
+
+
+def read_bytes(source) -> bytes:
+    """Encoded bytes of a path, buffer or binary file-like object"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    if isinstance(source, (str, Path)):
+        return Path(source).read_bytes()
+    return source.read()
+
+
+def _digest(data) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def content_digest(source) -> bytes:
+    """
+    16-byte hash identifying an image's content.
+
+    Encoded sources are hashed as stored, so the same file reached by path,
+    upload or URL gets the same digest. Decoded images use the digest that
+    load_image recorded, or else a hash of their pixels.
+    """
+    if isinstance(source, Image.Image):
+        digest = source.info.get(DIGEST_KEY)
+        if digest is None:
+            digest = _digest(f"{source.mode}{source.size}".encode() + source.tobytes())
+            source.info[DIGEST_KEY] = digest
+        return digest
+
+    if isinstance(source, np.ndarray):
+        return _digest(f"{source.dtype}{source.shape}".encode() + np.ascontiguousarray(source).tobytes())
+
+    return _digest(read_bytes(source))
+
+
+def describe_source(source) -> str:
+    """Short human-readable label for logs and results"""
+    if isinstance(source, (str, Path)):
+        return str(source)
+    if isinstance(source, Image.Image):
+        return f"<image {source.width}x{source.height}>"
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return f"<{len(source)} bytes>"
+    return f"<{type(source).__name__}>"
@@ -0,0 +1,190 @@
+"""
+Inference backends for the CLIP vision tower
+Eager PyTorch, TorchScript and ONNX Runtime behind one call interface
+"""
+
+import logging
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('eager', 'torchscript', 'onnx')
+EXPORT_SUFFIXES = {'torchscript': '.ts.pt', 'onnx': '.onnx'}
+
+# Try to import ONNX Runtime, but allow graceful fallback
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+
+
+class EagerBackend:
+    """Runs the vision tower as a regular PyTorch module"""
+
+    name = 'eager'
+
+    def __init__(self, trunk: nn.Module):
+        self.trunk = trunk
+
+    def __call__(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            return self.trunk(pixel_values)
+
+
+class TorchScriptBackend:
+    """Runs a traced TorchScript export of the vision tower"""
+
+    name = 'torchscript'
+
+    def __init__(self, path: str, device: str = 'cpu'):
+        module = torch.jit.load(str(path), map_location=device)
+        module.eval()
+        try:
+            # Fold weights into the graph and fuse ops for CPU inference
+            module = torch.jit.optimize_for_inference(torch.jit.freeze(module))
+        except Exception as e:
+            logger.warning(f"TorchScript graph optimization skipped: {e}")
+        self.module = module
+
+    def __call__(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            return self.module(pixel_values)
+
+
+class OnnxRuntimeBackend:
+    """Runs an ONNX export of the vision tower with ONNX Runtime on CPU"""
+
+    name = 'onnx'
+
+    def __init__(self, path: str, num_threads: int = 0):
+        if not ONNXRUNTIME_AVAILABLE:
+            raise RuntimeError("onnxruntime is not installed")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+
+        self.session = ort.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        inputs = {self.input_name: pixel_values.detach().cpu().numpy().astype(np.float32)}
+        return torch.from_numpy(self.session.run(None, inputs)[0])
+
+
+def exported_model_path(export_dir: str, fingerprint: str, backend: str) -> Path:
+    """Where an exported vision tower for a backbone fingerprint lives"""
+    safe_name = fingerprint.replace(':', '_').replace('/', '_')
+    return Path(export_dir) / f"{safe_name}{EXPORT_SUFFIXES[backend]}"
+
+
+def _example_input(image_size: int, batch_size: int = 2) -> torch.Tensor:
+    return torch.randn(batch_size, 3, image_size, image_size)
+
+
+def export_torchscript(trunk: nn.Module, path: Path, image_size: int = 224):
+    """Trace the vision tower at a fixed image size and save it"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with torch.no_grad():
+        traced = torch.jit.trace(trunk.cpu().eval(), _example_input(image_size))
+    traced.save(str(path))
+    logger.info(f"Exported TorchScript vision tower to {path}")
+
+
+def export_onnx(trunk: nn.Module, path: Path, image_size: int = 224, opset: int = 17):
+    """Export the vision tower to ONNX with a dynamic batch dimension"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    kwargs = dict(
+        input_names=['pixel_values'],
+        output_names=['pooled'],
+        dynamic_axes={'pixel_values': {0: 'batch'}, 'pooled': {0: 'batch'}},
+        opset_version=opset
+    )
+    # Export with grad enabled: under no_grad, nn.MultiheadAttention takes a
+    # fused fast path that has no ONNX symbolic
+    try:
+        # Use the TorchScript-based exporter where torch defaults to dynamo
+        torch.onnx.export(trunk.cpu().eval(), _example_input(image_size), str(path),
+                          dynamo=False, **kwargs)
+    except TypeError:
+        torch.onnx.export(trunk.cpu().eval(), _example_input(image_size), str(path), **kwargs)
+    logger.info(f"Exported ONNX vision tower to {path}")
+
+
+def export_backend(trunk: nn.Module, backend: str, path: Path, image_size: int = 224):
+    """Export the vision tower for a non-eager backend"""
+    if backend == 'torchscript':
+        export_torchscript(trunk, path, image_size=image_size)
+    elif backend == 'onnx':
+        export_onnx(trunk, path, image_size=image_size)
+    else:
+        raise ValueError(f"Backend '{backend}' has nothing to export")
+
+
+def create_backend(backend: str, trunk: nn.Module, fingerprint: str, export_dir: str = None,
+                   device: str = 'cpu'):
+    """
+    Build the requested inference backend, falling back to eager PyTorch.
+
+    Args:
+        backend: 'eager', 'torchscript' or 'onnx'
+        trunk: The eager vision tower (used for the eager fallback)
+        fingerprint: Backbone fingerprint naming the exported file
+        export_dir: Directory holding exported models
+        device: Torch device
+
+    Returns:
+        A callable backend mapping pixel batches to pooled features
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+
+    if backend == 'eager':
+        return EagerBackend(trunk)
+
+    if str(device) != 'cpu':
+        logger.warning(f"{backend} backend is served on CPU only - using eager on {device}")
+        return EagerBackend(trunk)
+
+    path = exported_model_path(export_dir, fingerprint, backend) if export_dir else None
+    if path is None or not path.exists():
+        logger.warning(f"No {backend} export for {fingerprint} (run model_tools.py export) - using eager")
+        return EagerBackend(trunk)
+
+    try:
+        if backend == 'torchscript':
+            return TorchScriptBackend(path, device=device)
+        return OnnxRuntimeBackend(path, num_threads=torch.get_num_threads())
+    except Exception as e:
+        logger.error(f"Failed to load {backend} backend from {path}: {e} - using eager")
+        return EagerBackend(trunk)
+
+
+def check_parity(reference, candidate, pixel_values: torch.Tensor) -> dict:
+    """
+    Compare a backend's pooled features against a reference backend.
+
+    Args:
+        reference: Reference backend (normally eager)
+        candidate: Backend under test
+        pixel_values: Preprocessed image batch
+
+    Returns:
+        dict with max absolute difference and cosine similarity statistics
+    """
+    expected = reference(pixel_values).float()
+    actual = candidate(pixel_values).float()
+    cosine = torch.nn.functional.cosine_similarity(expected, actual, dim=-1)
+
+    return {
+        'samples': int(pixel_values.shape[0]),
+        'max_abs_diff': float((expected - actual).abs().max()),
+        'cosine_min': float(cosine.min()),
+        'cosine_mean': float(cosine.mean())
+    }
@@ -0,0 +1,125 @@
+"""
+Precomputed location gallery for the coarse stage
+GPS points plus their GeoCLIP location-encoder features, stored as float32
+.npy files and memory-mapped at load time
+"""
+
+import json
+import hashlib
+import logging
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+logger = logging.getLogger(__name__)
+
+COORDS_FILE = 'coords.npy'
+FEATURES_FILE = 'features.npy'
+# Galleries built before features were stored as float32
+LEGACY_FEATURES_FILE = 'features.f16.npy'
+INFO_FILE = 'gallery.json'
+
+
+def module_fingerprint(module: torch.nn.Module) -> str:
+    """Content hash of a module's weights"""
+    digest = hashlib.sha256()
+    for name, tensor in sorted(module.state_dict().items()):
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+class LocationGallery:
+    """
+    GPS points and normalized location features, memory-mapped from disk.
+
+    Features are float32 so queries score the mapped rows directly; a
+    float16 gallery from an older build is converted once here.
+    """
+
+    def __init__(self, gallery_dir: str):
+        self.gallery_dir = Path(gallery_dir)
+        self.info = json.loads((self.gallery_dir / INFO_FILE).read_text())
+        self.coords = np.load(self.gallery_dir / COORDS_FILE, mmap_mode='r')
+        if (self.gallery_dir / FEATURES_FILE).exists():
+            self.features = np.load(self.gallery_dir / FEATURES_FILE, mmap_mode='r')
+        else:
+            self.features = np.load(self.gallery_dir / LEGACY_FEATURES_FILE).astype(np.float32)
+            logger.warning(f"Gallery {gallery_dir} stores float16 features - converted in memory; "
+                           f"rebuild it to memory-map float32 features")
+
+        if len(self.coords) != len(self.features):
+            raise ValueError(f"Gallery {gallery_dir} is inconsistent: "
+                             f"{len(self.coords)} points, {len(self.features)} feature rows")
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+    @property
+    def encoder_fingerprint(self) -> str:
+        return self.info.get('encoder_fingerprint')
+
+    @staticmethod
+    def exists(gallery_dir: str) -> bool:
+        gallery_dir = Path(gallery_dir)
+        return (all((gallery_dir / name).exists() for name in (INFO_FILE, COORDS_FILE)) and
+                any((gallery_dir / name).exists() for name in (FEATURES_FILE, LEGACY_FEATURES_FILE)))
+
+
+def build_location_gallery(location_encoder: torch.nn.Module, coords: np.ndarray, gallery_dir: str,
+                           batch_size: int = 8192, device: str = 'cpu', info: dict = None) -> dict:
+    """
+    Encode GPS points offline and write them as a memory-mappable gallery.
+
+    Features are written chunk by chunk straight into the float32 .npy, so
+    galleries larger than RAM can be built.
+
+    Args:
+        location_encoder: GeoCLIP location encoder
+        coords: float32 array of (lat, lon) rows
+        gallery_dir: Output directory
+        batch_size: Points encoded per forward pass
+        device: Torch device for encoding
+        info: Extra build parameters recorded in gallery.json
+
+    Returns:
+        The gallery.json contents
+    """
+    gallery_dir = Path(gallery_dir)
+    gallery_dir.mkdir(parents=True, exist_ok=True)
+    coords = np.ascontiguousarray(coords, dtype=np.float32)
+    np.save(gallery_dir / COORDS_FILE, coords)
+
+    location_encoder = location_encoder.to(device).eval()
+    features = None
+
+    with torch.no_grad():
+        for start in range(0, len(coords), batch_size):
+            batch = torch.from_numpy(coords[start:start + batch_size]).to(device)
+            encoded = F.normalize(location_encoder(batch).float(), dim=1).cpu().numpy()
+
+            if features is None:
+                features = np.lib.format.open_memmap(
+                    gallery_dir / FEATURES_FILE, mode='w+', dtype=np.float32,
+                    shape=(len(coords), encoded.shape[1])
+                )
+            features[start:start + len(encoded)] = encoded
+            logger.info(f"Encoded {min(start + batch_size, len(coords))}/{len(coords)} locations")
+
+    if features is None:
+        raise ValueError("Cannot build an empty location gallery")
+    features.flush()
+    del features
+    (gallery_dir / LEGACY_FEATURES_FILE).unlink(missing_ok=True)
+
+    gallery_info = dict(info or {})
+    gallery_info.update({
+        'count': int(len(coords)),
+        'dim': int(encoded.shape[1]),
+        'encoder_fingerprint': module_fingerprint(location_encoder)
+    })
+    (gallery_dir / INFO_FILE).write_text(json.dumps(gallery_info, indent=2))
+    logger.info(f"Wrote location gallery with {len(coords)} points to {gallery_dir}")
+    return gallery_info
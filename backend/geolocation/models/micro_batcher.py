@@ -0,0 +1,180 @@
+"""
+Dynamic micro-batching for model inference
+Coalesces concurrent single-item requests into one batched forward pass
+"""
+
+import threading
+import time
+import queue
+import logging
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Groups items submitted from many threads into batches.
+
+    The first item to arrive opens a window of max_wait_ms; everything that
+    arrives inside the window (up to max_batch_size items) is passed to
+    batch_fn in one call. Each caller blocks until its own result is ready;
+    if a batch fails, its items are retried one by one so only the callers
+    whose own item fails get the exception.
+    """
+
+    def __init__(self, batch_fn, max_batch_size: int = 16, max_wait_ms: float = 10.0,
+                 name: str = 'batcher'):
+        """
+        Args:
+            batch_fn: Callable taking a list of items and returning a list of
+                results of the same length and order
+            max_batch_size: Maximum number of items per batch
+            max_wait_ms: How long to wait for more items after the first arrives
+            name: Name used in logs and metrics
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+        self._total_wait_s = 0.0
+        self._total_batch_s = 0.0
+        self._batch_sizes = {}
+
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name=f"{name}-worker", daemon=True)
+        self._worker.start()
+        logger.info(f"MicroBatcher '{name}' started (max_batch_size={self.max_batch_size}, "
+                    f"max_wait_ms={self.max_wait_ms})")
+
+    def submit(self, item, timeout: float = None):
+        """
+        Queue an item and block until its result is available.
+
+        Args:
+            item: Single input for batch_fn
+            timeout: Optional seconds to wait for the result
+
+        Returns:
+            The result batch_fn produced for this item
+        """
+        if self._closed:
+            raise RuntimeError(f"MicroBatcher '{self.name}' is closed")
+
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future.result(timeout=timeout)
+
+    def _collect(self) -> list:
+        """Block for the first item, then gather more until the window closes"""
+        first = self._queue.get()
+        if first is None:
+            return []
+
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                self._closed = True
+                break
+            batch.append(entry)
+
+        return batch
+
+    def _run(self):
+        """Worker loop: collect a batch, run it, hand results back"""
+        while not (self._closed and self._queue.empty()):
+            batch = self._collect()
+            if not batch:
+                continue
+
+            items = [item for item, _, _ in batch]
+            started = time.perf_counter()
+
+            try:
+                results = self._call(items)
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+                failed = 0
+            except Exception as e:
+                failed = self._retry_singly(batch, e)
+
+            finished = time.perf_counter()
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._errors += failed
+                self._total_wait_s += sum(started - queued for _, _, queued in batch)
+                self._total_batch_s += finished - started
+                self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+
+    def _call(self, items: list) -> list:
+        """Run batch_fn, checking it returned one result per item"""
+        results = self.batch_fn(items)
+        if len(results) != len(items):
+            raise RuntimeError(f"batch_fn returned {len(results)} results for {len(items)} items")
+        return results
+
+    def _retry_singly(self, batch: list, error: Exception) -> int:
+        """
+        Run a failed batch again one item at a time, so a single bad item
+        only fails its own caller.
+
+        Returns:
+            Number of items that failed on their own
+        """
+        if len(batch) == 1:
+            logger.error(f"MicroBatcher '{self.name}' item failed: {error}")
+            batch[0][1].set_exception(error)
+            return 1
+
+        logger.warning(f"MicroBatcher '{self.name}' batch of {len(batch)} failed ({error}) - "
+                       f"retrying items one at a time")
+        failed = 0
+        for item, future, _ in batch:
+            try:
+                future.set_result(self._call([item])[0])
+            except Exception as e:
+                logger.error(f"MicroBatcher '{self.name}' item failed: {e}")
+                future.set_exception(e)
+                failed += 1
+        return failed
+
+    def stats(self) -> dict:
+        """Configuration and running counters for monitoring"""
+        with self._stats_lock:
+            batches = self._batches
+            items = self._items
+            return {
+                'name': self.name,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'batches': batches,
+                'items': items,
+                'errors': self._errors,
+                'pending': self._queue.qsize(),
+                'avg_batch_size': round(items / batches, 2) if batches else 0.0,
+                'avg_queue_wait_ms': round(1000 * self._total_wait_s / items, 2) if items else 0.0,
+                'avg_batch_latency_ms': round(1000 * self._total_batch_s / batches, 2) if batches else 0.0,
+                'batch_size_histogram': {str(k): v for k, v in sorted(self._batch_sizes.items())}
+            }
+
+    def close(self):
+        """Stop accepting items and let the worker drain the queue"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
@@ -4,12 +4,18 @@ Fine-tuned on Portuguese architecture and streetscapes
 """
 
 import torch
-import torch.nn as nn
-from PIL import Image
 import numpy as np
+from PIL import Image
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import logging
 
+from .backbone import get_backbone
+from .embedding_cache import EmbeddingCache
+from .image_io import load_image, describe_source, content_digest, read_bytes
+from .micro_batcher import MicroBatcher
+
 logger = logging.getLogger(__name__)
 
 
@@ -19,104 +25,343 @@ class PortugalEmbedder:
     Uses transfer learning from GeoCLIP/CLIP.
     """
 
-    def __init__(self, model_path: str = None, device: str = None):
+    def __init__(self, model_path: str = None, device: str = None,
+                 batch_window_ms: float = 0, max_batch_size: int = 16,
+                 cache_dir: str = None, cache_mb: float = 256):
+        """
+        Args:
+            model_path: Optional fine-tuned weights (a CLIP state dict)
+            device: Torch device (auto-detected if omitted)
+            batch_window_ms: If > 0, concurrent get_embedding calls arriving
+                within this window are merged into one forward pass
+            max_batch_size: Maximum images per merged forward pass
+            cache_dir: Directory for the persistent embedding cache (None disables it)
+            cache_mb: Size budget of the embedding cache
+        """
         self.device = device or ('cuda' if torch.cuda.is_available() else
                                   'mps' if torch.backends.mps.is_available() else 'cpu')
         self.model_path = model_path
-        self.model = None
-        self.preprocess = None
+        self.backbone = None
+        self.head = 'base'
         self.is_fine_tuned = False
+        self.cache = None
+        self._batcher = None
         self._load_model()
 
-    def _load_model(self):
-        """Load fine-tuned Portugal model or base model"""
-        try:
-            import open_clip
+        if cache_dir and cache_mb > 0 and self.backbone is not None:
+            self._open_cache(cache_dir, cache_mb)
 
-            # Load base CLIP model
-            self.model, _, self.preprocess = open_clip.create_model_and_transforms(
-                'ViT-L-14', pretrained='openai'
+        if batch_window_ms > 0 and self.backbone is not None:
+            self._batcher = MicroBatcher(
+                # get_embedding has already looked the images up in the cache
+                lambda images: list(self._embed(images, lookup=False)),
+                max_batch_size=max_batch_size,
+                max_wait_ms=batch_window_ms,
+                name='portugal_embedder'
             )
 
-            # Load fine-tuned weights if available
+    def _load_model(self):
+        """Load fine-tuned Portugal model or base model"""
+        try:
+            # Base CLIP model comes from the shared registry; fine-tuned
+            # weights that only change the head reuse the same trunk
             if self.model_path and Path(self.model_path).exists():
                 logger.info(f"Loading fine-tuned weights from {self.model_path}")
-                state_dict = torch.load(self.model_path, map_location=self.device)
-                self.model.load_state_dict(state_dict, strict=False)
                 self.is_fine_tuned = True
             else:
                 logger.info("Using base CLIP model (no fine-tuned weights found)")
                 self.is_fine_tuned = False
 
-            self.model.to(self.device)
-            self.model.eval()
-            logger.info(f"PortugalEmbedder loaded on {self.device}")
+            self.backbone, self.head = get_backbone(
+                'ViT-L-14', 'openai', self.device, weights_path=self.model_path
+            )
+            logger.info(f"PortugalEmbedder loaded on {self.device} (head: {self.head})")
 
         except Exception as e:
             logger.error(f"Failed to load model: {e}")
-            self.model = None
+            self.backbone = None
+
+    def _open_cache(self, cache_dir: str, cache_mb: float):
+        """Open the embedding cache for this model's weights and head"""
+        fingerprint = f"{self.backbone.fingerprint}/{self.head}"
+        safe_name = fingerprint.replace(':', '_').replace('/', '_')
+        try:
+            self.cache = EmbeddingCache(Path(cache_dir) / safe_name, self.embedding_dim,
+                                        max_mb=cache_mb, fingerprint=fingerprint)
+            logger.info(f"Embedding cache at {self.cache.cache_dir} ({cache_mb:g} MB)")
+        except OSError as e:
+            logger.warning(f"Embedding cache disabled: {e}")
 
-    def get_embedding(self, image_path: str) -> np.ndarray:
+    @property
+    def cache_stats(self) -> dict:
+        """Embedding cache counters, or None when the cache is disabled"""
+        return self.cache.stats() if self.cache else None
+
+    def get_embedding(self, image) -> np.ndarray:
         """
         Get Portugal-optimized embedding for image.
 
         Args:
-            image_path: Path to image file
+            image: Image path, encoded bytes, or decoded image (see load_image)
 
         Returns:
             numpy array of embeddings (768 or 1024 dim)
         """
-        if self.model is None:
+        if self.backbone is None:
             logger.warning("No model loaded, returning zero embedding")
             return np.zeros(768)
 
+        # Looked up (and on a miss decoded) here once, skipping the batcher
+        # queue entirely on a hit
         try:
-            image = Image.open(image_path).convert('RGB')
-            image_tensor = self.preprocess(image).unsqueeze(0).to(self.device)
-
-            with torch.no_grad():
-                embedding = self.model.encode_image(image_tensor)
-                # Normalize for cosine similarity
-                embedding = embedding / embedding.norm(dim=-1, keepdim=True)
-                return embedding.cpu().numpy().flatten()
-
+            _, cached, image = self._lookup(image)
         except Exception as e:
             logger.error(f"Embedding failed: {e}")
             return np.zeros(768)
+        if cached is not None:
+            return cached
+
+        if self._batcher is not None:
+            return self._batcher.submit(image)
 
-    def batch_embed(self, image_paths: list) -> np.ndarray:
+        return self._embed([image], lookup=False)[0]
+
+    @property
+    def batching_stats(self) -> dict:
+        """Micro-batching metrics, or None when batching is disabled"""
+        return self._batcher.stats() if self._batcher else None
+
+    def get_embeddings(self, images: list, batch_size: int = 32) -> np.ndarray:
         """
-        Embed multiple images efficiently.
+        Embed several images with batched forward passes, keeping row order.
+
+        An unreadable image does not shift the rows: its row is left as
+        zeros so results line up with images.
 
         Args:
-            image_paths: List of image paths
+            images: List of image paths, encoded bytes, or decoded images
+            batch_size: Number of images per forward pass
 
         Returns:
             numpy array of shape (n_images, embedding_dim)
         """
-        if self.model is None:
-            return np.zeros((len(image_paths), 768))
+        return self._embed(images, batch_size)
+
+    def _embed(self, images: list, batch_size: int = 32, lookup: bool = True) -> np.ndarray:
+        """get_embeddings; lookup=False for decoded images already missed in the cache"""
+        if self.backbone is None:
+            logger.warning("No model loaded, returning zero embeddings")
+            return np.zeros((len(images), 768))
 
-        embeddings = []
-        batch_size = 32
+        embeddings = np.zeros((len(images), self.embedding_dim), dtype=np.float32)
 
-        for i in range(0, len(image_paths), batch_size):
-            batch_paths = image_paths[i:i+batch_size]
-            batch_tensors = []
+        for i in range(0, len(images), batch_size):
+            batch_images = images[i:i+batch_size]
+            batch_decoded = []
+            batch_rows = []
 
-            for path in batch_paths:
+            for row, image in enumerate(batch_images, start=i):
                 try:
-                    img = Image.open(path).convert('RGB')
-                    batch_tensors.append(self.preprocess(img))
+                    _, cached, image = self._lookup(image) if lookup else (None, None, load_image(image))
                 except Exception as e:
-                    logger.warning(f"Failed to load {path}: {e}")
+                    logger.warning(f"Failed to load {describe_source(image)}: {e}")
                     continue
 
-            if batch_tensors:
-                batch = torch.stack(batch_tensors).to(self.device)
-                with torch.no_grad():
-                    batch_emb = self.model.encode_image(batch)
-                    batch_emb = batch_emb / batch_emb.norm(dim=-1, keepdim=True)
-                    embeddings.append(batch_emb.cpu().numpy())
+                if cached is not None:
+                    embeddings[row] = cached
+                else:
+                    batch_decoded.append(image)
+                    batch_rows.append(row)
+
+            if not batch_decoded:
+                continue
+
+            try:
+                batch_emb = self.backbone.encode(batch_decoded, head=self.head).cpu().numpy()
+            except Exception as e:
+                logger.error(f"Batch embedding failed: {e}")
+                continue
+
+            embeddings[batch_rows] = batch_emb
+            if self.cache is not None:
+                for image, embedding in zip(batch_decoded, batch_emb):
+                    # Decoded images carry the digest load_image recorded
+                    self._cache_put(content_digest(image), embedding)
+
+        return embeddings
+
+    def _cache_get(self, digest: bytes):
+        if self.cache is None:
+            return None
+        try:
+            return self.cache.get(digest)
+        except Exception as e:
+            logger.warning(f"Embedding cache lookup failed: {e}")
+            return None
+
+    def _cache_put(self, digest: bytes, embedding: np.ndarray):
+        if self.cache is None:
+            return
+        try:
+            self.cache.put(digest, embedding)
+        except Exception as e:
+            logger.warning(f"Embedding cache store failed: {e}")
+
+    @property
+    def embedding_dim(self) -> int:
+        """Dimension of the embeddings this model produces"""
+        return self.backbone.heads[self.head].shape[1] if self.backbone is not None else 768
+
+    def _lookup(self, image) -> tuple:
+        """
+        Hash and look up one image, decoding it only on a miss.
+
+        Returns:
+            (digest or None, cached embedding or None, decoded image or None)
+        """
+        if self.cache is None:
+            return None, None, load_image(image)
+
+        if not isinstance(image, (Image.Image, np.ndarray)):
+            # Hash the encoded bytes before decoding so cache hits skip it
+            image = read_bytes(image)
+        digest = content_digest(image)
+
+        cached = self._cache_get(digest)
+        if cached is not None:
+            return digest, cached, None
+        return digest, None, load_image(image, digest=digest)
+
+    def _prepare(self, image) -> tuple:
+        """
+        Hash, look up, and on a miss decode and preprocess one image (runs
+        on the worker pool).
+
+        Returns:
+            (digest, cached embedding or None, pixel tensor or None)
+        """
+        digest, cached, image = self._lookup(image)
+        if cached is not None:
+            return digest, cached, None
+        return digest, None, self.backbone.preprocess(image)
+
+    def iter_embeddings(self, images, batch_size: int = 32, num_workers: int = 4, prefetch: int = 2):
+        """
+        Stream embeddings for a large image collection.
+
+        Images are decoded and preprocessed on a thread pool while the model
+        runs the current batch; up to `prefetch` batches are prepared ahead.
+        Images found in the embedding cache are never decoded.
+        Every input yields exactly one tuple, in input order, so failures
+        never shift results.
+
+        Args:
+            images: Iterable of image paths, encoded bytes, or decoded images
+            batch_size: Number of images per forward pass
+            num_workers: Decode/preprocess threads
+            prefetch: Batches prepared ahead of the one being embedded
+
+        Yields:
+            (index, image, embedding) tuples; embedding is None when the image
+            could not be decoded or embedded
+        """
+        batches = _chunked(enumerate(images), batch_size)
+
+        if self.backbone is None:
+            logger.warning("No model loaded, no embeddings produced")
+            for batch in batches:
+                for index, image in batch:
+                    yield index, image, None
+            return
+
+        with ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='embed-decode') as pool:
+            pending = deque()
+
+            def submit_next():
+                batch = next(batches, None)
+                if batch is not None:
+                    pending.append([(index, image, pool.submit(self._prepare, image))
+                                    for index, image in batch])
+
+            for _ in range(prefetch + 1):
+                submit_next()
+
+            while pending:
+                batch = pending.popleft()
+                submit_next()
+
+                embeddings = {}
+                pixels = {}
+                digests = {}
+                for index, image, future in batch:
+                    try:
+                        digest, cached, pixel_values = future.result()
+                    except Exception as e:
+                        logger.warning(f"Failed to load {describe_source(image)}: {e}")
+                        continue
+
+                    if cached is not None:
+                        embeddings[index] = cached
+                    else:
+                        pixels[index] = pixel_values
+                        digests[index] = digest
+
+                if pixels:
+                    try:
+                        with torch.no_grad():
+                            pooled = self.backbone.forward(torch.stack(list(pixels.values())))
+                            batch_emb = self.backbone.project(pooled, head=self.head).cpu().numpy()
+                    except Exception as e:
+                        logger.error(f"Batch embedding failed: {e}")
+                    else:
+                        for index, embedding in zip(pixels, batch_emb):
+                            embeddings[index] = embedding
+                            if digests[index] is not None:
+                                self._cache_put(digests[index], embedding)
+
+                for index, image, _ in batch:
+                    yield index, image, embeddings.get(index)
+
+    def batch_embed(self, image_paths: list, batch_size: int = 32, num_workers: int = 4,
+                    return_mask: bool = False):
+        """
+        Embed multiple images efficiently.
+
+        Rows line up with image_paths; images that fail to load keep a zero
+        row, and the failure mask says which rows are real embeddings.
+
+        Args:
+            image_paths: List of image paths (or encoded bytes / decoded images)
+            batch_size: Number of images per forward pass
+            num_workers: Decode/preprocess threads
+            return_mask: Also return the boolean mask of embedded rows
+
+        Returns:
+            numpy array of shape (n_images, embedding_dim), or an
+            (embeddings, mask) tuple when return_mask is set
+        """
+        embeddings = np.zeros((len(image_paths), self.embedding_dim), dtype=np.float32)
+        mask = np.zeros(len(image_paths), dtype=bool)
+
+        for index, _, embedding in self.iter_embeddings(image_paths, batch_size=batch_size,
+                                                        num_workers=num_workers):
+            if embedding is not None:
+                embeddings[index] = embedding
+                mask[index] = True
+
+        if not mask.all():
+            logger.warning(f"{int((~mask).sum())} of {len(image_paths)} images could not be embedded")
+
+        return (embeddings, mask) if return_mask else embeddings
+
 
-        return np.vstack(embeddings) if embeddings else np.zeros((0, 768))
+def _chunked(iterable, size: int):
+    """Lists of up to size items from an iterable"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,133 @@
+"""
+Dynamic int8 quantization for the CLIP vision tower
+Includes a drift check against the fp32 model before adopting it
+"""
+
+import logging
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = ('int8',)
+
+
+def quantize_trunk(trunk: nn.Module) -> nn.Module:
+    """
+    Dynamically quantize the linear layers of a vision tower to int8.
+
+    Weights are stored as int8 and activations are quantized on the fly,
+    which speeds up the MLP-heavy ViT blocks on CPU.
+    """
+    return torch.ao.quantization.quantize_dynamic(trunk, {nn.Linear}, dtype=torch.qint8)
+
+
+def quantized_model_path(quantized_dir: str, fingerprint: str, mode: str) -> Path:
+    """Where a persisted quantized tower for a backbone fingerprint lives"""
+    safe_name = fingerprint.replace(':', '_').replace('/', '_')
+    return Path(quantized_dir) / f"{safe_name}.{mode}.pt"
+
+
+def save_quantized(path: Path, trunk: nn.Module, heads: dict, checksums: dict):
+    """Persist a quantized tower with its heads and fp32 tensor checksums"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    torch.save({
+        'trunk': trunk.state_dict(),
+        'heads': {name: head.cpu() for name, head in heads.items()},
+        'checksums': checksums
+    }, path)
+    logger.info(f"Saved quantized vision tower to {path}")
+
+
+def load_quantized(path: Path, trunk: nn.Module) -> tuple:
+    """
+    Load a persisted quantized tower.
+
+    Args:
+        path: File written by save_quantized
+        trunk: Freshly built (unweighted) fp32 tower of the same architecture
+
+    Returns:
+        (quantized trunk, heads, checksums) tuple
+    """
+    saved = torch.load(path, map_location='cpu', weights_only=False)
+    trunk = quantize_trunk(trunk)
+    trunk.load_state_dict(saved['trunk'])
+    logger.info(f"Loaded quantized vision tower from {path}")
+    return trunk, saved['heads'], saved.get('checksums', {})
+
+
+def compare_embeddings(reference: np.ndarray, candidate: np.ndarray, top_k: int = 10) -> dict:
+    """
+    Measure how far candidate embeddings drift from reference embeddings.
+
+    Each sample image is used as a query against the rest of the sample, so
+    the top-k overlap reflects how retrieval rankings would change.
+
+    Args:
+        reference: fp32 embeddings of shape (n, d), L2-normalized
+        candidate: Embeddings of the same images from the model under test
+        top_k: Neighbours compared per query
+
+    Returns:
+        dict with cosine drift and retrieval overlap statistics
+    """
+    n = len(reference)
+    cosine = np.sum(reference * candidate, axis=1)
+
+    report = {
+        'samples': int(n),
+        'cosine_mean': float(cosine.mean()),
+        'cosine_min': float(cosine.min()),
+        'cosine_p5': float(np.percentile(cosine, 5)),
+        'top_k': int(min(top_k, n - 1)) if n > 1 else 0,
+        'top_k_overlap_mean': None,
+        'top_k_overlap_min': None,
+        'top_1_agreement': None
+    }
+
+    k = report['top_k']
+    if k == 0:
+        return report
+
+    def neighbours(embeddings):
+        sims = embeddings @ embeddings.T
+        np.fill_diagonal(sims, -np.inf)
+        return np.argsort(-sims, axis=1)[:, :k]
+
+    ref_nn = neighbours(reference)
+    cand_nn = neighbours(candidate)
+    overlap = np.array([len(set(r) & set(c)) / k for r, c in zip(ref_nn, cand_nn)])
+
+    report['top_k_overlap_mean'] = float(overlap.mean())
+    report['top_k_overlap_min'] = float(overlap.min())
+    report['top_1_agreement'] = float(np.mean(ref_nn[:, 0] == cand_nn[:, 0]))
+    return report
+
+
+def check_quantization(reference_backbone, quantized_backbone, images: list,
+                       head: str = 'base', top_k: int = 10, batch_size: int = 16) -> dict:
+    """
+    Compare a quantized backbone against its fp32 reference on sample images.
+
+    Args:
+        reference_backbone: fp32 ClipBackbone
+        quantized_backbone: Quantized ClipBackbone of the same weights
+        images: Decoded sample images
+        head: Projection head to compare
+        top_k: Neighbours compared per query
+        batch_size: Images per forward pass
+
+    Returns:
+        Drift report (see compare_embeddings)
+    """
+    def embed(backbone):
+        rows = []
+        for i in range(0, len(images), batch_size):
+            rows.append(backbone.encode(images[i:i + batch_size], head=head).cpu().numpy())
+        return np.vstack(rows).astype(np.float32)
+
+    return compare_embeddings(embed(reference_backbone), embed(quantized_backbone), top_k=top_k)
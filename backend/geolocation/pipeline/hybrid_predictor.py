@@ -5,8 +5,12 @@ Combines coarse prediction, retrieval, and GIS snapping
 
 import numpy as np
 import logging
+from pathlib import Path
 from typing import Optional
 
+from models.image_io import load_image, describe_source
+from retrieval.geo_filter import GeoFilter
+
 logger = logging.getLogger(__name__)
 
 # Try to import sklearn for clustering
@@ -44,48 +48,174 @@ class HybridGeoLocator:
         self.cluster_eps_km = 0.5  # 500m radius for clustering
         self.min_cluster_samples = 2
 
-    def predict(self, image_path: str) -> dict:
+        # Coarse confidences are probability summed per gallery cell (see
+        # models.coarse_locator.CELL_KM), so they hold up on a dense location
+        # grid. A coarse prediction is trusted on its own above this
+        self.coarse_min_confidence = 0.6
+
+        # Retrieval restricted to the area around the coarse top-k when the
+        # coarse step puts at least this much probability there
+        self.geo_filter_radius_km = 25
+        self.geo_filter_min_confidence = 0.3
+        self.geo_filter_min_hits = 5  # fewer hits than this: search everywhere
+
+    def predict(self, image) -> dict:
         """
         Run complete hybrid geolocation pipeline.
 
         Args:
-            image_path: Path to input image
+            image: Image path, encoded bytes, or decoded image
 
         Returns:
             Complete prediction result with candidates and confidence
         """
-        result = {
-            'image_path': image_path,
+        return self.predict_many([image])[0]
+
+    def predict_many(self, images: list) -> list:
+        """
+        Run the hybrid pipeline over several images at once.
+
+        Each image is decoded once and the same RGB image is handed to every
+        stage. Embeddings are computed with batched forward passes and the
+        index is queried with a single FAISS search; clustering and snapping
+        then run per image.
+
+        Args:
+            images: List of image paths, encoded bytes, or decoded images
+
+        Returns:
+            List of prediction results, one per image, in input order
+        """
+        results = [self._empty_result(image) for image in images]
+
+        # Decode once; an unreadable image fails on its own
+        decoded = []
+        active = []
+        for result, image in zip(results, images):
+            try:
+                decoded.append(load_image(image))
+                active.append(result)
+            except Exception as e:
+                logger.error(f"Could not decode {describe_source(image)}: {e}")
+                result['error'] = f"Could not decode image: {e}"
+
+        if not decoded:
+            return results
+
+        # Step 1: Coarse prediction
+        if self.coarse_locator:
+            try:
+                coarse_predictions = self._coarse_predictions(decoded)
+                for result, coarse in zip(active, coarse_predictions):
+                    result['coarse_prediction'] = coarse
+                    logger.info(f"Coarse prediction: {coarse['lat']:.4f}, {coarse['lon']:.4f} "
+                               f"(confidence: {coarse.get('confidence', 0):.2f})")
+            except Exception as e:
+                logger.error(f"Coarse prediction failed: {e}")
+                for result in active:
+                    result['error'] = str(e)
+
+        # Step 2: Get embeddings and retrieve similar images
+        if self.portugal_embedder and self.image_index and self.image_index.is_available:
+            try:
+                embeddings = self._embeddings(decoded)
+
+                # A failed embedding comes back as a zero row; searching it
+                # would return arbitrary neighbours, so it is left out
+                embedded = np.flatnonzero(np.any(embeddings != 0, axis=1))
+                for i in np.setdiff1d(np.arange(len(active)), embedded):
+                    active[i]['retrieval_error'] = 'Image could not be embedded'
+                searched = [active[i] for i in embedded]
+                all_candidates, scopes = self._retrieve(embeddings[embedded], searched) if len(searched) else ([], [])
+
+                for result, candidates, scope in zip(searched, all_candidates, scopes):
+                    result['retrieval_candidates'] = candidates
+                    result['retrieval_scope'] = scope
+                    if getattr(candidates, 'missing', None):
+                        # Sharded search merged what answered; say what is left out
+                        result['retrieval_error'] = (f"Partial retrieval: no results from shards "
+                                                     f"{', '.join(candidates.missing)}")
+
+                    if candidates:
+                        logger.info(f"Retrieved {len(candidates)} similar images")
+
+                        # Step 3: Cluster candidate coordinates
+                        result['predictions'] = self._cluster_candidates(candidates)
+            except Exception as e:
+                logger.error(f"Retrieval failed: {e}")
+                for result in active:
+                    result['error'] = str(e)
+
+        for result in active:
+            self._finalize_prediction(result)
+
+        return results
+
+    def _coarse_predictions(self, images: list) -> list:
+        """Coarse predictions in input order"""
+        # Single images go through predict() so that concurrent requests can
+        # be merged by the locator's micro-batcher
+        if len(images) == 1:
+            return [self.coarse_locator.predict(images[0])]
+        return self.coarse_locator.predict_many(images)
+
+    def _embeddings(self, images: list) -> np.ndarray:
+        """Retrieval embeddings of shape (n_images, dimension) in input order"""
+        if len(images) == 1:
+            return self.portugal_embedder.get_embedding(images[0]).reshape(1, -1)
+        return self.portugal_embedder.get_embeddings(images)
+
+    def _retrieve(self, embeddings: np.ndarray, results: list) -> tuple:
+        """
+        Retrieval candidates per image, restricted to the coarse area when possible.
+
+        Images whose restricted search finds too few matches are searched
+        again over the whole index.
+
+        Returns:
+            (candidates per image, 'geo_filtered' or 'global' per image)
+        """
+        filters = [self._geo_filter(result) for result in results]
+        candidates = self.image_index.search_many(embeddings, top_k=self.retrieval_top_k,
+                                                  geo_filter=filters)
+        scopes = ['global' if f is None else 'geo_filtered' for f in filters]
+
+        retry = [i for i, (f, hits) in enumerate(zip(filters, candidates))
+                 if f is not None and len(hits) < self.geo_filter_min_hits]
+        if retry:
+            logger.info(f"Geo-filtered retrieval too sparse for {len(retry)} images - searching globally")
+            for i, hits in zip(retry, self.image_index.search_many(embeddings[retry], top_k=self.retrieval_top_k)):
+                candidates[i] = hits
+                scopes[i] = 'global'
+
+        return candidates, scopes
+
+    def _geo_filter(self, result: dict) -> Optional[GeoFilter]:
+        """Circles around a confident coarse prediction's top-k locations"""
+        coarse = result.get('coarse_prediction')
+        if not coarse or not coarse.get('top_k'):
+            return None
+        if sum(loc.get('confidence', 0) for loc in coarse['top_k']) < self.geo_filter_min_confidence:
+            return None
+        return GeoFilter.around(coarse['top_k'], self.geo_filter_radius_km)
+
+    def _empty_result(self, image) -> dict:
+        """Result skeleton filled in by the pipeline stages"""
+        return {
+            'image_path': str(image) if isinstance(image, (str, Path)) else None,
             'predictions': [],
             'best_prediction': None,
             'coarse_prediction': None,
             'retrieval_candidates': [],
+            'retrieval_scope': None,
             'building_match': None,
             'confidence': 0.0,
             'method': 'hybrid'
         }
 
+    def _finalize_prediction(self, result: dict):
+        """Select, snap and score the best prediction for one image"""
         try:
-            # Step 1: Coarse prediction
-            if self.coarse_locator:
-                coarse = self.coarse_locator.predict(image_path)
-                result['coarse_prediction'] = coarse
-                logger.info(f"Coarse prediction: {coarse['lat']:.4f}, {coarse['lon']:.4f} "
-                           f"(confidence: {coarse.get('confidence', 0):.2f})")
-
-            # Step 2: Get embedding and retrieve similar images
-            if self.portugal_embedder and self.image_index and self.image_index.is_available:
-                embedding = self.portugal_embedder.get_embedding(image_path)
-                candidates = self.image_index.search(embedding, top_k=self.retrieval_top_k)
-                result['retrieval_candidates'] = candidates
-
-                if candidates:
-                    logger.info(f"Retrieved {len(candidates)} similar images")
-
-                    # Step 3: Cluster candidate coordinates
-                    clustered = self._cluster_candidates(candidates)
-                    result['predictions'] = clustered
-
             # Step 4: Determine best prediction
             best = self._select_best_prediction(result)
 
@@ -108,8 +238,6 @@ class HybridGeoLocator:
             logger.error(f"Prediction failed: {e}")
             result['error'] = str(e)
 
-        return result
-
     def _cluster_candidates(self, candidates: list) -> list:
         """
         Cluster retrieval candidates to find location modes.
@@ -121,10 +249,15 @@ class HybridGeoLocator:
             List of cluster centers with aggregated confidence
         """
         if not SKLEARN_AVAILABLE or len(candidates) < 2:
-            return candidates
+            return list(candidates)
 
-        # Extract coordinates
-        coords = np.array([[c['lat'], c['lon']] for c in candidates])
+        # Extract coordinates (array-backed hits skip building dicts)
+        if hasattr(candidates, 'lat'):
+            coords = np.column_stack([candidates.lat, candidates.lon])
+            similarities = np.asarray(candidates.similarity, dtype=np.float64)
+        else:
+            coords = np.array([[c['lat'], c['lon']] for c in candidates])
+            similarities = np.array([c['similarity'] for c in candidates])
 
         # DBSCAN clustering (eps in degrees, ~0.5km at Portugal latitude)
         eps_deg = self.cluster_eps_km / 111  # Rough km to degrees
@@ -138,10 +271,10 @@ class HybridGeoLocator:
 
             mask = clustering.labels_ == label
             cluster_coords = coords[mask]
-            cluster_candidates = [c for c, m in zip(candidates, mask) if m]
+            members = np.flatnonzero(mask)
 
             # Calculate cluster center (weighted by similarity)
-            weights = np.array([c['similarity'] for c in cluster_candidates])
+            weights = similarities[mask]
             if weights.sum() > 0:
                 weights = weights / weights.sum()
             else:
@@ -150,12 +283,17 @@ class HybridGeoLocator:
             center_lat = np.average(cluster_coords[:, 0], weights=weights)
             center_lon = np.average(cluster_coords[:, 1], weights=weights)
 
+            # A hit that near-duplicates were collapsed into stands for all
+            # of those photos, so the cluster size counts them too
+            sources = [candidates[i] for i in members]
+            cluster_size = sum(1 + int(source.get('duplicate_count') or 0) for source in sources)
+
             clusters.append({
                 'lat': float(center_lat),
                 'lon': float(center_lon),
-                'cluster_size': int(mask.sum()),
-                'avg_similarity': float(np.mean([c['similarity'] for c in cluster_candidates])),
-                'sources': cluster_candidates[:5]  # Top 5 sources
+                'cluster_size': cluster_size,
+                'avg_similarity': float(np.mean(similarities[mask])),
+                'sources': sources[:5]  # Top 5 sources
             })
 
         # Sort by cluster size and similarity
@@ -181,7 +319,7 @@ class HybridGeoLocator:
         # Priority 2: High-confidence coarse prediction
         if result['coarse_prediction']:
             coarse = result['coarse_prediction']
-            if coarse.get('confidence', 0) > 0.6:
+            if coarse.get('confidence', 0) > self.coarse_min_confidence:
                 return {
                     'lat': coarse['lat'],
                     'lon': coarse['lon'],
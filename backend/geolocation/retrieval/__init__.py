@@ -1,4 +1,11 @@
 """Retrieval Module"""
-from .faiss_index import PortugalImageIndex
+from .faiss_index import PortugalImageIndex, SearchHits, BatchHits
+from .metadata_store import ColumnarMetadata
+from .geo_filter import GeoFilter
+from .sharded_index import ShardedImageIndex, ShardHits
+from .prototype_index import PrototypeImageIndex
+from .remote_index import RemoteShardIndex
 
-__all__ = ['PortugalImageIndex']
+__all__ = ['PortugalImageIndex', 'SearchHits', 'BatchHits', 'ColumnarMetadata', 'GeoFilter',
+           'ShardedImageIndex', 'ShardHits', 'PrototypeImageIndex',
+           'RemoteShardIndex']
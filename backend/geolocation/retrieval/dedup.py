@@ -0,0 +1,252 @@
+"""
+Near-duplicate collapsing for the image index
+The same listing photo is republished across portals (Idealista,
+Imovirtual, OLX, Supercasa); each group of near-identical photos is kept
+as one vector whose metadata counts the copies and lists their sources
+"""
+
+import os
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Cosine similarity above which two embeddings are the same photo
+DEFAULT_THRESHOLD = 0.97
+# Hamming distance (of 64 bits) within which two dHashes are the same photo
+DEFAULT_MAX_HASH_DISTANCE = 10
+
+
+def dhash(image, size: int = 8) -> str:
+    """
+    64-bit difference hash of an image as 16 hex digits.
+
+    Args:
+        image: Image path or PIL image
+    """
+    from PIL import Image
+
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+    pixels = np.asarray(image.convert('L').resize((size + 1, size), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return f"{int(''.join('1' if b else '0' for b in bits), 2):016x}"
+
+
+def _parse_hashes(records: list) -> tuple:
+    """(uint64 hashes, bool mask of records that have one)"""
+    hashes = np.zeros(len(records), dtype=np.uint64)
+    hashed = np.zeros(len(records), dtype=bool)
+    for i, record in enumerate(records):
+        value = record.get('phash')
+        if value:
+            try:
+                hashes[i] = int(str(value), 16)
+                hashed[i] = True
+            except ValueError:
+                pass
+    return hashes, hashed
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    """Set bits of each uint64"""
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1).reshape(values.shape)
+
+
+class DuplicateCollapser:
+    """
+    Streaming near-duplicate detection in id order.
+
+    Every batch of vectors is compared with the vectors already kept and
+    with the earlier vectors of the same batch. A search function over the
+    index being built only proposes candidates: its scores may come from
+    compressed or PCA-reduced codes, so each candidate is rescored with
+    exact cosine against the kept vector itself (float16 unit rows, in
+    memory or appended to `vectors_file`). A vector whose exact similarity
+    to a kept one reaches the threshold is dropped and counted in that
+    vector's group; when both photos carry a perceptual hash ('phash' in
+    their records), the hashes must match too, so look-alike but different
+    photos (e.g. generic interiors) are not merged.
+
+    The kept vector keeps its own coordinates; the group adds
+    duplicate_count (photos collapsed into it) and duplicate_sources.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD,
+                 max_hash_distance: int = DEFAULT_MAX_HASH_DISTANCE, neighbours: int = 4,
+                 vectors_file=None):
+        """
+        Args:
+            vectors_file: Raw float16 file the kept vectors are appended to
+                (default: kept in memory); rows past `kept` are left over
+                from an interrupted run and overwritten
+        """
+        self.threshold = threshold
+        self.max_hash_distance = max_hash_distance
+        self.neighbours = neighbours
+        self.vectors_file = Path(vectors_file) if vectors_file else None
+        self.keep = np.zeros(0, dtype=bool)  # per input row, in order
+        self.groups = {}  # kept id -> {'count': copies dropped, 'sources': set}
+        self._hashes = np.zeros(0, dtype=np.uint64)  # per kept id
+        self._hashed = np.zeros(0, dtype=bool)
+        self._dimension = None
+        self._vectors = None  # float16 unit rows per kept id, without vectors_file
+
+    @property
+    def kept(self) -> int:
+        return len(self._hashes)
+
+    def _kept_vectors(self, ids: np.ndarray) -> np.ndarray:
+        """float32 unit rows of some kept ids"""
+        if self.vectors_file is None:
+            return self._vectors[ids].astype(np.float32)
+        mapped = np.memmap(self.vectors_file, dtype=np.float16, mode='r', shape=(self.kept, self._dimension))
+        return np.asarray(mapped[ids], dtype=np.float32)
+
+    def _append_vectors(self, rows: np.ndarray):
+        rows = rows.astype(np.float16)
+        if self.vectors_file is None:
+            self._vectors = rows if self._vectors is None else np.vstack([self._vectors, rows])
+            return
+        with open(self.vectors_file, 'ab') as f:
+            f.truncate(self.kept * self._dimension * 2)
+            f.write(rows.tobytes())
+
+    def _hashes_match(self, hash_a, hashed_a, hash_b, hashed_b) -> np.ndarray:
+        """Pairs whose hashes agree, or where either photo has no hash"""
+        close = _popcount(np.bitwise_xor(hash_a, hash_b)) <= self.max_hash_distance
+        return close | ~(hashed_a & hashed_b)
+
+    def add_batch(self, vectors: np.ndarray, records: list, search=None) -> np.ndarray:
+        """
+        Decide which vectors of the next batch to keep.
+
+        Args:
+            vectors: Embeddings (n, dimension), following every earlier batch
+            records: Metadata dicts, one per vector
+            search: Function (vectors, k) -> (similarities, ids) over the
+                vectors kept so far, or None to only compare within the batch;
+                only its ids are used
+
+        Returns:
+            bool mask of the vectors to add; kept vectors get consecutive
+            ids starting at the number kept before this batch
+        """
+        n = len(vectors)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        hashes, hashed = _parse_hashes(records)
+        target = np.full(n, -1, dtype=np.int64)  # kept id a row collapses into
+        if self._dimension is None and n:
+            self._dimension = vectors.shape[1]
+
+        # Against the vectors kept by earlier batches: the index proposes,
+        # exact cosine decides
+        if search is not None and self.kept and n:
+            _, ids = search(vectors, min(self.neighbours, self.kept))
+            candidate = (ids >= 0) & (ids < self.kept)
+            safe_ids = np.where(candidate, ids, 0)
+            exact = np.full(ids.shape, -np.inf, dtype=np.float32)
+            if candidate.any():
+                # Sorted ids read a mapped file front to back
+                unique, inverse = np.unique(safe_ids[candidate], return_inverse=True)
+                rows = np.nonzero(candidate)[0]
+                exact[candidate] = np.einsum('ij,ij->i', self._kept_vectors(unique)[inverse], unit[rows])
+            candidate &= exact >= self.threshold
+            candidate &= self._hashes_match(hashes[:, None], hashed[:, None],
+                                            self._hashes[safe_ids], self._hashed[safe_ids])
+            best = np.where(candidate, exact, -np.inf).argmax(axis=1)
+            found = candidate[np.arange(n), best]
+            target[found] = ids[found, best[found]]
+
+        # Against earlier rows of this batch
+        keep = np.zeros(n, dtype=bool)
+        new_ids = np.full(n, -1, dtype=np.int64)
+        if n:
+            sims = unit @ unit.T
+            matches = np.triu(sims >= self.threshold, k=1).T  # row i: earlier rows j
+            next_id = self.kept
+            for i in range(n):
+                if target[i] < 0:
+                    earlier = np.flatnonzero(matches[i] & keep)
+                    if len(earlier):
+                        same = self._hashes_match(hashes[i], hashed[i], hashes[earlier], hashed[earlier])
+                        earlier = earlier[same]
+                    if len(earlier):
+                        target[i] = new_ids[earlier[np.argmax(sims[i, earlier])]]
+                    else:
+                        keep[i] = True
+                        new_ids[i] = next_id
+                        next_id += 1
+
+        for i in np.flatnonzero(~keep):
+            group = self.groups.setdefault(int(target[i]), {'count': 0, 'sources': set()})
+            group['count'] += 1
+            if records[i].get('source'):
+                group['sources'].add(str(records[i]['source']))
+
+        if keep.any():
+            self._append_vectors(unit[keep])
+        self.keep = np.concatenate([self.keep, keep])
+        self._hashes = np.concatenate([self._hashes, hashes[keep]])
+        self._hashed = np.concatenate([self._hashed, hashed[keep]])
+        return keep
+
+    def merged(self, record: dict, kept_id: int) -> dict:
+        """A kept vector's record with its group's duplicate fields"""
+        group = self.groups.get(kept_id)
+        if group is None:
+            return record
+        sources = set(group['sources'])
+        if record.get('source'):
+            sources.add(str(record['source']))
+        return {**record, 'duplicate_count': group['count'], 'duplicate_sources': sorted(sources)}
+
+    @property
+    def stats(self) -> dict:
+        counts = [group['count'] for group in self.groups.values()]
+        return {
+            'threshold': self.threshold,
+            'input_vectors': int(len(self.keep)),
+            'kept_vectors': int(self.kept),
+            'collapsed': int(sum(counts)),
+            'groups': len(counts),
+            'largest_group': int(max(counts) + 1) if counts else 1,
+            'reduction': round(1 - self.kept / len(self.keep), 4) if len(self.keep) else 0.0
+        }
+
+    def save(self, path):
+        """
+        Persist the collapser state (written beside and renamed over).
+
+        With a vectors_file the kept vectors are already on disk; otherwise
+        they are saved in the state.
+        """
+        groups = {str(k): {'count': g['count'], 'sources': sorted(g['sources'])} for k, g in self.groups.items()}
+        vectors = {} if self.vectors_file is not None or self._vectors is None else {'vectors': self._vectors}
+        with open(str(path) + '.tmp', 'wb') as f:
+            np.savez(f, keep=self.keep, hashes=self._hashes, hashed=self._hashed,
+                     groups=np.array(json.dumps(groups)),
+                     settings=np.array(json.dumps([self.threshold, self.max_hash_distance, self._dimension])),
+                     **vectors)
+        os.replace(str(path) + '.tmp', str(path))
+
+    @classmethod
+    def load(cls, path, neighbours: int = 4, vectors_file=None) -> 'DuplicateCollapser':
+        with np.load(path) as data:
+            threshold, max_hash_distance, dimension = json.loads(str(data['settings']))
+            collapser = cls(threshold, max_hash_distance, neighbours, vectors_file=vectors_file)
+            collapser._dimension = dimension
+            collapser.keep = data['keep']
+            collapser._hashes = data['hashes']
+            collapser._hashed = data['hashed']
+            if 'vectors' in data and vectors_file is None:
+                collapser._vectors = data['vectors']
+            collapser.groups = {int(k): {'count': g['count'], 'sources': set(g['sources'])}
+                                for k, g in json.loads(str(data['groups'])).items()}
+        return collapser
+
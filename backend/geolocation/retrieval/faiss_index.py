@@ -3,44 +3,233 @@ FAISS-based retrieval for Portuguese geotagged images
 """
 
 import numpy as np
+import os
 import json
+import shutil
 from pathlib import Path
 import logging
+from typing import NamedTuple
+
+from .metadata_store import ColumnarMetadata, MetadataSegments, columnar_path
+from .geo_filter import GeoFilter, GridPartition
+from .vector_store import VectorStore, vectors_path
+from .index_factory import (choose_index, build_index, search_parameters, describe_index,
+                            pca_report, save_params, load_params)
 
 logger = logging.getLogger(__name__)
 
+# Delta segments live in <index_path>.delta/segment-NNNNNN/
+DELTA_SUFFIX = '.delta'
+TOMBSTONES_SUFFIX = '.removed.npy'
+
+# Upper bound for efSearch when a geo filter widens an HNSW search
+MAX_FILTERED_EF_SEARCH = 4096
+
+MB = 1024 * 1024
+
 # Try to import faiss, but allow graceful fallback
 try:
     import faiss
     FAISS_AVAILABLE = True
+    # In-place mmap reader; missing from older faiss releases
+    MMAP_FLAG = getattr(faiss, 'IO_FLAG_MMAP_IFC', None)
 except ImportError:
     FAISS_AVAILABLE = False
     logger.warning("FAISS not available - retrieval will be disabled")
 
 
+def mapped_usage(paths: list) -> dict:
+    """
+    Mapped and resident size of the memory mappings of some files.
+
+    Reads /proc/self/smaps (Linux); a file's resident pages are shared with
+    every other process mapping it through the page cache.
+
+    Args:
+        paths: Files, or directories whose files count
+
+    Returns:
+        dict with mapped_mb and resident_mb (None where smaps is unavailable)
+    """
+    prefixes = [str(Path(p).resolve()) for p in paths]
+    mapped = resident = 0
+    counting = False
+    try:
+        with open('/proc/self/smaps') as f:
+            for line in f:
+                fields = line.split()
+                if '-' in fields[0] and not fields[0].endswith(':'):
+                    # Mapping header: address perms offset dev inode [path]
+                    path = fields[5] if len(fields) > 5 else ''
+                    counting = any(path == p or path.startswith(p + os.sep) for p in prefixes)
+                elif counting and fields[0] == 'Size:':
+                    mapped += int(fields[1])
+                elif counting and fields[0] == 'Rss:':
+                    resident += int(fields[1])
+    except OSError:
+        return {'mapped_mb': None, 'resident_mb': None}
+
+    return {'mapped_mb': round(mapped / 1024, 1), 'resident_mb': round(resident / 1024, 1)}
+
+
+def process_rss_mb() -> float:
+    """Resident set size of this process"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+class BatchHits(NamedTuple):
+    """
+    Results of a batch of queries as (n_queries, top_k) arrays.
+
+    Rows with fewer than top_k hits are padded with id -1, similarity -inf
+    and NaN coordinates.
+    """
+    similarities: np.ndarray
+    ids: np.ndarray
+    lat: np.ndarray
+    lon: np.ndarray
+
+    @property
+    def counts(self) -> np.ndarray:
+        """Real (unpadded) hits per query"""
+        return (self.ids >= 0).sum(axis=1)
+
+
+class SearchHits:
+    """
+    Hits of one query, backed by arrays.
+
+    Behaves like the list of result dicts search used to return, but a dict
+    is only built for a hit that is actually accessed; lat, lon and
+    similarity are available as arrays for vectorized consumers.
+    """
+
+    def __init__(self, ids: np.ndarray, similarities: np.ndarray, metadata: ColumnarMetadata,
+                 tombstones: np.ndarray = None, limit: int = None):
+        keep = (ids >= 0) & (ids < len(metadata))
+        if tombstones is not None and len(tombstones):
+            keep &= ~np.isin(ids, tombstones)
+        if limit is not None:
+            keep &= np.cumsum(keep) <= limit
+        self.ids = ids[keep]
+        self.similarity = similarities[keep]
+        self._metadata = metadata
+
+    @property
+    def lat(self) -> np.ndarray:
+        return np.asarray(self._metadata.lat[self.ids], dtype=np.float64)
+
+    @property
+    def lon(self) -> np.ndarray:
+        return np.asarray(self._metadata.lon[self.ids], dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._hit(j) for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._hit(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._hit(i)
+
+    def _hit(self, i: int) -> dict:
+        return {
+            'rank': i + 1,
+            'similarity': float(self.similarity[i]),
+            **self._metadata.record(self.ids[i])
+        }
+
+    def to_dicts(self, limit: int = None) -> list:
+        """Result dicts for the first `limit` hits (all by default)"""
+        return self[:limit]
+
+
 class PortugalImageIndex:
     """
     FAISS index for Portuguese geotagged image retrieval.
     Stores embeddings + metadata (lat, lon, source, etc.)
+
+    Vector ids are metadata row numbers. add() appends rows with new ids
+    and remove() tombstones ids, so ids stay stable for the life of the
+    index. Changes are persisted as append-only delta segments next to the
+    base snapshot (save_delta) and folded into it by compact().
+
+    The index type is chosen by create_index from a memory budget and a
+    target recall; the chosen spec, including default nprobe / efSearch,
+    is saved next to the index as <index_path>.params.json.
+
+    With mmap=True the index file is memory-mapped read-only instead of
+    read into the heap: loading is near-instant and every worker process
+    shares one page-cached copy. Removes on a mapped index are filtered at
+    search time, and adds (live or replayed from delta segments) go to a
+    small flat heap index searched beside the mapped one, so the base stays
+    shared until the next save folds them in.
+
+    Compressed indexes also keep L2-normalized float16 copies of their
+    vectors in <index_path>.vectors.npy (memory-mapped). With rerank=N a
+    search fetches N candidates from the index and rescores them exactly
+    against those copies, so similarities stay comparable to a flat index.
     """
 
-    def __init__(self, index_path: str = None, metadata_path: str = None):
+    def __init__(self, index_path: str = None, metadata_path: str = None, mmap: bool = False,
+                 rerank: int = 0):
         self.index_path = index_path
         self.metadata_path = metadata_path
+        self.mmap = mmap
+        self.rerank = rerank  # candidates rescored exactly per query (0: off)
+        self.vectors = None  # VectorStore of full-precision copies, if kept
+        self.mapped_path = None  # file the current index is mapped from
         self.index = None
-        self.metadata = []
+        self.delta_index = None  # heap IDMap2 of vectors added on top of a mapped index
+        self.metadata = ColumnarMetadata.from_records([])
         self.dimension = 768  # CLIP ViT-L-14 dimension
+        self.spec = {'type': 'flat', 'search_params': {}}
+        self.tombstones = np.zeros(0, dtype=np.int64)
+        self._tombstones_in_index = 0  # removed ids the index itself could not drop
+        self._pending_adds = []
+        self._pending_removes = []
+        self._partition = None
 
         if index_path and Path(index_path).exists():
             self.load()
 
-    def create_index(self, embeddings: np.ndarray, metadata: list):
+    def create_index(self, embeddings: np.ndarray, metadata: list, memory_budget_mb: float = None,
+                     target_recall: float = 0.95, index_type: str = None, nlist: int = None,
+                     hnsw_m: int = None, pq_m: int = None, pca_dim: int = None, whiten: bool = False,
+                     store_vectors: bool = None):
         """
         Create new FAISS index from embeddings.
 
         Args:
             embeddings: numpy array of shape (n, dimension)
-            metadata: list of dicts with lat, lon, image_path, source
+            metadata: list of dicts with lat, lon, image_path, source (or a
+                ColumnarMetadata with one row per embedding)
+            memory_budget_mb: RAM the index may use (None: unbounded)
+            target_recall: Recall@10 against exact search to aim for
+            index_type: Force flat, hnsw, ivf_fp16, ivf_sq8 or ivf_pq
+            nlist: IVF list count (default from the collection size)
+            hnsw_m: HNSW links per node
+            pq_m: PQ bytes per vector
+            pca_dim: Project vectors onto this many principal components
+                (trained here, stored in the index, applied to queries)
+            whiten: Whiten the principal components
+            store_vectors: Keep float16 copies for exact re-ranking (default:
+                when the index is compressed or PCA-reduced)
         """
         if not FAISS_AVAILABLE:
             logger.error("FAISS not available - cannot create index")
@@ -49,62 +238,382 @@ class PortugalImageIndex:
         n, d = embeddings.shape
         self.dimension = d
 
-        # Use IVF index for faster search on larger datasets
-        if n > 10000:
-            nlist = min(int(np.sqrt(n)), 256)
-            quantizer = faiss.IndexFlatIP(d)  # Inner product (cosine with normalized vectors)
-            self.index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+        # Inner product (cosine with normalized vectors); ids are metadata rows,
+        # stored natively by IVF and through an ID map otherwise
+        self.spec = choose_index(n, d, memory_budget_mb=memory_budget_mb,
+                                 target_recall=target_recall, index_type=index_type,
+                                 nlist=nlist, hnsw_m=hnsw_m, pq_m=pq_m, pca_dim=pca_dim, whiten=whiten)
+        self.index = build_index(embeddings, self.spec)
+        if self.spec.get('pca_dim'):
+            self.spec['pca'] = pca_report(self.index)
+            logger.info(f"PCA {d} -> {self.spec['pca_dim']} dimensions retains "
+                        f"{self.spec['pca']['retained_variance']:.1%} of the variance")
 
-            # Train the index
-            self.index.train(embeddings.astype('float32'))
-            self.index.add(embeddings.astype('float32'))
-        else:
-            # Simple flat index for smaller datasets
-            self.index = faiss.IndexFlatIP(d)
-            self.index.add(embeddings.astype('float32'))
+        if store_vectors is None:
+            store_vectors = self.spec['type'] != 'flat' or bool(self.spec.get('pca_dim'))
+        self.vectors = VectorStore.from_embeddings(embeddings) if store_vectors else None
 
+        if not isinstance(metadata, ColumnarMetadata):
+            metadata = ColumnarMetadata.from_records(metadata)
         self.metadata = metadata
-        logger.info(f"Created FAISS index with {n} vectors of dimension {d}")
+        self.delta_index = None
+        self.tombstones = np.zeros(0, dtype=np.int64)
+        self._tombstones_in_index = 0
+        self._pending_adds = []
+        self._pending_removes = []
+        logger.info(f"Created {self.spec['factory']} FAISS index with {n} vectors of dimension {d} "
+                    f"(~{self.spec['estimated_memory_mb']} MB, search params {self.spec['search_params']})")
 
-    def search(self, query_embedding: np.ndarray, top_k: int = 20) -> list:
+    def search(self, query_embedding: np.ndarray, top_k: int = 20, nprobe: int = None,
+               ef_search: int = None, geo_filter: GeoFilter = None, rerank: int = None) -> SearchHits:
         """
         Search for similar images.
 
         Args:
             query_embedding: Query image embedding (1, dimension)
             top_k: Number of results to return
+            nprobe: IVF lists to scan (default from the index spec)
+            ef_search: HNSW search breadth (default from the index spec)
+            geo_filter: Only score vectors located inside this area
+            rerank: Candidates to rescore exactly (default: the index's
+                rerank; 0 disables)
 
         Returns:
-            List of dicts with lat, lon, similarity, metadata
+            SearchHits, best first: a sequence of dicts with rank, similarity
+            and metadata, also exposing ids, similarity, lat and lon arrays
+            (empty when no index is loaded)
         """
         if not FAISS_AVAILABLE or self.index is None:
             logger.warning("No index available for search")
-            return []
+            return self._no_hits()
+
+        return self.search_many(query_embedding.reshape(1, -1), top_k=top_k, nprobe=nprobe,
+                                ef_search=ef_search, geo_filter=geo_filter, rerank=rerank)[0]
+
+    def search_many(self, query_embeddings: np.ndarray, top_k: int = 20, nprobe: int = None,
+                    ef_search: int = None, geo_filter=None, rerank: int = None) -> list:
+        """
+        Search for similar images for several queries in one FAISS call.
+
+        Args:
+            query_embeddings: Query embeddings of shape (n_queries, dimension)
+            top_k: Number of results to return per query
+            nprobe: IVF lists to scan (default from the index spec)
+            ef_search: HNSW search breadth (default from the index spec)
+            geo_filter: GeoFilter applied to every query, or a list with one
+                GeoFilter (or None for an unrestricted search) per query
+            rerank: Candidates to rescore exactly (see search)
+
+        Returns:
+            List (one entry per query, in order) of SearchHits as returned by search
+        """
+        if not FAISS_AVAILABLE or self.index is None:
+            logger.warning("No index available for search")
+            return [self._no_hits() for _ in range(len(query_embeddings))]
+
+        batch = self.search_batch(query_embeddings, top_k=top_k, nprobe=nprobe,
+                                  ef_search=ef_search, geo_filter=geo_filter, rerank=rerank)
+        return [
+            SearchHits(row_ids, row_sims, self.metadata)
+            for row_sims, row_ids in zip(batch.similarities, batch.ids)
+        ]
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int = 20, nprobe: int = None,
+                     ef_search: int = None, geo_filter=None, rerank: int = None) -> BatchHits:
+        """
+        Search a batch of queries and return plain arrays.
+
+        Unrestricted queries share one FAISS call over the whole
+        (n_queries, dimension) matrix; no per-hit Python objects are built.
+        With re-ranking, max(top_k, rerank) candidates are fetched and the
+        best top_k by exact cosine similarity are kept.
+
+        Args:
+            query_embeddings: Query embeddings of shape (n_queries, dimension)
+            top_k: Number of results per query
+            nprobe: IVF lists to scan (default from the index spec)
+            ef_search: HNSW search breadth (default from the index spec)
+            geo_filter: GeoFilter for every query, or a list with one per query
+            rerank: Candidates to rescore exactly (see search)
+
+        Returns:
+            BatchHits of (n_queries, top_k) arrays: similarities, ids, lat, lon
+        """
+        if query_embeddings.ndim == 1:
+            query_embeddings = query_embeddings.reshape(1, -1)
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype='float32')
+        n = len(query_embeddings)
+
+        similarities = np.full((n, top_k), -np.inf, dtype=np.float32)
+        ids = np.full((n, top_k), -1, dtype=np.int64)
+        if not FAISS_AVAILABLE or self.index is None or self.ntotal == 0:
+            return self._batch_hits(similarities, ids)
+
+        rerank = self.rerank if rerank is None else rerank
+        exact = bool(rerank) and self.has_exact_vectors
+        if exact and rerank > top_k:
+            final_k, top_k = top_k, rerank
+            similarities = np.full((n, top_k), -np.inf, dtype=np.float32)
+            ids = np.full((n, top_k), -1, dtype=np.int64)
+        else:
+            final_k = top_k
+
+        filters = geo_filter if isinstance(geo_filter, (list, tuple)) else [geo_filter] * n
+        unfiltered = [i for i, f in enumerate(filters) if f is None]
+        if unfiltered:
+            # Over-fetch when removed vectors are still inside the index
+            k = min(top_k + min(self._tombstones_in_index, top_k), self.ntotal)
+            found_sims, found_ids = self._index_search(query_embeddings[unfiltered], k,
+                                                       self._search_params(nprobe, ef_search))
+
+            valid = (found_ids >= 0) & (found_ids < len(self.metadata))
+            if self._tombstones_in_index:
+                valid &= ~np.isin(found_ids, self.tombstones)
+
+            # Move each row's valid hits to the front, keeping their order
+            order = np.argsort(~valid, axis=1, kind='stable')[:, :top_k]
+            keep = np.take_along_axis(valid, order, axis=1)
+            width = order.shape[1]
+            similarities[unfiltered, :width] = np.where(keep, np.take_along_axis(found_sims, order, axis=1), -np.inf)
+            ids[unfiltered, :width] = np.where(keep, np.take_along_axis(found_ids, order, axis=1), -1)
+
+        # A selector is per FAISS call, so restricted queries run one at a time
+        for i, f in enumerate(filters):
+            if f is not None:
+                row_sims, row_ids = self._search_within(query_embeddings[i:i + 1], top_k, f, nprobe, ef_search)
+                similarities[i, :len(row_ids)] = row_sims
+                ids[i, :len(row_ids)] = row_ids
+
+        if exact:
+            similarities, ids = self.vectors.rerank(query_embeddings, ids, final_k)
+        return self._batch_hits(similarities, ids)
+
+    def _no_hits(self) -> SearchHits:
+        return SearchHits(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32), self.metadata)
+
+    @property
+    def has_exact_vectors(self) -> bool:
+        """Whether every vector id has a full-precision copy to re-rank with"""
+        return self.vectors is not None and len(self.vectors) == len(self.metadata)
+
+    def _batch_hits(self, similarities: np.ndarray, ids: np.ndarray) -> BatchHits:
+        """Attach coordinates (NaN for padding) to padded result arrays"""
+        found = ids >= 0
+        lat = np.full(ids.shape, np.nan)
+        lon = np.full(ids.shape, np.nan)
+        if found.any():
+            lat[found] = self.metadata.lat[ids[found]]
+            lon[found] = self.metadata.lon[ids[found]]
+        return BatchHits(similarities, ids, lat, lon)
+
+    def _search_within(self, query: np.ndarray, top_k: int, geo_filter: GeoFilter,
+                       nprobe: int = None, ef_search: int = None) -> tuple:
+        """
+        Search only the vectors whose location lies inside a filter.
+
+        Returns:
+            (similarities, ids) of the hits, best first
+        """
+        ids = self.geo_partition().select(geo_filter)
+        if len(self.tombstones):
+            ids = ids[~np.isin(ids, self.tombstones)]
+        if not len(ids):
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+        selector = faiss.IDSelectorBatch(ids)
+        params = self._search_params(nprobe, ef_search, selector=selector,
+                                     selectivity=len(ids) / max(1, self.ntotal))
+        similarities, found = self._index_search(query, min(top_k, len(ids)), params, selector=selector)
+        valid = found[0] >= 0
+        return similarities[0][valid], found[0][valid]
+
+    def _index_search(self, queries: np.ndarray, k: int, params, selector=None) -> tuple:
+        """Search the index and the heap delta index beside it, merged best first"""
+        similarities, ids = self.index.search(queries, k, params=params)
+        if self.delta_index is None or not self.delta_index.ntotal:
+            return similarities, ids
+
+        delta_params = faiss.SearchParameters(sel=selector) if selector is not None else None
+        delta_sims, delta_ids = self.delta_index.search(queries, k, params=delta_params)
+        similarities, ids = np.hstack([similarities, delta_sims]), np.hstack([ids, delta_ids])
+        order = np.argsort(-similarities, axis=1, kind='stable')[:, :k]
+        return np.take_along_axis(similarities, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+    @property
+    def ntotal(self) -> int:
+        """Vectors held by the index and its heap delta index"""
+        if self.index is None:
+            return 0
+        return int(self.index.ntotal) + (int(self.delta_index.ntotal) if self.delta_index is not None else 0)
+
+    def _search_params(self, nprobe: int = None, ef_search: int = None, selector=None,
+                       selectivity: float = 1.0):
+        """
+        Per-query SearchParameters, falling back to the spec defaults.
+
+        With a selector that admits only a fraction of the vectors, nprobe
+        and efSearch grow by the inverse of that fraction so a restricted
+        search still finds top_k candidates.
+        """
+        defaults = self.spec.get('search_params', {})
+        nprobe = nprobe or defaults.get('nprobe')
+        ef_search = ef_search or defaults.get('ef_search')
+
+        if selectivity < 1.0:
+            boost = 1.0 / max(selectivity, 1e-6)
+            ivf = faiss.try_extract_index_ivf(self.index)
+            if nprobe and ivf is not None:
+                nprobe = int(min(ivf.nlist, np.ceil(nprobe * boost)))
+            if ef_search:
+                ef_search = int(min(MAX_FILTERED_EF_SEARCH, np.ceil(ef_search * boost)))
+
+        return search_parameters(self.index, nprobe=nprobe, ef_search=ef_search, selector=selector)
 
-        # Ensure correct shape
-        if query_embedding.ndim == 1:
-            query_embedding = query_embedding.reshape(1, -1)
-
-        # Search
-        similarities, indices = self.index.search(
-            query_embedding.astype('float32'),
-            min(top_k, self.index.ntotal)
-        )
-
-        results = []
-        for i, (sim, idx) in enumerate(zip(similarities[0], indices[0])):
-            if idx >= 0 and idx < len(self.metadata):
-                result = {
-                    'rank': i + 1,
-                    'similarity': float(sim),
-                    **self.metadata[idx]
-                }
-                results.append(result)
-
-        return results
-
-    def save(self, index_path: str = None, metadata_path: str = None):
-        """Save index and metadata to disk"""
+    def geo_partition(self) -> GridPartition:
+        """Grid partition of the metadata locations, rebuilt when rows are added"""
+        if self._partition is None or self._partition.count != len(self.metadata):
+            self._partition = GridPartition(self.metadata.lat, self.metadata.lon)
+            logger.info(f"Built grid partition over {len(self._partition.rows)} located vectors "
+                        f"({len(self._partition.cells)} cells)")
+        return self._partition
+
+    def add(self, embeddings: np.ndarray, metadata: list) -> np.ndarray:
+        """
+        Add vectors to the live index without rebuilding it.
+
+        Args:
+            embeddings: numpy array of shape (n, dimension)
+            metadata: list of metadata dicts (or a ColumnarMetadata), one per row
+
+        Returns:
+            int64 array of the ids assigned to the new vectors
+        """
+        if not FAISS_AVAILABLE:
+            logger.error("FAISS not available - cannot add to index")
+            return np.zeros(0, dtype=np.int64)
+
+        if not isinstance(metadata, ColumnarMetadata):
+            metadata = ColumnarMetadata.from_records(metadata)
+        if len(metadata) != len(embeddings):
+            raise ValueError(f"{len(embeddings)} embeddings but {len(metadata)} metadata rows")
+
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+        if self.index is None:
+            self.create_index(embeddings, metadata)
+            ids = np.arange(len(embeddings), dtype=np.int64)
+        else:
+            ids = np.arange(len(self.metadata), len(self.metadata) + len(embeddings), dtype=np.int64)
+            self._add_vectors(embeddings, ids)
+            self.metadata = self.metadata.append(metadata) if len(self.metadata) else metadata
+            if self.vectors is not None:
+                self.vectors.append(embeddings)
+
+        self._pending_adds.append((ids, embeddings, metadata))
+        logger.info(f"Added {len(ids)} vectors (ids {ids[0] if len(ids) else '-'}..)")
+        return ids
+
+    def remove(self, ids) -> int:
+        """
+        Remove vectors by id. Their metadata rows stay (ids are never reused)
+        but they no longer appear in search results.
+
+        Returns:
+            Number of ids newly removed
+        """
+        if not FAISS_AVAILABLE or self.index is None:
+            return 0
+
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        ids = ids[(ids >= 0) & (ids < len(self.metadata))]
+        ids = ids[~np.isin(ids, self.tombstones)]
+        if not len(ids):
+            return 0
+
+        if self.mapped_path is not None:
+            # A mapped index is read-only; filter these ids at search time
+            # unless they were added to the heap delta index
+            dropped = 0
+            if self.delta_index is not None:
+                dropped = self.delta_index.remove_ids(faiss.IDSelectorBatch(ids))
+            self._tombstones_in_index += len(ids) - dropped
+        else:
+            self._ensure_id_mapped()
+            try:
+                self.index.remove_ids(faiss.IDSelectorBatch(ids))
+            except RuntimeError:
+                # e.g. HNSW graphs cannot delete; filter these ids at search time
+                self._tombstones_in_index += len(ids)
+
+        self.tombstones = np.union1d(self.tombstones, ids)
+        self._pending_removes.append(ids)
+        logger.info(f"Removed {len(ids)} vectors")
+        return len(ids)
+
+    def _add_vectors(self, vectors: np.ndarray, ids: np.ndarray):
+        """Add to the index, or beside it in the heap delta index while it is mapped"""
+        if self.mapped_path is None:
+            self._ensure_id_mapped()
+            self.index.add_with_ids(vectors, ids)
+            return
+
+        if self.delta_index is None:
+            self.delta_index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.index.d))
+        self.delta_index.add_with_ids(np.ascontiguousarray(vectors, dtype='float32'), ids)
+
+    def _ensure_writable(self):
+        """Swap a memory-mapped (read-only) index for a private heap copy holding the delta index too"""
+        if self.mapped_path is None:
+            return
+
+        # FAISS aborts the process on writes to mapped storage
+        self.index = faiss.read_index(str(self.mapped_path))
+        self.mapped_path = None
+        logger.warning(f"Copied memory-mapped index into the heap to modify it "
+                       f"({self.index.ntotal} vectors); save() restores sharing")
+
+        if len(self.tombstones):
+            try:
+                self.index.remove_ids(faiss.IDSelectorBatch(self.tombstones))
+            except RuntimeError:
+                pass
+            self._tombstones_in_index = self._count_in_index(self.tombstones)
+
+        if self.delta_index is not None:
+            self._ensure_id_mapped()
+            delta = self.delta_index
+            self.index.add_with_ids(delta.index.reconstruct_n(0, delta.ntotal), faiss.vector_to_array(delta.id_map))
+            self.delta_index = None
+
+    def _ensure_id_mapped(self):
+        """
+        Make sure vectors can be added and removed by id.
+
+        IVF indexes store ids natively. Flat (or graph) indexes written by
+        older builds are positional; they are rebuilt once inside an ID map
+        whose ids are their positions, which are the metadata row numbers.
+        """
+        if isinstance(self.index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+            return
+        if faiss.try_extract_index_ivf(self.index) is not None:
+            return
+
+        vectors = self.index.reconstruct_n(0, self.index.ntotal)
+        inner = faiss.clone_index(self.index)
+        inner.reset()
+        mapped = faiss.IndexIDMap2(inner)
+        mapped.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+        self.index = mapped
+        logger.info(f"Wrapped positional index ({len(vectors)} vectors) in an ID map")
+
+    def save(self, index_path: str = None, metadata_path: str = None, legacy_json: bool = False):
+        """
+        Save index and metadata to disk.
+
+        Metadata is written as a columnar store (portugal_meta.cols next to
+        portugal_meta.json). With legacy_json, a .json metadata path also
+        gets the JSON list for older readers; it holds every row in memory
+        at once, so it is off by default.
+        """
         if not FAISS_AVAILABLE:
             return
 
@@ -112,32 +621,258 @@ class PortugalImageIndex:
         metadata_path = metadata_path or self.metadata_path
 
         if self.index and index_path:
-            faiss.write_index(self.index, str(index_path))
+            if (self._tombstones_in_index or self.delta_index is not None) and self.mapped_path is not None:
+                # Fold in added vectors and drop removed ones rather than carrying them
+                self._ensure_writable()
+
+            # Written beside and renamed over, so processes that have the old
+            # file mapped keep reading a complete copy
+            tmp_path = str(index_path) + '.tmp'
+            faiss.write_index(self.index, tmp_path)
+            os.replace(tmp_path, str(index_path))
+            np.save(Path(str(index_path) + TOMBSTONES_SUFFIX), self.tombstones)
+            save_params(index_path, self.spec)
+            if self.vectors is not None:
+                self.vectors.save(vectors_path(index_path))
+            else:
+                # Copies of an older index would not match these ids
+                vectors_path(index_path).unlink(missing_ok=True)
             logger.info(f"Saved FAISS index to {index_path}")
 
-        if self.metadata and metadata_path:
-            with open(metadata_path, 'w') as f:
-                json.dump(self.metadata, f)
-            logger.info(f"Saved metadata to {metadata_path}")
+        if len(self.metadata) and metadata_path:
+            if legacy_json and Path(metadata_path).suffix == '.json':
+                with open(metadata_path, 'w') as f:
+                    json.dump(list(self.metadata), f)
+                logger.info(f"Saved metadata to {metadata_path}")
+
+            # Written after the JSON so the columnar copy is the newer one
+            self.metadata.save(columnar_path(metadata_path))
+
+        # A full snapshot supersedes every delta segment
+        if index_path:
+            shutil.rmtree(Path(str(index_path) + DELTA_SUFFIX), ignore_errors=True)
+        self._pending_adds = []
+        self._pending_removes = []
 
-    def load(self, index_path: str = None, metadata_path: str = None):
-        """Load index and metadata from disk"""
+    def save_delta(self, index_path: str = None, auto_compact: bool = True) -> Path:
+        """
+        Persist adds and removes since the last save as one new delta segment.
+
+        The base snapshot is not touched; segments are replayed on load.
+        With auto_compact, the segments are folded into a new snapshot once
+        needs_compaction() says so. Segments are only replayed onto a base
+        snapshot, so an index that has none yet gets a full save instead.
+
+        Returns:
+            The segment directory, or None when nothing changed or a base
+            snapshot was written
+        """
+        index_path = index_path or self.index_path
+        if not (self._pending_adds or self._pending_removes) or not index_path:
+            return None
+
+        if not Path(index_path).exists():
+            logger.info(f"No base snapshot at {index_path} - saving the whole index")
+            self.save(index_path)
+            return None
+
+        delta_dir = Path(str(index_path) + DELTA_SUFFIX)
+        existing = sorted(delta_dir.glob('segment-*'))
+        number = int(existing[-1].name.split('-')[1]) + 1 if existing else 1
+        segment_dir = delta_dir / f"segment-{number:06d}"
+        segment_dir.mkdir(parents=True)
+
+        if self._pending_adds:
+            np.save(segment_dir / 'ids.npy', np.concatenate([ids for ids, _, _ in self._pending_adds]))
+            np.save(segment_dir / 'vectors.npy', np.vstack([vectors for _, vectors, _ in self._pending_adds]))
+            MetadataSegments([metadata for _, _, metadata in self._pending_adds]).save(segment_dir / 'meta.cols')
+        if self._pending_removes:
+            np.save(segment_dir / 'removed.npy', np.concatenate(self._pending_removes))
+
+        # Written last: a segment without its manifest is ignored on load
+        (segment_dir / 'segment.json').write_text(json.dumps({
+            'added': int(sum(len(ids) for ids, _, _ in self._pending_adds)),
+            'removed': int(sum(len(ids) for ids in self._pending_removes))
+        }))
+
+        self._pending_adds = []
+        self._pending_removes = []
+        logger.info(f"Saved delta segment {segment_dir}")
+
+        if auto_compact and index_path == self.index_path and self.needs_compaction():
+            self.compact()
+        return segment_dir
+
+    def compact(self, index_path: str = None, metadata_path: str = None):
+        """Fold the delta segments into a new base snapshot"""
+        metadata_path = metadata_path or self.metadata_path
+        if hasattr(self.metadata, 'compacted'):
+            self.metadata = self.metadata.compacted()
+        self.save(index_path, metadata_path)
+        logger.info(f"Compacted index ({self.index.ntotal if self.index else 0} live vectors, "
+                    f"{len(self.tombstones)} tombstones)")
+
+    def delta_segments(self, index_path: str = None) -> list:
+        """Complete delta segment directories, oldest first"""
+        index_path = index_path or self.index_path
+        if not index_path:
+            return []
+        delta_dir = Path(str(index_path) + DELTA_SUFFIX)
+        return [d for d in sorted(delta_dir.glob('segment-*')) if (d / 'segment.json').exists()]
+
+    def needs_compaction(self, max_segments: int = 16, max_delta_fraction: float = 0.1) -> bool:
+        """Whether the delta segments are numerous or large enough to compact"""
+        segments = self.delta_segments()
+        if len(segments) >= max_segments:
+            return True
+        delta_rows = sum(json.loads((d / 'segment.json').read_text())['added'] for d in segments)
+        return len(self.metadata) > 0 and delta_rows / len(self.metadata) > max_delta_fraction
+
+    def load(self, index_path: str = None, metadata_path: str = None, mmap: bool = None):
+        """
+        Load index and metadata from disk.
+
+        Args:
+            index_path: FAISS index file (default: the constructor's)
+            metadata_path: Metadata file (default: the constructor's)
+            mmap: Memory-map the index read-only (default: the constructor's)
+        """
         if not FAISS_AVAILABLE:
             return
 
         index_path = index_path or self.index_path
         metadata_path = metadata_path or self.metadata_path
+        mmap = self.mmap if mmap is None else mmap
 
         if index_path and Path(index_path).exists():
-            self.index = faiss.read_index(str(index_path))
-            logger.info(f"Loaded FAISS index with {self.index.ntotal} vectors")
+            if mmap and MMAP_FLAG is None:
+                logger.warning("This faiss release cannot memory-map indexes in place "
+                               "(no IO_FLAG_MMAP_IFC) - reading the index into the heap")
+                mmap = False
+            if mmap:
+                flags = MMAP_FLAG | faiss.IO_FLAG_READ_ONLY
+                self.index = faiss.read_index(str(index_path), flags)
+                self.mapped_path = Path(index_path)
+            else:
+                self.index = faiss.read_index(str(index_path))
+                self.mapped_path = None
+            self.delta_index = None
+            self.dimension = self.index.d
+            # Indexes built before the params file existed get defaults for their type
+            self.spec = load_params(index_path) or describe_index(self.index)
+            logger.info(f"{'Memory-mapped' if mmap else 'Loaded'} {self.spec['type']} FAISS index "
+                        f"with {self.index.ntotal} vectors (search params {self.spec.get('search_params')})")
+
+        if metadata_path:
+            self.metadata = self._load_metadata(Path(metadata_path))
+
+        self.vectors = None
+        if index_path and vectors_path(index_path).exists():
+            self.vectors = VectorStore.load(vectors_path(index_path))
+            if len(self.vectors) != len(self.metadata):
+                logger.warning(f"{vectors_path(index_path)} has {len(self.vectors)} vectors for "
+                               f"{len(self.metadata)} metadata rows - exact re-ranking disabled")
+                self.vectors = None
+
+        if index_path and self.index is not None:
+            tombstones_path = Path(str(index_path) + TOMBSTONES_SUFFIX)
+            if tombstones_path.exists():
+                self.tombstones = np.load(tombstones_path)
+                self._tombstones_in_index = self._count_in_index(self.tombstones)
+            self._replay_deltas(index_path)
+
+    def _count_in_index(self, ids: np.ndarray) -> int:
+        """How many of these ids the index still holds vectors for"""
+        if not len(ids):
+            return 0
+        if isinstance(self.index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+            held = faiss.vector_to_array(self.index.id_map)
+            return int(np.isin(ids, held).sum())
+        return 0
+
+    def _replay_deltas(self, index_path: str):
+        """Apply delta segments written after the base snapshot, in order"""
+        segments = self.delta_segments(index_path)
+        for segment_dir in segments:
+            if (segment_dir / 'ids.npy').exists():
+                ids = np.load(segment_dir / 'ids.npy')
+                if len(ids) and ids[0] != len(self.metadata):
+                    raise ValueError(f"Delta segment {segment_dir} does not follow the snapshot "
+                                     f"(starts at id {ids[0]}, expected {len(self.metadata)})")
+                vectors = np.load(segment_dir / 'vectors.npy')
+                self._add_vectors(vectors, ids)
+                self.metadata = self.metadata.append(ColumnarMetadata.load(segment_dir / 'meta.cols'))
+                if self.vectors is not None:
+                    self.vectors.append(vectors)
+
+            if (segment_dir / 'removed.npy').exists():
+                self.remove(np.load(segment_dir / 'removed.npy'))
+
+        # Replayed changes are already on disk
+        self._pending_adds = []
+        self._pending_removes = []
+        if segments:
+            logger.info(f"Replayed {len(segments)} delta segments "
+                        f"({self.ntotal} live vectors)")
+
+    def _load_metadata(self, metadata_path: Path) -> ColumnarMetadata:
+        """
+        Memory-map the columnar metadata store, converting legacy JSON once.
+
+        A JSON file newer than its columnar copy is re-converted, so indexes
+        written by older tools keep working.
+        """
+        store_dir = columnar_path(metadata_path)
+        json_exists = metadata_path.suffix == '.json' and metadata_path.exists()
+
+        if ColumnarMetadata.exists(store_dir):
+            manifest = store_dir / 'columns.json'
+            if not json_exists or manifest.stat().st_mtime >= metadata_path.stat().st_mtime:
+                metadata = ColumnarMetadata.load(store_dir)
+                logger.info(f"Memory-mapped {len(metadata)} metadata entries from {store_dir}")
+                return metadata
+
+        if not json_exists:
+            return ColumnarMetadata.from_records([])
+
+        with open(metadata_path, 'r') as f:
+            metadata = ColumnarMetadata.from_records(json.load(f))
+        logger.info(f"Loaded {len(metadata)} metadata entries from {metadata_path}")
+
+        try:
+            metadata.save(store_dir)
+            metadata = ColumnarMetadata.load(store_dir)
+        except OSError as e:
+            logger.warning(f"Could not write columnar metadata to {store_dir}: {e}")
+        return metadata
+
+    @property
+    def memory_stats(self) -> dict:
+        """
+        Memory held by the index and its metadata.
+
+        mapped_mb is address space backed by the files; resident_mb is the
+        part currently in RAM, shared by every process mapping them. A heap
+        index is private to this process and counted at its file size.
+        """
+        stats = {'mode': 'mmap' if self.mapped_path is not None else 'heap', 'process_rss_mb': process_rss_mb()}
+        if self.delta_index is not None:
+            stats['delta_vectors'] = int(self.delta_index.ntotal)
+
+        if self.index is not None and self.index_path and Path(self.index_path).exists():
+            stats['index_file_mb'] = round(Path(self.index_path).stat().st_size / MB, 1)
+            if self.mapped_path is not None:
+                stats['index'] = mapped_usage([self.mapped_path])
+            else:
+                stats['index'] = {'mapped_mb': 0.0, 'resident_mb': stats['index_file_mb']}
 
-        if metadata_path and Path(metadata_path).exists():
-            with open(metadata_path, 'r') as f:
-                self.metadata = json.load(f)
-            logger.info(f"Loaded {len(self.metadata)} metadata entries")
+        if self.metadata_path:
+            stats['metadata'] = mapped_usage([columnar_path(self.metadata_path)])
+        if self.vectors is not None and self.index_path:
+            stats['vectors'] = mapped_usage([vectors_path(self.index_path)])
+        return stats
 
     @property
     def is_available(self) -> bool:
         """Check if index is ready for search"""
-        return FAISS_AVAILABLE and self.index is not None and self.index.ntotal > 0
+        return FAISS_AVAILABLE and self.index is not None and self.ntotal > 0
@@ -0,0 +1,133 @@
+"""
+Spatial constraints for retrieval
+Restrict an index search to vectors whose metadata location lies inside a
+set of circles, using a grid partition of the columnar lat/lon arrays
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE_LAT = 111.32
+
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Great-circle distance in km (broadcasts over arrays)"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class GeoFilter:
+    """
+    Union of circles a search is restricted to.
+
+    Build one around a single point (circle) or around the coarse top-k
+    locations of an image (around).
+    """
+
+    def __init__(self, centers: np.ndarray, radius_km: float):
+        self.centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        self.radius_km = float(radius_km)
+
+    @classmethod
+    def circle(cls, lat: float, lon: float, radius_km: float) -> 'GeoFilter':
+        return cls([[lat, lon]], radius_km)
+
+    @classmethod
+    def around(cls, locations: list, radius_km: float) -> 'GeoFilter':
+        """Circles around dicts with lat/lon (e.g. a coarse prediction's top_k)"""
+        return cls([[loc['lat'], loc['lon']] for loc in locations], radius_km)
+
+    def __len__(self) -> int:
+        return len(self.centers)
+
+    def bounding_boxes(self) -> np.ndarray:
+        """(lat_min, lat_max, lon_min, lon_max) of each circle"""
+        lat, lon = self.centers[:, 0], self.centers[:, 1]
+        dlat = self.radius_km / KM_PER_DEGREE_LAT
+        dlon = self.radius_km / (KM_PER_DEGREE_LAT * np.maximum(np.cos(np.radians(lat)), 1e-6))
+        return np.column_stack([lat - dlat, lat + dlat, lon - dlon, lon + dlon])
+
+    def intersects(self, bounds) -> bool:
+        """Whether any circle can reach into a (lat_min, lat_max, lon_min, lon_max) box"""
+        boxes = self.bounding_boxes()
+        lat_min, lat_max, lon_min, lon_max = bounds
+        return bool(((boxes[:, 0] <= lat_max) & (boxes[:, 1] >= lat_min) &
+                     (boxes[:, 2] <= lon_max) & (boxes[:, 3] >= lon_min)).any())
+
+    def contains(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        """Boolean mask of the points inside any circle"""
+        inside = np.zeros(len(lat), dtype=bool)
+        for center_lat, center_lon in self.centers:
+            inside |= haversine_km(center_lat, center_lon, lat, lon) <= self.radius_km
+        return inside
+
+    def __repr__(self) -> str:
+        return f"GeoFilter({len(self)} circles, {self.radius_km:g} km)"
+
+
+class GridPartition:
+    """
+    Index rows bucketed into lat/lon grid cells.
+
+    Rows are sorted by cell once, so the rows of any cell are one contiguous
+    slice; a filter only looks at the cells its circles overlap and checks
+    exact distances for those rows alone.
+    """
+
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, cell_deg: float = 0.1):
+        """
+        Args:
+            lat: Latitude per row (NaN for rows without a location)
+            lon: Longitude per row
+            cell_deg: Cell size in degrees (0.1 is ~11 km north-south)
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        self.count = len(lat)
+        self.cell_deg = cell_deg
+
+        located = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+        keys = self._keys(lat[located], lon[located])
+        order = np.argsort(keys, kind='stable')
+
+        self.rows = located[order]
+        self.lat = lat[self.rows]
+        self.lon = lon[self.rows]
+        self.cells, self.starts = np.unique(keys[order], return_index=True)
+        self.ends = np.append(self.starts[1:], len(self.rows))
+
+    def _keys(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        return self._cell(lat, 90) * 10_000 + self._cell(lon, 180)
+
+    def _cell(self, value, offset: float):
+        return np.floor((np.asarray(value) + offset) / self.cell_deg).astype(np.int64)
+
+    def select(self, geo_filter: GeoFilter) -> np.ndarray:
+        """
+        Rows inside a filter.
+
+        Returns:
+            Sorted int64 array of row ids
+        """
+        slices = []
+        for lat_min, lat_max, lon_min, lon_max in geo_filter.bounding_boxes():
+            lat_cells = np.arange(self._cell(lat_min, 90), self._cell(lat_max, 90) + 1)
+            lon_cells = np.arange(self._cell(lon_min, 180), self._cell(lon_max, 180) + 1)
+            wanted = (lat_cells[:, None] * 10_000 + lon_cells[None, :]).ravel()
+
+            found = np.searchsorted(self.cells, wanted)
+            found = found[(found < len(self.cells))]
+            found = found[np.isin(self.cells[found], wanted)]
+            slices.extend(np.arange(self.starts[i], self.ends[i]) for i in found)
+
+        if not slices:
+            return np.zeros(0, dtype=np.int64)
+
+        positions = np.unique(np.concatenate(slices))
+        inside = geo_filter.contains(self.lat[positions], self.lon[positions])
+        return np.sort(self.rows[positions[inside]]).astype(np.int64)
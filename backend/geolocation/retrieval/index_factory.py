@@ -0,0 +1,291 @@
+"""
+FAISS index selection
+Picks an index type from the collection size, a memory budget and a target
+recall, and builds it with matching default search parameters
+"""
+
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Try to import faiss, but allow graceful fallback
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+PARAMS_SUFFIX = '.params.json'
+
+# Below this many vectors exact search is fast enough
+EXACT_SEARCH_MAX = 50_000
+
+HNSW_M = 32
+
+# Typical recall@10 of each type at its default search parameters, best first
+INDEX_TYPES = {
+    'flat': 1.0,
+    'hnsw': 0.98,
+    'ivf_fp16': 0.97,
+    'ivf_sq8': 0.95,
+    'ivf_pq': 0.85
+}
+
+
+def estimate_memory_mb(index_type: str, n: int, d: int, pq_m: int = None, hnsw_m: int = HNSW_M) -> float:
+    """Approximate resident size of an index holding n vectors of dimension d"""
+    per_vector = {
+        'flat': 4 * d + 8,
+        'hnsw': 4 * d + 8 + hnsw_m * 2 * 4 * 1.1,  # level-0 links plus upper layers
+        'ivf_fp16': 2 * d + 8,
+        'ivf_sq8': d + 8,
+        'ivf_pq': (pq_m or d // 8) + 8
+    }[index_type]
+    return n * per_vector / (1024 * 1024)
+
+
+def _nlist(n: int) -> int:
+    """IVF list count: ~4 sqrt(n), a power of two, with >= 39 training points per list"""
+    nlist = 1 << int(np.log2(max(1, 4 * np.sqrt(n))))
+    while nlist > 1 and n / nlist < 39:
+        nlist //= 2
+    return max(1, nlist)
+
+
+def _pq_m(n: int, d: int, memory_budget_mb: float) -> int:
+    """Largest PQ sub-quantizer count dividing d that fits the budget"""
+    candidates = [m for m in (96, 64, 48, 32, 24, 16, 12, 8, 4) if d % m == 0 and m <= d]
+    for m in candidates:
+        if memory_budget_mb is None or estimate_memory_mb('ivf_pq', n, d, pq_m=m) <= memory_budget_mb:
+            return m
+    return candidates[-1] if candidates else 1
+
+
+def default_search_params(spec: dict, target_recall: float = 0.95) -> dict:
+    """nprobe / efSearch that reach roughly the target recall for an index spec"""
+    if spec['type'] == 'hnsw':
+        return {'ef_search': 128 if target_recall >= 0.97 else 64}
+    if spec['type'].startswith('ivf'):
+        share = 0.1 if target_recall >= 0.97 else 0.05
+        return {'nprobe': int(np.clip(spec['nlist'] * share, min(8, spec['nlist']), 256))}
+    return {}
+
+
+def choose_index(n: int, d: int, memory_budget_mb: float = None, target_recall: float = 0.95,
+                 index_type: str = None, nlist: int = None, hnsw_m: int = None, pq_m: int = None,
+                 pca_dim: int = None, whiten: bool = False) -> dict:
+    """
+    Pick an index type for a collection.
+
+    Small collections get exact search. Larger ones get the most compact
+    type whose typical recall meets the target and whose estimated size
+    fits the budget; if none meets the target within budget, the most
+    accurate type that fits is used.
+
+    With pca_dim, vectors are projected onto their top principal
+    components (and re-normalized) before indexing. The projection is
+    trained with the index and stored inside it, so queries and later adds
+    go through it automatically; sizes and PQ splits use the reduced
+    dimension.
+
+    Args:
+        n: Number of vectors
+        d: Vector dimension
+        memory_budget_mb: Memory available for the index (None: unbounded)
+        target_recall: Required recall@10 against exact search
+        index_type: Force a type from INDEX_TYPES
+        nlist: IVF list count (default ~4 sqrt(n))
+        hnsw_m: HNSW links per node (default HNSW_M)
+        pq_m: PQ bytes per vector (default: the most that fit the budget)
+        pca_dim: Reduce vectors to this many dimensions (None: keep d)
+        whiten: Scale the principal components to unit variance
+
+    Returns:
+        Index spec dict (type, factory string, parameters, estimates)
+    """
+    if index_type is not None and index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type} (choose from {', '.join(INDEX_TYPES)})")
+
+    input_dimension = d
+    if pca_dim and pca_dim < d:
+        d = pca_dim
+    else:
+        pca_dim = None
+
+    pq_m = pq_m or _pq_m(n, d, memory_budget_mb)
+    hnsw_m = hnsw_m or HNSW_M
+
+    def fits(kind):
+        return memory_budget_mb is None or estimate_memory_mb(kind, n, d, pq_m, hnsw_m) <= memory_budget_mb
+
+    if index_type is None:
+        # Exact search over a national-scale index is too slow per query
+        candidates = list(INDEX_TYPES) if n <= EXACT_SEARCH_MAX else list(INDEX_TYPES)[1:]
+
+        fitting = [kind for kind in candidates if fits(kind)]
+        meeting = [kind for kind in fitting if INDEX_TYPES[kind] >= target_recall]
+        if 'flat' in meeting:
+            index_type = 'flat'
+        elif meeting:
+            index_type = meeting[-1]
+        elif fitting:
+            index_type = fitting[0]
+            logger.warning(f"No index type reaches recall {target_recall} within "
+                           f"{memory_budget_mb} MB - using {index_type}")
+        else:
+            index_type = 'ivf_pq'
+            logger.warning(f"Even IVF-PQ exceeds the {memory_budget_mb} MB budget")
+
+    nlist = nlist or _nlist(n)
+    factory = {
+        'flat': 'IDMap2,Flat',
+        'hnsw': f'IDMap2,HNSW{hnsw_m},Flat',
+        'ivf_fp16': f'IVF{nlist},SQfp16',
+        'ivf_sq8': f'IVF{nlist},SQ8',
+        'ivf_pq': f'IVF{nlist},PQ{pq_m}'
+    }[index_type]
+    if pca_dim:
+        transform = f"PCA{'W' if whiten else ''}{pca_dim},L2norm,"
+        factory = (f'IDMap2,{transform}' + factory[len('IDMap2,'):] if factory.startswith('IDMap2,')
+                   else transform + factory)
+
+    spec = {
+        'type': index_type,
+        'factory': factory,
+        'n': int(n),
+        'dimension': int(input_dimension),
+        'pca_dim': pca_dim,
+        'whiten': bool(whiten) if pca_dim else False,
+        'nlist': nlist if index_type.startswith('ivf') else None,
+        'pq_m': pq_m if index_type == 'ivf_pq' else None,
+        'hnsw_m': hnsw_m if index_type == 'hnsw' else None,
+        'estimated_memory_mb': round(estimate_memory_mb(index_type, n, d, pq_m, hnsw_m), 1),
+        'memory_budget_mb': memory_budget_mb,
+        'target_recall': target_recall,
+        'expected_recall': INDEX_TYPES[index_type]
+    }
+    spec['search_params'] = default_search_params(spec, target_recall)
+    return spec
+
+
+def build_index(embeddings: np.ndarray, spec: dict, train_size: int = 100_000, seed: int = 0):
+    """
+    Build and fill the index described by a spec.
+
+    Vectors get ids 0..n-1 (the metadata row numbers).
+
+    Args:
+        embeddings: float32 array of shape (n, d), L2-normalized
+        spec: Spec from choose_index
+        train_size: Vectors sampled to train IVF / quantizers
+        seed: Sampling seed
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    n, d = embeddings.shape
+
+    sample = embeddings
+    if n > train_size:
+        rows = np.random.default_rng(seed).choice(n, train_size, replace=False)
+        sample = embeddings[np.sort(rows)]
+
+    index = trained_index(spec, sample)
+    index.add_with_ids(embeddings, np.arange(n, dtype=np.int64))
+    return index
+
+
+def trained_index(spec: dict, sample: np.ndarray):
+    """
+    Empty index for a spec, trained on a sample when the type needs it.
+
+    Vectors are added afterwards with add_with_ids, e.g. chunk by chunk.
+    """
+    sample = np.ascontiguousarray(sample, dtype='float32')
+    index = faiss.index_factory(sample.shape[1], spec['factory'], faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        logger.info(f"Training {spec['factory']} on {len(sample)} vectors")
+        index.train(sample)
+    return index
+
+
+def search_parameters(index, nprobe: int = None, ef_search: int = None, selector=None):
+    """
+    Per-query FAISS SearchParameters for an index.
+
+    Returns:
+        SearchParameters object, or None when nothing applies
+    """
+    if faiss.try_extract_index_ivf(index) is not None:
+        kwargs = {'nprobe': int(nprobe)} if nprobe else {}
+        return faiss.SearchParametersIVF(sel=selector, **kwargs) if (kwargs or selector) else None
+
+    if isinstance(_inner_index(index), faiss.IndexHNSW):
+        kwargs = {'efSearch': int(ef_search)} if ef_search else {}
+        return faiss.SearchParametersHNSW(sel=selector, **kwargs) if (kwargs or selector) else None
+
+    return faiss.SearchParameters(sel=selector) if selector is not None else None
+
+
+def _inner_index(index):
+    """The index under any ID map and vector transform wrappers"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexPreTransform):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def pca_report(index) -> dict:
+    """
+    The PCA stage of an index: dimensions, whitening and retained variance.
+
+    Returns:
+        dict, or None when the index has no PCA stage
+    """
+    wrapped = faiss.downcast_index(index.index) if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) else index
+    if not isinstance(wrapped, faiss.IndexPreTransform):
+        return None
+
+    for i in range(wrapped.chain.size()):
+        transform = faiss.downcast_VectorTransform(wrapped.chain.at(i))
+        if isinstance(transform, faiss.PCAMatrix):
+            eigenvalues = faiss.vector_to_array(transform.eigenvalues)
+            total = float(eigenvalues.sum())
+            return {
+                'dimension_in': int(transform.d_in),
+                'dimension_out': int(transform.d_out),
+                'whiten': transform.eigen_power != 0,
+                'retained_variance': round(float(eigenvalues[:transform.d_out].sum()) / total, 4) if total > 0 else None
+            }
+    return None
+
+
+def describe_index(index) -> dict:
+    """Spec-like description of an index loaded without a params file"""
+    pca = pca_report(index)
+    pca_fields = {'pca_dim': pca['dimension_out'], 'whiten': pca['whiten']} if pca else {}
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        spec = {'type': 'ivf', 'nlist': int(ivf.nlist), **pca_fields}
+        spec['search_params'] = default_search_params({'type': 'ivf', 'nlist': int(ivf.nlist)})
+        return spec
+
+    if isinstance(_inner_index(index), faiss.IndexHNSW):
+        return {'type': 'hnsw', 'search_params': {'ef_search': 64}, **pca_fields}
+    return {'type': 'flat', 'search_params': {}, **pca_fields}
+
+
+def save_params(index_path: str, spec: dict):
+    """Record the index spec next to the index file"""
+    path = Path(str(index_path) + PARAMS_SUFFIX)
+    path.write_text(json.dumps(spec, indent=2))
+
+
+def load_params(index_path: str) -> dict:
+    """Index spec recorded by save_params, or None"""
+    path = Path(str(index_path) + PARAMS_SUFFIX)
+    return json.loads(path.read_text()) if path.exists() else None
@@ -0,0 +1,346 @@
+"""
+Columnar metadata store for the image index
+lat/lon as float32 arrays and text fields as offset-encoded string tables,
+memory-mapped so worker processes share one copy through the page cache
+"""
+
+import os
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'columns.json'
+COORD_COLUMNS = ('lat', 'lon')
+
+
+class ColumnarMetadata:
+    """
+    Per-vector metadata stored column by column.
+
+    Row i belongs to vector i of the index. Rows are only turned into dicts
+    on access (record / indexing), so millions of rows cost a few arrays
+    instead of millions of Python objects.
+
+    Column kinds:
+        float32: lat, lon
+        str: UTF-8 strings (offsets + bytes)
+        json: any other JSON value, stored as its JSON text
+    """
+
+    def __init__(self, columns: dict, kinds: dict, count: int):
+        self._columns = columns
+        self.kinds = kinds
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> dict:
+        return self.record(index)
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.record(i)
+
+    @property
+    def names(self) -> list:
+        return list(self.kinds)
+
+    @property
+    def lat(self) -> np.ndarray:
+        return self._columns['lat']
+
+    @property
+    def lon(self) -> np.ndarray:
+        return self._columns['lon']
+
+    def value(self, name: str, index: int):
+        """One field of one row (None when missing)"""
+        kind = self.kinds[name]
+        if kind == 'float32':
+            value = self._columns[name][index]
+            return None if np.isnan(value) else float(value)
+
+        offsets, data, valid = self._columns[name]
+        if valid is not None and not valid[index]:
+            return None
+        text = bytes(data[offsets[index]:offsets[index + 1]]).decode('utf-8')
+        return text if kind == 'str' else json.loads(text)
+
+    def record(self, index: int) -> dict:
+        """Row as a dict with the fields that are set"""
+        index = int(index)
+        if index < 0 or index >= self.count:
+            raise IndexError(index)
+
+        record = {}
+        for name in self.kinds:
+            value = self.value(name, index)
+            if value is not None:
+                record[name] = value
+        return record
+
+    @classmethod
+    def from_records(cls, records: list) -> 'ColumnarMetadata':
+        """Build in-memory columns from a list of metadata dicts"""
+        count = len(records)
+        names = []
+        for record in records:
+            for name in record:
+                if name not in names:
+                    names.append(name)
+        for name in COORD_COLUMNS:
+            if name not in names:
+                names.append(name)
+
+        columns = {}
+        kinds = {}
+        for name in names:
+            values = [record.get(name) for record in records]
+
+            if name in COORD_COLUMNS:
+                columns[name] = np.array([np.nan if v is None else v for v in values], dtype=np.float32)
+                kinds[name] = 'float32'
+                continue
+
+            kind = 'str' if all(v is None or isinstance(v, str) for v in values) else 'json'
+            encoded = [
+                None if v is None else (v if kind == 'str' else json.dumps(v)).encode('utf-8')
+                for v in values
+            ]
+            columns[name] = _string_table(encoded)
+            kinds[name] = kind
+
+        return cls(columns, kinds, count)
+
+    def save(self, store_dir: str):
+        """Write every column as .npy files plus a manifest"""
+        store_dir = Path(store_dir)
+        store_dir.mkdir(parents=True, exist_ok=True)
+
+        for name, kind in self.kinds.items():
+            if kind == 'float32':
+                _save_array(store_dir / f"{name}.npy", np.asarray(self._columns[name], dtype=np.float32))
+                continue
+
+            offsets, data, valid = self._columns[name]
+            _save_array(store_dir / f"{name}.offsets.npy", np.asarray(offsets, dtype=np.int64))
+            _save_array(store_dir / f"{name}.data.npy", np.asarray(data, dtype=np.uint8))
+            if valid is not None:
+                _save_array(store_dir / f"{name}.valid.npy", np.asarray(valid, dtype=bool))
+            else:
+                # A mask left by an earlier save would mark these rows missing
+                (store_dir / f"{name}.valid.npy").unlink(missing_ok=True)
+
+        manifest = {'count': self.count, 'columns': self.kinds}
+        tmp_path = store_dir / (MANIFEST_FILE + '.tmp')
+        tmp_path.write_text(json.dumps(manifest, indent=2))
+        os.replace(tmp_path, store_dir / MANIFEST_FILE)
+        logger.info(f"Saved {self.count} metadata rows ({len(self.kinds)} columns) to {store_dir}")
+
+    @classmethod
+    def load(cls, store_dir: str, mmap: bool = True) -> 'ColumnarMetadata':
+        """Open a saved store; arrays are memory-mapped unless mmap is False"""
+        store_dir = Path(store_dir)
+        manifest = json.loads((store_dir / MANIFEST_FILE).read_text())
+        mode = 'r' if mmap else None
+
+        columns = {}
+        for name, kind in manifest['columns'].items():
+            if kind == 'float32':
+                columns[name] = np.load(store_dir / f"{name}.npy", mmap_mode=mode)
+                continue
+
+            valid_path = store_dir / f"{name}.valid.npy"
+            columns[name] = (
+                np.load(store_dir / f"{name}.offsets.npy", mmap_mode=mode),
+                np.load(store_dir / f"{name}.data.npy", mmap_mode=mode),
+                np.load(valid_path, mmap_mode=mode) if valid_path.exists() else None
+            )
+
+        return cls(columns, manifest['columns'], manifest['count'])
+
+    @staticmethod
+    def exists(store_dir: str) -> bool:
+        return (Path(store_dir) / MANIFEST_FILE).exists()
+
+    def take(self, rows: np.ndarray) -> 'ColumnarMetadata':
+        """In-memory store holding the given rows, in the given order"""
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = {}
+        for name, kind in self.kinds.items():
+            if kind == 'float32':
+                columns[name] = np.asarray(self._columns[name][rows], dtype=np.float32)
+                continue
+
+            offsets, data, valid = self._columns[name]
+            starts = np.asarray(offsets[rows], dtype=np.int64)
+            lengths = np.asarray(offsets[rows + 1], dtype=np.int64) - starts
+            new_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=new_offsets[1:])
+            # Byte positions of every taken string, in output order
+            source = np.repeat(starts - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+            columns[name] = (
+                new_offsets,
+                np.asarray(data, dtype=np.uint8)[source],
+                None if valid is None else np.asarray(valid[rows], dtype=bool)
+            )
+
+        return ColumnarMetadata(columns, dict(self.kinds), len(rows))
+
+    def append(self, other: 'ColumnarMetadata') -> 'MetadataSegments':
+        """This store followed by another, without copying either"""
+        return MetadataSegments([self, other])
+
+    @property
+    def segments(self) -> list:
+        return [self]
+
+
+class MetadataSegments:
+    """
+    Several metadata stores read as one, rows numbered consecutively.
+
+    Used while delta segments are layered on a base snapshot; compaction
+    collapses them back into one ColumnarMetadata.
+    """
+
+    def __init__(self, segments: list):
+        self.segments = []
+        for segment in segments:
+            self.segments.extend(segment.segments)
+        self.starts = np.cumsum([0] + [len(segment) for segment in self.segments])
+        self._coords = {}
+
+    def __len__(self) -> int:
+        return int(self.starts[-1])
+
+    def __getitem__(self, index: int) -> dict:
+        return self.record(index)
+
+    def __iter__(self):
+        for segment in self.segments:
+            yield from segment
+
+    @property
+    def kinds(self) -> dict:
+        kinds = {}
+        for segment in self.segments:
+            for name, kind in segment.kinds.items():
+                kinds[name] = 'json' if kinds.get(name, kind) != kind else kind
+        return kinds
+
+    @property
+    def lat(self) -> np.ndarray:
+        return self._coord('lat')
+
+    @property
+    def lon(self) -> np.ndarray:
+        return self._coord('lon')
+
+    def _coord(self, name: str) -> np.ndarray:
+        if name not in self._coords:
+            self._coords[name] = np.concatenate([getattr(segment, name) for segment in self.segments])
+        return self._coords[name]
+
+    def record(self, index: int) -> dict:
+        index = int(index)
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        s = int(np.searchsorted(self.starts, index, side='right')) - 1
+        return self.segments[s].record(index - int(self.starts[s]))
+
+    def append(self, other) -> 'MetadataSegments':
+        return MetadataSegments([self, other])
+
+    def take(self, rows: np.ndarray) -> ColumnarMetadata:
+        return self.compacted().take(rows)
+
+    def compacted(self) -> ColumnarMetadata:
+        """One in-memory store holding every row"""
+        return concat_metadata(self.segments)
+
+    def save(self, store_dir: str):
+        self.compacted().save(store_dir)
+
+
+def concat_metadata(stores: list) -> ColumnarMetadata:
+    """Concatenate stores column by column; missing fields become unset"""
+    kinds = MetadataSegments(stores).kinds
+    for name in COORD_COLUMNS:
+        kinds.setdefault(name, 'float32')
+
+    columns = {}
+    for name, kind in kinds.items():
+        if kind == 'float32':
+            columns[name] = np.concatenate([
+                np.asarray(store._columns[name], dtype=np.float32) if name in store.kinds
+                else np.full(len(store), np.nan, dtype=np.float32)
+                for store in stores
+            ])
+            continue
+
+        offsets, data, valid = [np.zeros(1, dtype=np.int64)], [], []
+        for store in stores:
+            if store.kinds.get(name) == kind:
+                part_offsets, part_data, part_valid = store._columns[name]
+                part_valid = np.ones(len(store), dtype=bool) if part_valid is None else part_valid
+            else:
+                # Field missing from this store, or stored as text and promoted to json
+                encoded = [None] * len(store)
+                if name in store.kinds:
+                    encoded = [
+                        None if v is None else json.dumps(v).encode('utf-8')
+                        for v in (store.value(name, i) for i in range(len(store)))
+                    ]
+                part_offsets, part_data, part_valid = _string_table(encoded)
+                part_valid = np.ones(len(store), dtype=bool) if part_valid is None else part_valid
+
+            offsets.append(np.asarray(part_offsets[1:], dtype=np.int64) + offsets[-1][-1])
+            data.append(np.asarray(part_data, dtype=np.uint8))
+            valid.append(np.asarray(part_valid, dtype=bool))
+
+        valid = np.concatenate(valid) if valid else np.zeros(0, dtype=bool)
+        columns[name] = (
+            np.concatenate(offsets),
+            np.concatenate(data) if data else np.zeros(0, dtype=np.uint8),
+            None if valid.all() else valid
+        )
+
+    return ColumnarMetadata(columns, kinds, sum(len(store) for store in stores))
+
+
+def _save_array(path: Path, array: np.ndarray):
+    """
+    Write an .npy file beside the target and rename it over.
+
+    The store being saved may itself be memory-mapped from these files
+    (here or in another worker); the old mapping keeps its complete copy.
+    """
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def _string_table(encoded: list) -> tuple:
+    """(offsets, bytes, validity or None) for a list of encoded strings"""
+    lengths = np.array([0 if e is None else len(e) for e in encoded], dtype=np.int64)
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    data = np.frombuffer(b''.join(e for e in encoded if e is not None), dtype=np.uint8)
+
+    valid = np.array([e is not None for e in encoded], dtype=bool)
+    return offsets, data, None if valid.all() else valid
+
+
+def columnar_path(metadata_path: str) -> Path:
+    """Directory holding the columnar copy of a legacy JSON metadata file"""
+    metadata_path = Path(metadata_path)
+    if metadata_path.suffix == '.json':
+        return metadata_path.with_suffix('.cols')
+    return metadata_path
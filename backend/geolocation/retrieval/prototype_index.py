@@ -0,0 +1,305 @@
+"""
+Location-prototype retrieval index
+Photos of the same place (rounded coordinate or building id) are reduced to
+a few centroid vectors, so index size and search cost follow the number of
+distinct places rather than the number of photos
+"""
+
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from .faiss_index import PortugalImageIndex, BatchHits, SearchHits
+from .metadata_store import ColumnarMetadata
+from .vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'prototypes.json'
+
+
+def location_keys(metadata, decimals: int = 4, field: str = None) -> np.ndarray:
+    """
+    Place key of every row: a metadata field (e.g. an OSM building id) where
+    set, else the coordinate rounded to `decimals` (4: ~10 m). Rows without
+    a location get None.
+    """
+    lat = np.asarray(metadata.lat, dtype=np.float64)
+    lon = np.asarray(metadata.lon, dtype=np.float64)
+    keys = np.empty(len(metadata), dtype=object)
+    for i in range(len(metadata)):
+        value = metadata.value(field, i) if field and field in metadata.kinds else None
+        if value is not None:
+            keys[i] = f"{field}:{value}"
+        elif np.isfinite(lat[i]) and np.isfinite(lon[i]):
+            keys[i] = f"{lat[i]:.{decimals}f},{lon[i]:.{decimals}f}"
+    return keys
+
+
+def spherical_kmeans(vectors: np.ndarray, k: int, iterations: int = 10) -> tuple:
+    """
+    Cluster unit vectors by cosine similarity.
+
+    Returns:
+        (unit centroids of shape (k, dimension), assignment per vector)
+    """
+    if k <= 1 or len(vectors) <= 1:
+        centroid = vectors.mean(axis=0, keepdims=True)
+        return centroid / max(np.linalg.norm(centroid), 1e-12), np.zeros(len(vectors), dtype=np.int64)
+
+    # Farthest-point seeding: deterministic and spreads the centroids
+    seeds = [0]
+    closest = vectors @ vectors[0]
+    for _ in range(1, k):
+        seeds.append(int(np.argmin(closest)))
+        closest = np.maximum(closest, vectors @ vectors[seeds[-1]])
+    centroids = vectors[seeds].copy()
+
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(k):
+            members = vectors[assignment == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+    assignment = np.argmax(vectors @ centroids.T, axis=1)
+    used = np.unique(assignment)
+    return centroids[used], np.searchsorted(used, assignment)
+
+
+class PrototypeImageIndex:
+    """
+    Retrieval index over per-location prototype vectors.
+
+    Layout of index_dir:
+        prototypes.json          grouping settings and counts
+        prototypes.faiss         PortugalImageIndex of the prototypes (with
+        prototypes.cols          params, exact vectors and metadata)
+        members.npz              photo rows of every prototype (CSR)
+        photos.vectors.npy       per-photo float16 vectors, for drill-down
+        photos.cols              per-photo metadata, for drill-down
+
+    A prototype's metadata is that of its most central photo, with the
+    mean location of its photos, location_key and photo_count. Searches
+    return prototype hits in the same form as PortugalImageIndex; with
+    drill_down, each hit is rescored as its best-matching photo.
+    """
+
+    def __init__(self, index_dir: str = None, mmap: bool = False, rerank: int = 0, drill_down: bool = False):
+        """
+        Args:
+            index_dir: Directory holding prototypes.json and the index files
+            mmap: Memory-map the prototype index instead of reading it into the heap
+            rerank: Candidates the prototype index rescores exactly (0: off)
+            drill_down: Rescore hits as their best photo by default
+        """
+        self.index_dir = Path(index_dir) if index_dir else None
+        self.mmap = mmap
+        self.rerank = rerank
+        self.drill_down = drill_down
+        self.manifest = {}
+        self.prototypes = PortugalImageIndex(rerank=rerank)
+        self.member_offsets = np.zeros(1, dtype=np.int64)
+        self.member_rows = np.zeros(0, dtype=np.int64)
+        self.photo_vectors = None
+        self.photo_metadata = None
+
+        if index_dir and self.exists(index_dir):
+            self.load()
+
+    @staticmethod
+    def exists(index_dir: str) -> bool:
+        return (Path(index_dir) / MANIFEST_FILE).exists()
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, metadata, index_dir: str = None, decimals: int = 4,
+              field: str = None, max_prototypes: int = 3, photos_per_prototype: int = 4,
+              keep_photos: bool = True, rerank: int = 0, **index_options) -> 'PrototypeImageIndex':
+        """
+        Group photos by place and index one to max_prototypes centroids per place.
+
+        Args:
+            embeddings: numpy array of shape (n, dimension)
+            metadata: list of metadata dicts or a ColumnarMetadata
+            index_dir: Save the index here (None: keep it in memory)
+            decimals: Coordinate rounding that defines a place
+            field: Metadata field naming a place (e.g. osm_id), used where set
+            max_prototypes: Centroids per place at most
+            photos_per_prototype: Photos a place needs per extra centroid
+            keep_photos: Keep per-photo vectors and metadata for drill-down
+            rerank: Candidates the prototype index rescores exactly
+            **index_options: Passed to PortugalImageIndex.create_index
+        """
+        if not isinstance(metadata, ColumnarMetadata):
+            metadata = ColumnarMetadata.from_records(metadata)
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        unit = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        lat = np.asarray(metadata.lat, dtype=np.float64)
+        lon = np.asarray(metadata.lon, dtype=np.float64)
+
+        keys = location_keys(metadata, decimals, field)
+        located = np.flatnonzero([key is not None for key in keys])
+        _, first, inverse = np.unique(keys[located].astype(str), return_index=True, return_inverse=True)
+        by_place = located[np.argsort(inverse, kind='stable')]
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(inverse, minlength=len(first)))])
+
+        vectors, records, offsets, members = [], [], [0], []
+        for place in np.argsort(first):  # places in order of first appearance
+            rows = by_place[bounds[place]:bounds[place + 1]]
+            k = min(max_prototypes, max(1, len(rows) // max(1, photos_per_prototype)))
+            centroids, assignment = spherical_kmeans(unit[rows], k)
+            for c, centroid in enumerate(centroids):
+                photo_rows = rows[assignment == c]
+                central = photo_rows[np.argmax(unit[photo_rows] @ centroid)]
+                vectors.append(centroid)
+                records.append({
+                    **metadata.record(central),
+                    'lat': float(np.nanmean(lat[photo_rows])),
+                    'lon': float(np.nanmean(lon[photo_rows])),
+                    'location_key': str(keys[central]),
+                    'photo_count': int(len(photo_rows))
+                })
+                members.append(photo_rows)
+                offsets.append(offsets[-1] + len(photo_rows))
+
+        index = cls(rerank=rerank)
+        index.manifest = {
+            'decimals': decimals,
+            'field': field,
+            'max_prototypes': max_prototypes,
+            'photos_per_prototype': photos_per_prototype,
+            'photos': int(len(metadata)),
+            'located_photos': int(len(located)),
+            'places': int(len(first)),
+            'prototypes': len(vectors)
+        }
+        if vectors:
+            index.prototypes.create_index(np.vstack(vectors).astype(np.float32),
+                                          ColumnarMetadata.from_records(records), **index_options)
+        index.member_offsets = np.asarray(offsets, dtype=np.int64)
+        index.member_rows = np.concatenate(members) if members else np.zeros(0, dtype=np.int64)
+        if keep_photos:
+            index.photo_vectors = VectorStore.from_embeddings(embeddings)
+            index.photo_metadata = metadata
+
+        logger.info(f"Built {len(vectors)} prototypes for {index.manifest['places']} places "
+                    f"from {len(metadata)} photos")
+        if index_dir:
+            index.save(index_dir)
+        return index
+
+    def save(self, index_dir: str = None):
+        index_dir = Path(index_dir or self.index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        self.prototypes.save(str(index_dir / 'prototypes.faiss'), str(index_dir / 'prototypes.cols'))
+        np.savez(index_dir / 'members.npz', offsets=self.member_offsets, rows=self.member_rows)
+        if self.photo_vectors is not None:
+            self.photo_vectors.save(index_dir / 'photos.vectors.npy')
+            self.photo_metadata.save(index_dir / 'photos.cols')
+
+        # Written last: its presence marks a complete index
+        tmp = index_dir / (MANIFEST_FILE + '.tmp')
+        tmp.write_text(json.dumps(self.manifest, indent=2))
+        tmp.replace(index_dir / MANIFEST_FILE)
+        self.index_dir = index_dir
+        logger.info(f"Saved prototype index to {index_dir}")
+
+    def load(self, index_dir: str = None):
+        index_dir = Path(index_dir or self.index_dir)
+        self.manifest = json.loads((index_dir / MANIFEST_FILE).read_text())
+        self.prototypes = PortugalImageIndex(str(index_dir / 'prototypes.faiss'), str(index_dir / 'prototypes.cols'),
+                                             mmap=self.mmap, rerank=self.rerank)
+        with np.load(index_dir / 'members.npz') as data:
+            self.member_offsets = data['offsets']
+            self.member_rows = data['rows']
+
+        self.photo_vectors = self.photo_metadata = None
+        if (index_dir / 'photos.vectors.npy').exists() and ColumnarMetadata.exists(index_dir / 'photos.cols'):
+            self.photo_vectors = VectorStore.load(index_dir / 'photos.vectors.npy')
+            self.photo_metadata = ColumnarMetadata.load(index_dir / 'photos.cols')
+        self.index_dir = index_dir
+        logger.info(f"Loaded {self.manifest['prototypes']} prototypes for {self.manifest['places']} places "
+                    f"({self.manifest['photos']} photos)")
+
+    def members(self, prototype_id: int) -> np.ndarray:
+        """Photo rows a prototype stands for"""
+        return self.member_rows[self.member_offsets[prototype_id]:self.member_offsets[prototype_id + 1]]
+
+    def photos(self, prototype_id: int) -> list:
+        """Metadata of a prototype's photos (empty when photos were not kept)"""
+        if self.photo_metadata is None:
+            return []
+        return [self.photo_metadata.record(row) for row in self.members(prototype_id)]
+
+    def search(self, query_embedding: np.ndarray, top_k: int = 20, drill_down: bool = None,
+               **search_options) -> SearchHits:
+        """Search for similar places (see PortugalImageIndex.search)"""
+        return self.search_many(query_embedding.reshape(1, -1), top_k=top_k, drill_down=drill_down,
+                                **search_options)[0]
+
+    def search_many(self, query_embeddings: np.ndarray, top_k: int = 20, drill_down: bool = None,
+                    **search_options) -> list:
+        """
+        Search several queries over the prototypes.
+
+        Args:
+            query_embeddings: Query embeddings of shape (n_queries, dimension)
+            top_k: Places to return per query
+            drill_down: Rescore each hit as its best-matching photo
+                (default: the index's drill_down)
+            **search_options: nprobe, ef_search, geo_filter, rerank (see
+                PortugalImageIndex.search_many)
+
+        Returns:
+            List of SearchHits over prototype metadata, one per query
+        """
+        batch = self.search_batch(query_embeddings, top_k=top_k, drill_down=drill_down, **search_options)
+        return [SearchHits(row_ids, row_sims, self.prototypes.metadata)
+                for row_sims, row_ids in zip(batch.similarities, batch.ids)]
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int = 20, drill_down: bool = None,
+                     **search_options) -> BatchHits:
+        """Padded result arrays over the prototypes (see PortugalImageIndex.search_batch)"""
+        if query_embeddings.ndim == 1:
+            query_embeddings = query_embeddings.reshape(1, -1)
+        batch = self.prototypes.search_batch(query_embeddings, top_k=top_k, **search_options)
+        drill_down = self.drill_down if drill_down is None else drill_down
+        if not drill_down or self.photo_vectors is None:
+            return batch
+
+        ids = batch.ids
+        found = ids >= 0
+        if not found.any():
+            return batch
+
+        # Every photo of every hit, scored against its own query
+        hit_ids = ids[found]
+        starts, ends = self.member_offsets[hit_ids], self.member_offsets[hit_ids + 1]
+        counts = ends - starts
+        photo_rows = self.member_rows[np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())]
+        queries = query_embeddings / np.maximum(np.linalg.norm(query_embeddings, axis=1, keepdims=True), 1e-12)
+        query_rows = np.repeat(np.nonzero(found)[0], counts)
+
+        unique, inverse = np.unique(photo_rows, return_inverse=True)
+        scores = np.einsum('ij,ij->i', self.photo_vectors.take(unique)[inverse],
+                           queries[query_rows].astype(np.float32))
+        best = np.maximum.reduceat(scores, np.cumsum(counts) - counts)
+
+        similarities = np.full(ids.shape, -np.inf, dtype=np.float32)
+        similarities[found] = best
+        order = np.argsort(-similarities, axis=1, kind='stable')
+        return BatchHits(*(np.take_along_axis(a, order, axis=1) for a in (similarities, ids, batch.lat, batch.lon)))
+
+    @property
+    def is_available(self) -> bool:
+        return self.prototypes.is_available
+
+    @property
+    def memory_stats(self) -> dict:
+        stats = self.prototypes.memory_stats
+        stats['prototypes'] = self.manifest.get('prototypes')
+        stats['photos'] = self.manifest.get('photos')
+        return stats
@@ -0,0 +1,258 @@
+"""
+Scatter-gather retrieval over index servers
+Each index_server.py process serves one shard over HTTP; queries fan out to
+every shard concurrently and the per-shard top-k are merged by similarity,
+so the index can grow past one machine's RAM
+"""
+
+import time
+import base64
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+
+from .geo_filter import GeoFilter
+from .sharded_index import ShardHits
+
+logger = logging.getLogger(__name__)
+
+# Shard health (vector count, bounds) is refreshed this often
+HEALTH_TTL_SECONDS = 30
+
+
+def encode_queries(queries: np.ndarray) -> dict:
+    """Query matrix as JSON-safe base64 float32"""
+    queries = np.ascontiguousarray(queries, dtype='<f4')
+    return {'data': base64.b64encode(queries.tobytes()).decode('ascii'), 'shape': list(queries.shape)}
+
+
+def decode_queries(payload: dict) -> np.ndarray:
+    data = base64.b64decode(payload['data'])
+    return np.frombuffer(data, dtype='<f4').reshape(payload['shape']).astype(np.float32)
+
+
+def encode_filter(geo_filter: GeoFilter):
+    if geo_filter is None:
+        return None
+    return {'centers': geo_filter.centers.tolist(), 'radius_km': geo_filter.radius_km}
+
+
+def decode_filter(payload) -> GeoFilter:
+    if payload is None:
+        return None
+    return GeoFilter(payload['centers'], payload['radius_km'])
+
+
+class RemoteHits:
+    """
+    Hits of one query as returned by an index server.
+
+    Same interface as SearchHits, built from the hit dicts and ids of the
+    response.
+    """
+
+    def __init__(self, hits: list, ids: list):
+        self._hits = hits
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.similarity = np.array([hit['similarity'] for hit in hits], dtype=np.float32)
+
+    @property
+    def lat(self) -> np.ndarray:
+        return np.array([hit.get('lat', np.nan) for hit in self._hits], dtype=np.float64)
+
+    @property
+    def lon(self) -> np.ndarray:
+        return np.array([hit.get('lon', np.nan) for hit in self._hits], dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self._hits)
+
+    def __getitem__(self, i):
+        return self._hits[i]
+
+    def __iter__(self):
+        return iter(self._hits)
+
+    def to_dicts(self, limit: int = None) -> list:
+        return self._hits[:limit]
+
+
+class RemoteShardIndex:
+    """
+    Retrieval index made of shards served by index_server.py processes.
+
+    Every query batch is sent to the shards it can reach (all of them, or
+    the ones whose bounds a geo filter overlaps) in parallel. A shard that
+    fails or does not answer within `timeout` seconds is left out and the
+    other shards' hits are merged anyway; ShardHits.missing names the
+    shards a result lacks.
+    """
+
+    def __init__(self, urls: list, timeout: float = 2.0, max_workers: int = None):
+        """
+        Args:
+            urls: Base URLs of the index servers (e.g. http://10.0.0.5:8101)
+            timeout: Seconds to wait for each shard
+            max_workers: Concurrent requests (default: one per shard)
+        """
+        self.urls = [url.rstrip('/') for url in urls]
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or max(1, len(self.urls)),
+                                        thread_name_prefix='index-remote')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._health = {}  # url -> (checked at, health dict or None)
+        self._counters = {url: {'requests': 0, 'failures': 0, 'timeouts': 0} for url in self.urls}
+
+    def _session(self):
+        # requests sessions are not thread-safe; one per pool thread
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            import requests
+
+            session = self._local.session = requests.Session()
+        return session
+
+    def health(self, url: str, refresh: bool = False) -> dict:
+        """A server's /health answer (cached), or None when it is unreachable"""
+        with self._lock:
+            checked, health = self._health.get(url, (0, None))
+        if not refresh and time.monotonic() - checked < HEALTH_TTL_SECONDS:
+            return health
+
+        try:
+            response = self._session().get(f"{url}/health", timeout=self.timeout)
+            response.raise_for_status()
+            health = response.json()
+        except Exception as e:
+            logger.warning(f"Index server {url} unavailable: {e}")
+            health = None
+        with self._lock:
+            self._health[url] = (time.monotonic(), health)
+        return health
+
+    def _healths(self) -> dict:
+        """
+        Every server's health; expired entries are re-checked concurrently.
+
+        A server found unreachable stays out until its entry expires, so a
+        dead server costs at most one timeout per TTL rather than a
+        blocking check on every query.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = {url: self._health.get(url, (0, None)) for url in self.urls}
+        stale = [url for url, (checked, _) in cached.items() if now - checked >= HEALTH_TTL_SECONDS]
+        healths = {url: health for url, (_, health) in cached.items()}
+        healths.update(zip(stale, self._pool.map(self.health, stale, [True] * len(stale))))
+        return healths
+
+    def shards_for(self, geo_filter: GeoFilter = None, healths: dict = None) -> list:
+        """Servers a query can hit: all reachable ones, or those a geo filter overlaps"""
+        healths = healths if healths is not None else self._healths()
+        urls = []
+        for url in self.urls:
+            health = healths.get(url)
+            if health is None or not health.get('vectors'):
+                continue
+            if geo_filter is not None and (not health.get('bounds') or not geo_filter.intersects(health['bounds'])):
+                continue
+            urls.append(url)
+        return urls
+
+    def search(self, query_embedding: np.ndarray, top_k: int = 20, nprobe: int = None,
+               ef_search: int = None, geo_filter: GeoFilter = None, rerank: int = None) -> ShardHits:
+        """Search for similar images (see PortugalImageIndex.search)"""
+        return self.search_many(query_embedding.reshape(1, -1), top_k=top_k, nprobe=nprobe,
+                                ef_search=ef_search, geo_filter=geo_filter, rerank=rerank)[0]
+
+    def search_many(self, query_embeddings: np.ndarray, top_k: int = 20, nprobe: int = None,
+                    ef_search: int = None, geo_filter=None, rerank: int = None) -> list:
+        """
+        Search several queries across the index servers.
+
+        Args:
+            query_embeddings: Query embeddings of shape (n_queries, dimension)
+            top_k: Number of results to return per query
+            nprobe: IVF lists to scan in each shard
+            ef_search: HNSW search breadth in each shard
+            geo_filter: GeoFilter for every query, or a list with one per query
+            rerank: Candidates each shard rescores exactly
+
+        Returns:
+            List of ShardHits, one per query, in order; hits are named by
+            server URL
+        """
+        if query_embeddings.ndim == 1:
+            query_embeddings = query_embeddings.reshape(1, -1)
+        n = len(query_embeddings)
+        filters = geo_filter if isinstance(geo_filter, (list, tuple)) else [geo_filter] * n
+
+        healths = self._healths()
+        routed = {}
+        for i, f in enumerate(filters):
+            for url in self.shards_for(f, healths):
+                routed.setdefault(url, []).append(i)
+
+        def search_shard(url, queries):
+            body = {
+                'queries': encode_queries(query_embeddings[queries]),
+                'top_k': top_k,
+                'nprobe': nprobe,
+                'ef_search': ef_search,
+                'rerank': rerank,
+                'geo_filters': [encode_filter(filters[i]) for i in queries]
+            }
+            response = self._session().post(f"{url}/search", json=body, timeout=self.timeout)
+            response.raise_for_status()
+            return [RemoteHits(result['hits'], result['ids']) for result in response.json()['results']]
+
+        futures = {self._pool.submit(search_shard, url, queries): (url, queries)
+                   for url, queries in routed.items()}
+        _, late = wait(futures, timeout=self.timeout)
+
+        parts = [[] for _ in range(n)]
+        missing = [[] for _ in range(n)]
+        for future, (url, queries) in futures.items():
+            if future in late:
+                future.cancel()
+                outcome = 'timeouts'
+                logger.warning(f"Index server {url} timed out after {self.timeout}s")
+            elif future.exception() is not None:
+                outcome = 'failures'
+                logger.error(f"Index server {url} failed: {future.exception()}")
+            else:
+                outcome = None
+                for i, hits in zip(queries, future.result()):
+                    parts[i].append((url, hits))
+
+            with self._lock:
+                self._counters[url]['requests'] += 1
+                if outcome:
+                    self._counters[url][outcome] += 1
+                    # Left out until the entry expires and /health is re-checked
+                    self._health[url] = (time.monotonic(), None)
+            if outcome:
+                for i in queries:
+                    missing[i].append(url)
+
+        return [ShardHits(query_parts, limit=top_k, missing=query_missing)
+                for query_parts, query_missing in zip(parts, missing)]
+
+    @property
+    def is_available(self) -> bool:
+        """Check if any index server has vectors"""
+        return any((health or {}).get('vectors') for health in self._healths().values())
+
+    @property
+    def shard_stats(self) -> dict:
+        """Per-server health and request counters"""
+        with self._lock:
+            health = {url: checked_health for url, (_, checked_health) in self._health.items()}
+        return {
+            'servers': len(self.urls),
+            'timeout_seconds': self.timeout,
+            'shards': {url: {'health': health.get(url), **self._counters[url]} for url in self.urls}
+        }
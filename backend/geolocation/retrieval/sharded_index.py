@@ -0,0 +1,380 @@
+"""
+Region-sharded image index
+The retrieval index split into separately built and loaded FAISS shards
+(spatial grid cells or a metadata field such as district), searched in
+parallel and merged by similarity
+"""
+
+import re
+import json
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from .faiss_index import PortugalImageIndex, process_rss_mb
+from .geo_filter import GeoFilter
+from .metadata_store import ColumnarMetadata
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'shards.json'
+UNLOCATED = 'unlocated'
+
+
+def shard_keys(metadata, partition: str = 'grid', cell_deg: float = 1.0, field: str = None) -> np.ndarray:
+    """
+    Shard name for every metadata row.
+
+    Args:
+        metadata: ColumnarMetadata (or MetadataSegments)
+        partition: 'grid' for lat/lon cells, 'field' to shard by a metadata field
+        cell_deg: Grid cell size in degrees
+        field: Metadata field for partition='field' (e.g. 'district')
+
+    Returns:
+        Object array of shard names, one per row
+    """
+    if partition == 'grid':
+        lat = np.asarray(metadata.lat, dtype=np.float64)
+        lon = np.asarray(metadata.lon, dtype=np.float64)
+        located = np.isfinite(lat) & np.isfinite(lon)
+        lat0 = np.floor(np.where(located, lat, 0) / cell_deg) * cell_deg
+        lon0 = np.floor(np.where(located, lon, 0) / cell_deg) * cell_deg
+        return np.array([
+            f"grid_{a:.2f}_{b:.2f}" if ok else UNLOCATED
+            for a, b, ok in zip(lat0, lon0, located)
+        ], dtype=object)
+
+    if partition == 'field':
+        if not field:
+            raise ValueError("partition='field' needs a metadata field name")
+        values = (metadata.value(field, i) if field in metadata.kinds else None for i in range(len(metadata)))
+        return np.array([
+            re.sub(r'[^a-z0-9_-]+', '_', str(v).lower()).strip('_') or UNLOCATED if v is not None else UNLOCATED
+            for v in values
+        ], dtype=object)
+
+    raise ValueError(f"Unknown partition: {partition} (choose grid or field)")
+
+
+class ShardHits:
+    """
+    Hits of one query merged across shards, best first.
+
+    Same interface as SearchHits; every hit dict also names its shard.
+    """
+
+    def __init__(self, parts: list, limit: int, missing: list = None):
+        """
+        Args:
+            parts: (shard name, SearchHits) pairs
+            limit: Hits to keep
+            missing: Shards that should have been searched but did not answer
+        """
+        self.missing = list(missing or [])
+        parts = [(name, hits) for name, hits in parts if len(hits)]
+        self._parts = parts
+        if parts:
+            similarity = np.concatenate([hits.similarity for _, hits in parts])
+            part = np.concatenate([np.full(len(hits), p) for p, (_, hits) in enumerate(parts)])
+            position = np.concatenate([np.arange(len(hits)) for _, hits in parts])
+            order = np.argsort(-similarity, kind='stable')[:limit]
+        else:
+            similarity = part = position = order = np.zeros(0, dtype=np.int64)
+
+        self.similarity = np.asarray(similarity[order], dtype=np.float32)
+        self._part = part[order]
+        self._position = position[order]
+
+    def _column(self, attribute: str) -> np.ndarray:
+        values = np.zeros(len(self), dtype=np.float64 if attribute != 'ids' else np.int64)
+        for p, (_, hits) in enumerate(self._parts):
+            mask = self._part == p
+            values[mask] = getattr(hits, attribute)[self._position[mask]]
+        return values
+
+    @property
+    def ids(self) -> np.ndarray:
+        """Row ids within each hit's shard (see shards)"""
+        return self._column('ids')
+
+    @property
+    def shards(self) -> list:
+        return [self._parts[p][0] for p in self._part]
+
+    @property
+    def lat(self) -> np.ndarray:
+        return self._column('lat')
+
+    @property
+    def lon(self) -> np.ndarray:
+        return self._column('lon')
+
+    def __len__(self) -> int:
+        return len(self.similarity)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._hit(j) for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._hit(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._hit(i)
+
+    def _hit(self, i: int) -> dict:
+        name, hits = self._parts[self._part[i]]
+        return {**hits[int(self._position[i])], 'rank': i + 1, 'shard': name}
+
+    def to_dicts(self, limit: int = None) -> list:
+        """Result dicts for the first `limit` hits (all by default)"""
+        return self[:limit]
+
+
+class ShardedImageIndex:
+    """
+    Retrieval index made of independent PortugalImageIndex shards.
+
+    Layout of shard_dir:
+        shards.json          partition scheme, per-shard size and bounds
+        <name>/index.faiss   one FAISS index per shard (plus its params,
+        <name>/meta.cols     tombstones and delta segments)
+
+    Shards are loaded on first use and kept in an LRU of at most
+    max_loaded shards, so regions nobody queries take no memory. Queries
+    fan out over a thread pool to the shards they can reach (all shards, or
+    the ones a geo filter overlaps) and the per-shard top-k are merged.
+    """
+
+    def __init__(self, shard_dir: str, max_loaded: int = 8, max_workers: int = 4, mmap: bool = False,
+                 rerank: int = 0):
+        """
+        Args:
+            shard_dir: Directory holding shards.json and the shard directories
+            max_loaded: Shards kept in memory at once
+            max_workers: Shards searched in parallel
+            mmap: Memory-map shard indexes instead of reading them into the heap
+            rerank: Candidates each shard rescores exactly (0: off)
+        """
+        self.shard_dir = Path(shard_dir)
+        self.max_loaded = max(1, max_loaded)
+        self.mmap = mmap
+        self.rerank = rerank
+        self.manifest = {'partition': 'grid', 'cell_deg': 1.0, 'field': None, 'shards': {}}
+        if self.exists(shard_dir):
+            self.manifest = json.loads((self.shard_dir / MANIFEST_FILE).read_text())
+
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='index-shard')
+        self._counters = {'loads': 0, 'evictions': 0}
+
+    @staticmethod
+    def exists(shard_dir: str) -> bool:
+        return (Path(shard_dir) / MANIFEST_FILE).exists()
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, metadata, shard_dir: str, partition: str = 'grid',
+              cell_deg: float = 1.0, field: str = None, **index_options) -> 'ShardedImageIndex':
+        """
+        Partition a collection and build one index per shard.
+
+        Args:
+            embeddings: numpy array of shape (n, dimension)
+            metadata: list of metadata dicts or a ColumnarMetadata
+            shard_dir: Output directory
+            partition: 'grid' or 'field' (see shard_keys)
+            cell_deg: Grid cell size in degrees
+            field: Metadata field for partition='field'
+            **index_options: Passed to PortugalImageIndex.create_index
+                (memory_budget_mb, target_recall, index_type)
+        """
+        if not isinstance(metadata, ColumnarMetadata):
+            metadata = ColumnarMetadata.from_records(metadata)
+
+        sharded = cls(shard_dir)
+        sharded.manifest = {'partition': partition, 'cell_deg': cell_deg, 'field': field, 'shards': {}}
+        keys = shard_keys(metadata, partition, cell_deg, field)
+        for name in sorted(set(keys)):
+            rows = np.flatnonzero(keys == name)
+            sharded.rebuild_shard(name, embeddings[rows], metadata.take(rows), **index_options)
+
+        logger.info(f"Built {len(sharded.manifest['shards'])} shards from {len(metadata)} vectors")
+        return sharded
+
+    def _shard_paths(self, name: str) -> tuple:
+        return self.shard_dir / name / 'index.faiss', self.shard_dir / name / 'meta.cols'
+
+    def rebuild_shard(self, name: str, embeddings: np.ndarray, metadata, **index_options):
+        """Build (or replace) one shard without touching the others"""
+        if not isinstance(metadata, ColumnarMetadata):
+            metadata = ColumnarMetadata.from_records(metadata)
+
+        index = PortugalImageIndex()
+        index.create_index(embeddings, metadata, **index_options)
+        index_path, meta_path = self._shard_paths(name)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        index.save(str(index_path), str(meta_path))
+
+        lat = np.asarray(metadata.lat, dtype=np.float64)
+        lon = np.asarray(metadata.lon, dtype=np.float64)
+        located = np.isfinite(lat) & np.isfinite(lon)
+        bounds = ([float(lat[located].min()), float(lat[located].max()),
+                   float(lon[located].min()), float(lon[located].max())] if located.any() else None)
+
+        with self._lock:
+            self.manifest['shards'][name] = {'count': len(metadata), 'bounds': bounds,
+                                             'type': index.spec['type']}
+            self._loaded.pop(name, None)
+            self._write_manifest()
+        logger.info(f"Built shard {name} ({len(metadata)} vectors, {index.spec['type']})")
+
+    def _write_manifest(self):
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.shard_dir / (MANIFEST_FILE + '.tmp')
+        tmp.write_text(json.dumps(self.manifest, indent=2))
+        tmp.replace(self.shard_dir / MANIFEST_FILE)
+
+    def shard(self, name: str) -> PortugalImageIndex:
+        """A shard's index, loading it (and evicting the least recently used) if needed"""
+        with self._lock:
+            index = self._loaded.get(name)
+            if index is not None:
+                self._loaded.move_to_end(name)
+                return index
+
+        # Loaded outside the lock so other shards stay searchable meanwhile
+        index_path, meta_path = self._shard_paths(name)
+        index = PortugalImageIndex(str(index_path), str(meta_path), mmap=self.mmap, rerank=self.rerank)
+
+        with self._lock:
+            self._loaded[name] = index
+            self._loaded.move_to_end(name)
+            self._counters['loads'] += 1
+            while len(self._loaded) > self.max_loaded:
+                evicted, _ = self._loaded.popitem(last=False)
+                self._counters['evictions'] += 1
+                logger.info(f"Evicted index shard {evicted}")
+        return index
+
+    def evict(self, name: str = None):
+        """Drop one loaded shard, or all of them"""
+        with self._lock:
+            if name is None:
+                self._loaded.clear()
+            else:
+                self._loaded.pop(name, None)
+
+    def shards_for(self, geo_filter: GeoFilter = None) -> list:
+        """Shards a query can hit: all of them, or those a geo filter overlaps"""
+        shards = self.manifest['shards']
+        if geo_filter is None:
+            return [name for name, info in shards.items() if info['count']]
+        return [name for name, info in shards.items()
+                if info['count'] and info['bounds'] and geo_filter.intersects(info['bounds'])]
+
+    def search(self, query_embedding: np.ndarray, top_k: int = 20, nprobe: int = None,
+               ef_search: int = None, geo_filter: GeoFilter = None, rerank: int = None) -> ShardHits:
+        """Search for similar images (see PortugalImageIndex.search)"""
+        return self.search_many(query_embedding.reshape(1, -1), top_k=top_k, nprobe=nprobe,
+                                ef_search=ef_search, geo_filter=geo_filter, rerank=rerank)[0]
+
+    def search_many(self, query_embeddings: np.ndarray, top_k: int = 20, nprobe: int = None,
+                    ef_search: int = None, geo_filter=None, rerank: int = None) -> list:
+        """
+        Search several queries across the shards they can reach.
+
+        Args:
+            query_embeddings: Query embeddings of shape (n_queries, dimension)
+            top_k: Number of results to return per query
+            nprobe: IVF lists to scan in each shard
+            ef_search: HNSW search breadth in each shard
+            geo_filter: GeoFilter for every query, or a list with one per query
+            rerank: Candidates each shard rescores exactly (default: the
+                index's rerank)
+
+        Returns:
+            List of ShardHits, one per query, in order
+        """
+        if query_embeddings.ndim == 1:
+            query_embeddings = query_embeddings.reshape(1, -1)
+        n = len(query_embeddings)
+        filters = geo_filter if isinstance(geo_filter, (list, tuple)) else [geo_filter] * n
+
+        # Queries per shard
+        routed = {}
+        for i, f in enumerate(filters):
+            for name in self.shards_for(f):
+                routed.setdefault(name, []).append(i)
+
+        def search_shard(name, queries):
+            hits = self.shard(name).search_many(query_embeddings[queries], top_k=top_k, nprobe=nprobe,
+                                                ef_search=ef_search, rerank=rerank,
+                                                geo_filter=[filters[i] for i in queries])
+            return name, queries, hits
+
+        parts = [[] for _ in range(n)]
+        missing = [[] for _ in range(n)]
+        futures = {self._pool.submit(search_shard, name, queries): (name, queries)
+                   for name, queries in routed.items()}
+        for future, (name, queries) in futures.items():
+            try:
+                _, _, hits = future.result()
+            except Exception as e:
+                logger.error(f"Shard {name} search failed: {e}")
+                for i in queries:
+                    missing[i].append(name)
+                continue
+            for i, shard_hits in zip(queries, hits):
+                parts[i].append((name, shard_hits))
+
+        return [ShardHits(query_parts, limit=top_k, missing=query_missing)
+                for query_parts, query_missing in zip(parts, missing)]
+
+    @property
+    def is_available(self) -> bool:
+        """Check if any shard can be searched"""
+        return any(info['count'] for info in self.manifest['shards'].values())
+
+    @property
+    def memory_stats(self) -> dict:
+        """Memory of the resident shards (see PortugalImageIndex.memory_stats)"""
+        with self._lock:
+            loaded = dict(self._loaded)
+        shards = {name: index.memory_stats for name, index in loaded.items()}
+
+        def total(part, key):
+            values = [s[part][key] for s in shards.values() if s.get(part) and s[part][key] is not None]
+            return round(sum(values), 1)
+
+        return {
+            'mode': 'mmap' if self.mmap else 'heap',
+            'process_rss_mb': process_rss_mb(),
+            'index': {'mapped_mb': total('index', 'mapped_mb'), 'resident_mb': total('index', 'resident_mb')},
+            'metadata': {'mapped_mb': total('metadata', 'mapped_mb'),
+                         'resident_mb': total('metadata', 'resident_mb')},
+            'shards': shards
+        }
+
+    @property
+    def shard_stats(self) -> dict:
+        """Shard counts, which shards are resident, and load/eviction counters"""
+        with self._lock:
+            loaded = list(self._loaded)
+        return {
+            'partition': self.manifest['partition'],
+            'shards': len(self.manifest['shards']),
+            'vectors': sum(info['count'] for info in self.manifest['shards'].values()),
+            'loaded': loaded,
+            'max_loaded': self.max_loaded,
+            **self._counters
+        }
@@ -0,0 +1,134 @@
+"""
+Full-precision vector store for exact re-ranking
+L2-normalized float16 copies of the indexed vectors, memory-mapped so a
+compressed index can rescore its candidates with exact cosine similarity
+"""
+
+import os
+import logging
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Stored next to the index as <index_path>.vectors.npy
+VECTORS_SUFFIX = '.vectors.npy'
+
+
+def vectors_path(index_path: str) -> Path:
+    return Path(str(index_path) + VECTORS_SUFFIX)
+
+
+def normalized_f16(embeddings: np.ndarray) -> np.ndarray:
+    """Rows scaled to unit length and stored as float16"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return (embeddings / np.maximum(norms, 1e-12)).astype(np.float16)
+
+
+class VectorStore:
+    """
+    Row i holds vector id i of the index.
+
+    The base rows are a read-only memory map of a .npy file; rows added
+    since it was written are kept in the heap until the next save.
+    """
+
+    def __init__(self, base: np.ndarray = None, dimension: int = None):
+        if base is None:
+            base = np.zeros((0, dimension or 0), dtype=np.float16)
+        self._base = base
+        self._tail = []
+        self._count = len(base)
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def dimension(self) -> int:
+        return self._base.shape[1]
+
+    @classmethod
+    def from_embeddings(cls, embeddings: np.ndarray) -> 'VectorStore':
+        return cls(normalized_f16(embeddings))
+
+    @classmethod
+    def load(cls, path) -> 'VectorStore':
+        """Memory-map a stored vector file"""
+        base = np.load(path, mmap_mode='r')
+        logger.info(f"Memory-mapped {len(base)} exact vectors from {path}")
+        return cls(base)
+
+    def append(self, embeddings: np.ndarray):
+        rows = normalized_f16(embeddings)
+        if self._count == 0 and not self._base.shape[1]:
+            self._base = np.zeros((0, rows.shape[1]), dtype=np.float16)
+        if rows.shape[1] != self.dimension:
+            raise ValueError(f"Vectors of dimension {rows.shape[1]} added to a store of dimension {self.dimension}")
+        self._tail.append(rows)
+        self._count += len(rows)
+
+    def save(self, path):
+        """
+        Write every row and switch to a memory map of the new file.
+
+        Written beside and renamed over, so processes that have the old file
+        mapped keep reading a complete copy.
+        """
+        path = Path(path)
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.vstack([self._base, *self._tail]) if self._tail else np.asarray(self._base))
+        os.replace(tmp_path, path)
+        self._base = np.load(path, mmap_mode='r')
+        self._tail = []
+
+    def take(self, ids: np.ndarray) -> np.ndarray:
+        """float32 rows for some ids"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not self._tail:
+            return np.asarray(self._base[ids], dtype=np.float32)
+
+        rows = np.empty((len(ids), self.dimension), dtype=np.float32)
+        in_base = ids < len(self._base)
+        rows[in_base] = self._base[ids[in_base]]
+        if not in_base.all():
+            tail = np.vstack(self._tail)
+            rows[~in_base] = tail[ids[~in_base] - len(self._base)]
+        return rows
+
+    def rerank(self, queries: np.ndarray, ids: np.ndarray, top_k: int) -> tuple:
+        """
+        Exact cosine scores for candidate ids, best first.
+
+        Args:
+            queries: Query embeddings (n_queries, dimension)
+            ids: Candidate ids (n_queries, n_candidates), -1 for padding
+            top_k: Hits kept per query
+
+        Returns:
+            (similarities, ids) of shape (n_queries, top_k), padded with
+            -inf / -1
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+        valid = ids >= 0
+        scores = np.full(ids.shape, -np.inf, dtype=np.float32)
+        if valid.any():
+            # Sorted ids read the mapped file front to back
+            unique, inverse = np.unique(ids[valid], return_inverse=True)
+            vectors = self.take(unique)
+            rows = np.nonzero(valid)[0]
+            scores[valid] = np.einsum('ij,ij->i', vectors[inverse], queries[rows])
+
+        order = np.argsort(-scores, axis=1, kind='stable')[:, :top_k]
+        similarities = np.take_along_axis(scores, order, axis=1)
+        ranked = np.where(np.isfinite(similarities), np.take_along_axis(ids, order, axis=1), -1)
+
+        width = order.shape[1]
+        if width < top_k:
+            similarities = np.pad(similarities, ((0, 0), (0, top_k - width)), constant_values=-np.inf)
+            ranked = np.pad(ranked, ((0, 0), (0, top_k - width)), constant_values=-1)
+        return similarities, ranked
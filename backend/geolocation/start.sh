@@ -52,11 +52,15 @@ mkdir -p data/portugal data/indexes data/feedback data/gis_cache
 export FLASK_APP=app.py
 export FLASK_ENV=${FLASK_ENV:-production}
 export PORT=${PORT:-3001}
+# Worker count; also read by the execution profile (GEO_EXEC_PROFILE) to
+# split the CPU between workers
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-2}
 
 # Start server
 echo "Starting server on port $PORT..."
 if [ "$FLASK_ENV" = "development" ]; then
     python app.py
 else
-    gunicorn -w 2 -b 0.0.0.0:$PORT app:app
+    # Threads let concurrent requests reach the micro-batcher together
+    gunicorn -w $WEB_CONCURRENCY --threads ${GUNICORN_THREADS:-8} -b 0.0.0.0:$PORT app:app
 fi
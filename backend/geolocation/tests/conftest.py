@@ -0,0 +1,24 @@
+"""
+Shared setup for the geolocation service tests
+Modules are imported the way app.py imports them, from this service's directory
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def unit_vectors():
+    """Factory for random L2-normalized float32 rows"""
+    rng = np.random.default_rng(0)
+
+    def make(n: int, dimension: int = 16) -> np.ndarray:
+        vectors = rng.normal(size=(n, dimension)).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    return make
@@ -0,0 +1,86 @@
+"""Resumable index build: chunks where nothing could be embedded"""
+
+import csv
+
+import numpy as np
+import pytest
+
+pytest.importorskip('faiss')
+pytest.importorskip('torch')
+
+import build_index
+import models.portugal_embedder
+
+DIMENSION = 16
+
+
+class FakeEmbedder:
+    """Embeds local files by content; missing files fail like a dead portal"""
+
+    embedding_dim = DIMENSION
+    cache = None
+
+    def __init__(self, **kwargs):
+        self.backbone = object()
+
+    def iter_embeddings(self, sources, batch_size=32, num_workers=4):
+        for index, source in enumerate(sources):
+            if not source.exists():
+                yield index, source, None
+                continue
+            seed = int(source.read_text())
+            vector = np.random.default_rng(seed).normal(size=DIMENSION).astype(np.float32)
+            yield index, source, vector / np.linalg.norm(vector)
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    """Six rows in chunks of two; the middle chunk has no usable image"""
+    rows = []
+    for i in range(6):
+        image = tmp_path / f"photo{i}.jpg"
+        if i not in (2, 3):
+            image.write_text(str(i))
+        rows.append({'image_path': image.name, 'lat': 38.0 + i * 0.01, 'lon': -9.0})
+    rows[3]['lat'] = ''  # no location either
+
+    path = tmp_path / 'photos.csv'
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['image_path', 'lat', 'lon'])
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+
+def test_write_chunk_without_rows(tmp_path):
+    path = tmp_path / 'chunk.npz'
+    build_index.write_chunk(path, [], [], [], 5, DIMENSION)
+    vectors, records = build_index.read_chunk(path)
+    assert vectors.shape == (0, DIMENSION)
+    assert records == []
+
+
+def test_build_with_failing_chunk(tmp_path, manifest, monkeypatch):
+    monkeypatch.setattr(models.portugal_embedder, 'PortugalEmbedder', FakeEmbedder)
+    args = build_index.build_parser().parse_args([
+        '--manifest', str(manifest), '--work-dir', str(tmp_path / 'work'),
+        '--output-index', str(tmp_path / 'out' / 'index.faiss'),
+        '--output-meta', str(tmp_path / 'out' / 'meta.json'),
+        '--workers', '1', '--chunk-size', '2', '--index-type', 'flat', '--bf16', '0'
+    ])
+
+    work_dir = tmp_path / 'work'
+    total = build_index.stage_embed(args, work_dir)
+    assert total == 3
+    with np.load(build_index.chunk_path(work_dir, 1)) as chunk:
+        assert chunk['vectors'].shape == (0, DIMENSION)
+        assert int(chunk['failed']) == 2
+
+    report = build_index.stage_index(args, work_dir, total)
+    assert report['vectors'] == 4
+
+    from retrieval.faiss_index import PortugalImageIndex
+
+    index = PortugalImageIndex(report['index'], report['metadata'])
+    assert [record['image_path'] for record in index.metadata] == [
+        'photo0.jpg', 'photo1.jpg', 'photo4.jpg', 'photo5.jpg']
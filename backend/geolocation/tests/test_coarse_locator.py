@@ -0,0 +1,78 @@
+"""GeoCLIP construction and gallery cells (models.coarse_locator)"""
+
+import sys
+import types
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from models.coarse_locator import gallery_cells, geoclip_without_clip
+
+
+@pytest.fixture
+def fake_geoclip(monkeypatch):
+    """A geoclip package laid out like the real one, counting CLIP loads"""
+    loads = []
+
+    class CLIPModel:
+        @staticmethod
+        def from_pretrained(name):
+            loads.append(name)
+            return torch.nn.Linear(2, 2)
+
+    encoder_module = types.ModuleType('geoclip.model.image_encoder')
+    encoder_module.CLIPModel = CLIPModel
+    encoder_module.AutoProcessor = CLIPModel
+
+    class ImageEncoder(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.CLIP = encoder_module.CLIPModel.from_pretrained('openai/clip-vit-large-patch14')
+            self.image_processor = encoder_module.AutoProcessor.from_pretrained('openai/clip-vit-large-patch14')
+            self.mlp = torch.nn.Linear(768, 512)
+            for param in self.CLIP.parameters():
+                param.requires_grad = False
+
+    ImageEncoder.__module__ = encoder_module.__name__
+    encoder_module.ImageEncoder = ImageEncoder
+
+    class GeoCLIP(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.image_encoder = ImageEncoder()
+            self.location_encoder = torch.nn.Linear(2, 512)
+
+    package = types.ModuleType('geoclip')
+    package.GeoCLIP, package.ImageEncoder = GeoCLIP, ImageEncoder
+    monkeypatch.setitem(sys.modules, 'geoclip', package)
+    monkeypatch.setitem(sys.modules, encoder_module.__name__, encoder_module)
+    return loads, encoder_module
+
+
+def test_geoclip_is_built_without_its_clip(fake_geoclip):
+    loads, encoder_module = fake_geoclip
+    model = geoclip_without_clip()
+    assert loads == []
+    assert model.image_encoder.CLIP is None
+    assert model.image_encoder.mlp.out_features == 512
+    assert model.location_encoder is not None
+    # The loaders are restored for anyone else using them
+    encoder_module.CLIPModel.from_pretrained('x')
+    assert loads == ['x']
+
+
+def test_unrecognised_layout_still_drops_clip(fake_geoclip, monkeypatch):
+    loads, _ = fake_geoclip
+    monkeypatch.delattr(sys.modules['geoclip'], 'ImageEncoder')
+    model = geoclip_without_clip()
+    assert len(loads) == 2
+    assert model.image_encoder.CLIP is None
+
+
+def test_gallery_cells_group_nearby_points():
+    coords = np.array([[38.70, -9.10], [38.71, -9.11], [41.15, -8.61], [41.16, -8.60]])
+    cells, centers = gallery_cells(coords, cell_km=25)
+    assert cells[0] == cells[1] and cells[2] == cells[3] and cells[0] != cells[2]
+    assert np.allclose(centers[cells[0]], [38.705, -9.105])
@@ -0,0 +1,101 @@
+"""DuplicateCollapser grouping"""
+
+import numpy as np
+import pytest
+
+from retrieval.dedup import DuplicateCollapser
+
+
+def near_copy(vectors: np.ndarray, scale: float = 0.01, seed: int = 1) -> np.ndarray:
+    noise = np.random.default_rng(seed).normal(size=vectors.shape).astype(np.float32)
+    copies = vectors + scale * noise / np.sqrt(vectors.shape[1])
+    return copies / np.linalg.norm(copies, axis=1, keepdims=True)
+
+
+class KeptIndex:
+    """Exhaustive search over the kept vectors, as the index being built"""
+
+    def __init__(self, noise: float = 0.0):
+        self.vectors = []
+        self.noise = noise
+
+    def add(self, vectors):
+        self.vectors.extend(vectors)
+
+    def search(self, queries, k):
+        kept = np.array(self.vectors)
+        sims = queries @ kept.T
+        # Compressed codes: scores off by up to `noise`, never the ids' order
+        sims = sims + self.noise
+        order = np.argsort(-sims, axis=1)[:, :k]
+        return np.take_along_axis(sims, order, axis=1), order
+
+
+def run(collapser, batches, index=None):
+    index = index or KeptIndex()
+    masks = []
+    for vectors, batch_records in batches:
+        keep = collapser.add_batch(vectors, batch_records, search=index.search)
+        index.add(vectors[keep])
+        masks.append(keep)
+    return np.concatenate(masks)
+
+
+def test_groups_copies_within_and_across_batches(unit_vectors):
+    originals = unit_vectors(6)
+    batches = [
+        (np.vstack([originals[:3], near_copy(originals[:1])]),
+         [{'source': 'idealista'}] * 3 + [{'source': 'olx'}]),
+        (np.vstack([near_copy(originals[1:3], seed=2), originals[3:]]),
+         [{'source': 'supercasa'}] * 2 + [{'source': 'olx'}] * 3)
+    ]
+    collapser = DuplicateCollapser(threshold=0.97)
+    keep = run(collapser, batches)
+
+    assert keep.tolist() == [True, True, True, False, False, False, True, True, True]
+    assert collapser.kept == 6
+    assert set(collapser.groups) == {0, 1, 2}
+    assert collapser.groups[0] == {'count': 1, 'sources': {'olx'}}
+    merged = collapser.merged({'source': 'idealista'}, 1)
+    assert merged['duplicate_count'] == 1
+    assert merged['duplicate_sources'] == ['idealista', 'supercasa']
+    assert collapser.merged({'source': 'olx'}, 5) == {'source': 'olx'}
+    assert collapser.stats['largest_group'] == 2
+
+
+def test_distinct_vectors_are_kept(unit_vectors):
+    vectors = unit_vectors(10)
+    collapser = DuplicateCollapser(threshold=0.97)
+    assert run(collapser, [(vectors[:5], [{}] * 5), (vectors[5:], [{}] * 5)]).all()
+    assert collapser.groups == {}
+
+
+def test_inflated_search_scores_are_rechecked(unit_vectors):
+    vectors = unit_vectors(8)
+    collapser = DuplicateCollapser(threshold=0.97)
+    keep = run(collapser, [(vectors[:4], [{}] * 4), (vectors[4:], [{}] * 4)], index=KeptIndex(noise=1.0))
+    assert keep.all()
+
+
+def test_different_hashes_are_not_merged(unit_vectors):
+    original = unit_vectors(1)
+    batch = np.vstack([original, near_copy(original), near_copy(original, seed=3)])
+    hashes = [{'phash': '0' * 16}, {'phash': 'f' * 16}, {'phash': '0' * 15 + '3'}]
+    collapser = DuplicateCollapser(threshold=0.97, max_hash_distance=10)
+    assert run(collapser, [(batch, hashes)]).tolist() == [True, True, False]
+    assert collapser.groups[0]['count'] == 1
+
+
+@pytest.mark.parametrize('on_disk', [False, True])
+def test_state_survives_save_and_load(tmp_path, unit_vectors, on_disk):
+    originals = unit_vectors(4)
+    vectors_file = tmp_path / 'kept.f16' if on_disk else None
+    collapser = DuplicateCollapser(threshold=0.97, vectors_file=vectors_file)
+    index = KeptIndex()
+    run(collapser, [(originals, [{'source': 'olx'}] * 4)], index)
+    collapser.save(tmp_path / 'dedup.npz')
+
+    restored = DuplicateCollapser.load(tmp_path / 'dedup.npz', vectors_file=vectors_file)
+    run(restored, [(near_copy(originals[2:]), [{'source': 'idealista'}] * 2)], index)
+    assert restored.keep.tolist() == [True] * 4 + [False, False]
+    assert restored.groups[3] == {'count': 1, 'sources': {'idealista'}}
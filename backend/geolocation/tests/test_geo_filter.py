@@ -0,0 +1,67 @@
+"""Geo-filtered retrieval (retrieval.geo_filter and PortugalImageIndex)"""
+
+import numpy as np
+import pytest
+
+from retrieval.geo_filter import GeoFilter, GridPartition, haversine_km
+
+
+@pytest.fixture
+def points():
+    """500 random locations over mainland Portugal"""
+    rng = np.random.default_rng(1)
+    return rng.uniform(37.0, 42.0, 500), rng.uniform(-9.5, -6.5, 500)
+
+
+def test_partition_matches_brute_force(points):
+    lat, lon = points
+    lat[::50] = np.nan  # rows without a location are never selected
+    partition = GridPartition(lat, lon)
+    geo_filter = GeoFilter([[38.72, -9.14], [41.15, -8.61]], radius_km=40)
+
+    expected = np.flatnonzero(np.isfinite(lat) & geo_filter.contains(lat, lon))
+    assert len(expected) > 0
+    assert np.array_equal(partition.select(geo_filter), expected)
+    assert len(partition.select(GeoFilter.circle(0.0, 0.0, 10))) == 0
+
+
+@pytest.mark.parametrize('index_type', ['flat', 'hnsw'])
+def test_search_stays_inside_the_radius(points, unit_vectors, index_type):
+    pytest.importorskip('faiss')
+    from retrieval.faiss_index import PortugalImageIndex
+
+    lat, lon = points
+    vectors = unit_vectors(len(lat))
+    index = PortugalImageIndex()
+    index.create_index(vectors, [{'lat': a, 'lon': b} for a, b in zip(lat, lon)], index_type=index_type)
+
+    top_k = [{'lat': 38.72, 'lon': -9.14, 'confidence': 0.6}, {'lat': 40.2, 'lon': -8.4, 'confidence': 0.2}]
+    geo_filter = GeoFilter.around(top_k, radius_km=30)
+    inside = np.flatnonzero(geo_filter.contains(lat, lon))
+
+    found = index.search_many(vectors[:3], top_k=10, geo_filter=[geo_filter, None, geo_filter], ef_search=256)
+    for hits in (found[0], found[2]):
+        assert 0 < len(hits) <= min(10, len(inside))
+        assert np.isin(hits.ids, inside).all()
+        assert np.all(np.diff(hits.similarity) <= 1e-6)
+        distances = np.min([haversine_km(loc['lat'], loc['lon'], hits.lat, hits.lon) for loc in top_k], axis=0)
+        assert (distances <= 30).all()
+    # The unfiltered query ranks over the whole index
+    assert int(found[1].ids[0]) == 1 and len(found[1]) == 10
+
+
+def test_filter_reaches_adds_on_a_mapped_index(tmp_path, unit_vectors):
+    pytest.importorskip('faiss')
+    from retrieval.faiss_index import PortugalImageIndex
+
+    paths = str(tmp_path / 'index.faiss'), str(tmp_path / 'meta.cols')
+    index = PortugalImageIndex(*paths)
+    index.create_index(unit_vectors(20), [{'lat': 38.7, 'lon': -9.1}] * 10 + [{'lat': 41.1, 'lon': -8.6}] * 10)
+    index.save()
+
+    mapped = PortugalImageIndex(*paths, mmap=True)
+    added = unit_vectors(2)
+    mapped.add(added, [{'lat': 38.71, 'lon': -9.1}, {'lat': 41.1, 'lon': -8.6}])
+    hits = mapped.search_many(added, top_k=20, geo_filter=GeoFilter.circle(38.7, -9.1, 5))
+    assert int(hits[0].ids[0]) == 20
+    assert all(set(h.ids) <= set(range(10)) | {20} for h in hits)
@@ -0,0 +1,33 @@
+"""Clustering and best-prediction selection in HybridGeoLocator"""
+
+import pytest
+
+pytest.importorskip('sklearn')
+
+from pipeline.hybrid_predictor import HybridGeoLocator
+
+
+def hit(lat: float, lon: float, similarity: float, **fields) -> dict:
+    return {'lat': lat, 'lon': lon, 'similarity': similarity, **fields}
+
+
+def test_collapsed_duplicates_count_towards_cluster_size():
+    locator = HybridGeoLocator()
+    candidates = [hit(38.7100, -9.1400, 0.9, duplicate_count=3), hit(38.7101, -9.1401, 0.85),
+                  hit(41.1500, -8.6100, 0.8), hit(41.1501, -8.6101, 0.8), hit(41.1502, -8.6102, 0.8)]
+    clusters = locator._cluster_candidates(candidates)
+    assert [c['cluster_size'] for c in clusters] == [5, 3]
+    assert clusters[0]['lat'] == pytest.approx(38.71, abs=1e-3)
+
+    result = {'predictions': clusters, 'coarse_prediction': None, 'retrieval_candidates': candidates}
+    best = locator._select_best_prediction(result)
+    assert best['source'] == 'retrieval_cluster' and best['cluster_size'] == 5
+
+
+def test_two_hits_without_duplicates_are_not_a_strong_cluster():
+    locator = HybridGeoLocator()
+    candidates = [hit(38.7100, -9.1400, 0.9), hit(38.7101, -9.1401, 0.85)]
+    result = {'predictions': locator._cluster_candidates(candidates), 'coarse_prediction': None,
+              'retrieval_candidates': candidates}
+    assert result['predictions'][0]['cluster_size'] == 2
+    assert locator._select_best_prediction(result)['source'] == 'single_retrieval'
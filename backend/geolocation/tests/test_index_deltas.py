@@ -0,0 +1,122 @@
+"""Delta segments, tombstones and compaction of PortugalImageIndex"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('faiss')
+
+from retrieval.faiss_index import PortugalImageIndex
+
+
+def records(start: int, n: int) -> list:
+    return [{'lat': 38.0 + i * 0.01, 'lon': -9.0, 'photo': f'p{i}'} for i in range(start, start + n)]
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / 'index.faiss'), str(tmp_path / 'meta.cols')
+
+
+@pytest.fixture
+def base(paths, unit_vectors):
+    """Saved 20-vector index and its vectors"""
+    vectors = unit_vectors(20)
+    index = PortugalImageIndex(*paths)
+    index.create_index(vectors, records(0, 20))
+    index.save()
+    return vectors
+
+
+def nearest(index, vectors) -> list:
+    return [int(hits.ids[0]) if len(hits) else None for hits in index.search_many(vectors, top_k=1)]
+
+
+@pytest.mark.parametrize('mmap', [False, True])
+def test_replay_adds_and_removes(paths, base, unit_vectors, mmap):
+    index = PortugalImageIndex(*paths, mmap=mmap)
+    added = unit_vectors(5)
+    ids = index.add(added, records(20, 5))
+    assert list(ids) == [20, 21, 22, 23, 24]
+    assert index.remove([3, 21]) == 2
+    assert index.save_delta(auto_compact=False) is not None
+
+    reloaded = PortugalImageIndex(*paths, mmap=mmap)
+    assert len(reloaded.delta_segments()) == 1
+    assert len(reloaded.metadata) == 25
+    assert reloaded.metadata[22]['photo'] == 'p22'
+    assert nearest(reloaded, added[[0, 2]]) == [20, 22]
+    found = reloaded.search_many(np.vstack([base[3], added[1]]), top_k=25)
+    assert all(3 not in hits.ids and 21 not in hits.ids for hits in found)
+
+
+def test_segments_stack_in_order(paths, base, unit_vectors):
+    index = PortugalImageIndex(*paths)
+    first, second = unit_vectors(2), unit_vectors(2)
+    index.add(first, records(20, 2))
+    index.save_delta(auto_compact=False)
+    index.remove([20])
+    index.add(second, records(22, 2))
+    index.save_delta(auto_compact=False)
+
+    reloaded = PortugalImageIndex(*paths)
+    assert len(reloaded.delta_segments()) == 2
+    assert list(reloaded.tombstones) == [20]
+    assert nearest(reloaded, np.vstack([first[1], second])) == [21, 22, 23]
+
+
+def test_compaction_folds_segments(paths, base, unit_vectors):
+    index = PortugalImageIndex(*paths)
+    added = unit_vectors(3)
+    index.add(added, records(20, 3))
+    index.remove([0])
+    index.save_delta(auto_compact=False)
+    index.compact()
+
+    assert index.delta_segments() == []
+    reloaded = PortugalImageIndex(*paths)
+    assert len(reloaded.metadata) == 23
+    assert list(reloaded.tombstones) == [0]
+    assert nearest(reloaded, added) == [20, 21, 22]
+    assert all(0 not in hits.ids for hits in reloaded.search_many(base[:1], top_k=23))
+
+
+def test_needs_compaction_after_many_segments(paths, base, unit_vectors):
+    index = PortugalImageIndex(*paths)
+    for i in range(3):
+        index.add(unit_vectors(1), records(20 + i, 1))
+        index.save_delta(auto_compact=False)
+    assert index.needs_compaction(max_segments=3)
+    assert not index.needs_compaction(max_segments=4, max_delta_fraction=1.0)
+
+
+def test_delta_without_base_writes_snapshot(paths, unit_vectors):
+    index = PortugalImageIndex(*paths)
+    vectors = unit_vectors(4)
+    index.add(vectors, records(0, 4))
+    assert index.save_delta() is None
+
+    reloaded = PortugalImageIndex(*paths)
+    assert reloaded.index.ntotal == 4
+    assert nearest(reloaded, vectors) == [0, 1, 2, 3]
+
+
+def test_mapped_replay_keeps_base_shared(paths, base, unit_vectors):
+    index = PortugalImageIndex(*paths)
+    added = unit_vectors(4)
+    index.add(added, records(20, 4))
+    index.save_delta(auto_compact=False)
+
+    mapped = PortugalImageIndex(*paths, mmap=True)
+    stats = mapped.memory_stats
+    assert stats['mode'] == 'mmap'
+    assert stats['delta_vectors'] == 4
+    assert mapped.ntotal == 24
+    assert nearest(mapped, np.vstack([base[5], added])) == [5, 20, 21, 22, 23]
+
+    mapped.remove([21])
+    assert mapped.ntotal == 23
+    mapped.save()
+    reloaded = PortugalImageIndex(*paths, mmap=True)
+    assert 'delta_vectors' not in reloaded.memory_stats
+    assert nearest(reloaded, added[[0, 2, 3]]) == [20, 22, 23]
+    assert all(21 not in hits.ids for hits in reloaded.search_many(added[1:2], top_k=24))
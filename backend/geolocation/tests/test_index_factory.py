@@ -0,0 +1,55 @@
+"""Index type selection and search parameters (retrieval.index_factory)"""
+
+import pytest
+
+pytest.importorskip('faiss')
+
+from retrieval.faiss_index import PortugalImageIndex
+from retrieval.index_factory import EXACT_SEARCH_MAX, choose_index, estimate_memory_mb, load_params
+
+
+def test_small_collections_get_exact_search():
+    spec = choose_index(10_000, 768)
+    assert spec['type'] == 'flat' and spec['search_params'] == {}
+
+
+def test_picks_most_compact_type_meeting_recall():
+    n = 2_000_000
+    assert choose_index(n, 768, target_recall=0.95)['type'] == 'ivf_sq8'
+    assert choose_index(n, 768, target_recall=0.97)['type'] == 'ivf_fp16'
+    assert choose_index(n, 768, target_recall=0.98)['type'] == 'hnsw'
+
+
+def test_memory_budget_trades_recall_for_size():
+    n = 2_000_000
+    budget = estimate_memory_mb('ivf_sq8', n, 768) - 1
+    spec = choose_index(n, 768, memory_budget_mb=budget, target_recall=0.95)
+    assert spec['type'] == 'ivf_pq'
+    assert spec['estimated_memory_mb'] <= budget
+    assert 768 % spec['pq_m'] == 0
+
+
+def test_search_params_follow_target_recall():
+    n = EXACT_SEARCH_MAX * 4
+    loose = choose_index(n, 64, index_type='ivf_sq8', target_recall=0.9)
+    strict = choose_index(n, 64, index_type='ivf_sq8', target_recall=0.99)
+    assert 0 < loose['search_params']['nprobe'] < strict['search_params']['nprobe'] <= loose['nlist']
+    assert choose_index(n, 64, index_type='hnsw', target_recall=0.99)['search_params'] == {'ef_search': 128}
+
+    with pytest.raises(ValueError, match='Unknown index type'):
+        choose_index(n, 64, index_type='lsh')
+
+
+@pytest.mark.parametrize('index_type', ['hnsw', 'ivf_sq8'])
+def test_built_index_keeps_its_params(tmp_path, unit_vectors, index_type):
+    vectors = unit_vectors(2000, 32)
+    paths = str(tmp_path / 'index.faiss'), str(tmp_path / 'meta.cols')
+    index = PortugalImageIndex(*paths)
+    index.create_index(vectors, [{'lat': 38.7, 'lon': -9.1}] * len(vectors), index_type=index_type)
+    index.save()
+
+    reloaded = PortugalImageIndex(*paths)
+    assert load_params(paths[0])['type'] == index_type
+    assert reloaded.spec['search_params'] == index.spec['search_params']
+    found = reloaded.search_many(vectors[:20], top_k=1, nprobe=reloaded.spec.get('nlist'), ef_search=256)
+    assert [int(hits.ids[0]) for hits in found] == list(range(20))
@@ -0,0 +1,86 @@
+"""HTTP index server request handling (index_server.py)"""
+
+import json
+import threading
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+pytest.importorskip('faiss')
+
+import index_server
+from retrieval.faiss_index import PortugalImageIndex
+from retrieval.geo_filter import GeoFilter
+from retrieval.remote_index import encode_filter, encode_queries
+
+
+@pytest.fixture(scope='module')
+def server():
+    vectors = np.eye(16, dtype=np.float32)
+    index = PortugalImageIndex()
+    index.create_index(vectors, [{'lat': 38.7 + i * 0.01, 'lon': -9.1} for i in range(16)], index_type='flat')
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), index_server.IndexRequestHandler)
+    httpd.daemon_threads = True
+    httpd.index = index
+    httpd.health = index_server.shard_health('test', index)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def post(server, body: bytes, content_length: str = None, path: str = '/search') -> tuple:
+    """(status, decoded JSON) of a raw POST"""
+    connection = HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+    connection.putrequest('POST', path)
+    connection.putheader('Content-Type', 'application/json')
+    connection.putheader('Content-Length', str(len(body)) if content_length is None else content_length)
+    connection.endheaders()
+    connection.send(body)
+    response = connection.getresponse()
+    payload = json.loads(response.read())
+    connection.close()
+    return response.status, payload
+
+
+def search_body(**fields) -> bytes:
+    return json.dumps({'queries': encode_queries(np.eye(16, dtype=np.float32)[:2]), **fields}).encode()
+
+
+def test_valid_search(server):
+    status, payload = post(server, search_body(top_k=3))
+    assert status == 200 and payload['shard'] == 'test'
+    assert [result['ids'][0] for result in payload['results']] == [0, 1]
+
+
+@pytest.mark.parametrize('body', [
+    b'{not json',
+    b'\xff\xfe',
+    b'[1, 2]',
+    json.dumps({'top_k': 3}).encode(),
+    json.dumps({'queries': {'data': 'AAAA', 'shape': [2, 16]}}).encode(),
+    json.dumps({'queries': encode_queries(np.ones((2, 8), dtype=np.float32))}).encode(),
+    search_body(geo_filters=[encode_filter(GeoFilter.circle(38.7, -9.1, 5))]),
+    search_body(geo_filters=['nearby', None]),
+    search_body(top_k='many'),
+])
+def test_invalid_requests_get_400(server, body):
+    status, payload = post(server, body)
+    assert status == 400
+    assert payload['error'].startswith('Invalid search request')
+
+
+@pytest.mark.parametrize('content_length', ['abc', '-5'])
+def test_bad_content_length_gets_400(server, content_length):
+    status, _ = post(server, b'', content_length=content_length)
+    assert status == 400
+
+
+def test_oversized_body_and_unknown_path(server, monkeypatch):
+    monkeypatch.setattr(index_server, 'MAX_BODY_BYTES', 100)
+    assert post(server, search_body())[0] == 413
+    assert post(server, search_body(), path='/other')[0] == 404
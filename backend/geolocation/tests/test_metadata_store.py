@@ -0,0 +1,71 @@
+"""ColumnarMetadata take/concat round-trips"""
+
+import numpy as np
+import pytest
+
+from retrieval.metadata_store import ColumnarMetadata, MetadataSegments, concat_metadata
+
+RECORDS = [
+    {'lat': 38.72, 'lon': -9.14, 'source': 'idealista', 'tags': ['t0', 'sea']},
+    {'lat': 41.15, 'lon': -8.61, 'source': 'olx'},
+    {'lat': 37.02, 'lon': -7.93, 'tags': {'rooms': 3}},
+    {'lat': 32.65, 'lon': -16.91, 'source': 'supercasa', 'tags': []}
+]
+
+
+def assert_records_equal(actual, expected):
+    assert len(actual) == len(expected)
+    for got, want in zip(actual, expected):
+        assert got.keys() == want.keys()
+        for key, value in want.items():
+            if key in ('lat', 'lon'):
+                assert got[key] == pytest.approx(value, abs=1e-4)
+            else:
+                assert got[key] == value
+
+
+def test_from_records_round_trip():
+    assert_records_equal(list(ColumnarMetadata.from_records(RECORDS)), RECORDS)
+
+
+def test_take_keeps_order_and_missing_fields():
+    store = ColumnarMetadata.from_records(RECORDS)
+    rows = np.array([3, 0, 2, 0])
+    assert_records_equal(list(store.take(rows)), [RECORDS[i] for i in rows])
+
+
+def test_take_nothing():
+    assert len(ColumnarMetadata.from_records(RECORDS).take(np.zeros(0, dtype=np.int64))) == 0
+
+
+def test_concat_round_trip():
+    parts = [ColumnarMetadata.from_records(RECORDS[:1]), ColumnarMetadata.from_records(RECORDS[1:])]
+    merged = concat_metadata(parts)
+    assert_records_equal(list(merged), RECORDS)
+    np.testing.assert_allclose(merged.lat, [r['lat'] for r in RECORDS], atol=1e-4)
+
+
+def test_concat_promotes_text_to_json():
+    text = ColumnarMetadata.from_records([{'lat': 1.0, 'lon': 2.0, 'tags': 'plain'}])
+    structured = ColumnarMetadata.from_records([{'lat': 3.0, 'lon': 4.0, 'tags': {'a': 1}}])
+    merged = concat_metadata([text, structured])
+    assert [r['tags'] for r in merged] == ['plain', {'a': 1}]
+
+
+def test_segments_take_matches_concat():
+    parts = [ColumnarMetadata.from_records(RECORDS[:2]), ColumnarMetadata.from_records(RECORDS[2:])]
+    segments = MetadataSegments(parts)
+    assert segments[3] == concat_metadata(parts)[3]
+    assert_records_equal(list(segments.take(np.array([2, 1]))), [RECORDS[2], RECORDS[1]])
+
+
+def test_save_load_round_trip(tmp_path):
+    store = ColumnarMetadata.from_records(RECORDS)
+    store.save(tmp_path / 'meta.cols')
+    assert_records_equal(list(ColumnarMetadata.load(tmp_path / 'meta.cols')), RECORDS)
+
+
+def test_save_drops_stale_validity_mask(tmp_path):
+    ColumnarMetadata.from_records([{'source': 'olx'}, {'lat': 1.0}]).save(tmp_path)
+    ColumnarMetadata.from_records([{'source': 'olx'}, {'source': 'idealista'}]).save(tmp_path)
+    assert [r['source'] for r in ColumnarMetadata.load(tmp_path)] == ['olx', 'idealista']
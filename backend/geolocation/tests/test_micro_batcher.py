@@ -0,0 +1,57 @@
+"""Batching and failure isolation in MicroBatcher"""
+
+import threading
+
+import pytest
+
+from models.micro_batcher import MicroBatcher
+
+
+def submit_together(batcher, items) -> list:
+    """Submit items from concurrent threads; results (or exceptions) in order"""
+    outcomes = [None] * len(items)
+
+    def call(i):
+        try:
+            outcomes[i] = batcher.submit(items[i], timeout=5)
+        except Exception as e:
+            outcomes[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(items))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def test_concurrent_items_share_a_batch():
+    sizes = []
+
+    def double(items):
+        sizes.append(len(items))
+        return [2 * x for x in items]
+
+    batcher = MicroBatcher(double, max_batch_size=8, max_wait_ms=200)
+    assert submit_together(batcher, [1, 2, 3, 4]) == [2, 4, 6, 8]
+    assert max(sizes) > 1
+    batcher.close()
+
+
+def test_failed_batch_only_fails_bad_items():
+    def invert(items):
+        return [1 / x for x in items]
+
+    batcher = MicroBatcher(invert, max_batch_size=8, max_wait_ms=200)
+    outcomes = submit_together(batcher, [1, 0, 4, 0])
+    assert outcomes[0] == 1.0 and outcomes[2] == 0.25
+    assert all(isinstance(outcomes[i], ZeroDivisionError) for i in (1, 3))
+    assert batcher.stats()['errors'] == 2
+    batcher.close()
+
+
+def test_result_count_mismatch_is_an_error():
+    batcher = MicroBatcher(lambda items: [], max_batch_size=1)
+    with pytest.raises(RuntimeError, match='0 results for 1 items'):
+        batcher.submit('x', timeout=5)
+    batcher.close()
@@ -0,0 +1,52 @@
+"""Export and parity check of the vision tower backends (model_tools.py)"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+import model_tools
+
+
+class TinyTrunk(torch.nn.Module):
+    """Stand-in vision tower: patch conv, pooling and a projection"""
+
+    image_size = (32, 32)
+
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.patch = torch.nn.Conv2d(3, 16, kernel_size=8, stride=8)
+        self.proj = torch.nn.Linear(16, 8)
+
+    def forward(self, pixel_values):
+        features = self.patch(pixel_values).flatten(2).mean(-1)
+        return self.proj(torch.nn.functional.gelu(features))
+
+
+@pytest.fixture
+def tiny_backbone(monkeypatch):
+    backbone = SimpleNamespace(trunk=TinyTrunk().eval(), fingerprint='tiny:test', preprocess=None)
+    monkeypatch.setattr(model_tools, '_eager_backbone', lambda args: (backbone, 'base'))
+    return backbone
+
+
+@pytest.mark.parametrize('backend', ['torchscript', 'onnx'])
+def test_exported_backend_matches_eager(tmp_path, tiny_backbone, capsys, backend):
+    if backend == 'onnx':
+        pytest.importorskip('onnx')
+        pytest.importorskip('onnxruntime')
+
+    parser = model_tools.build_parser()
+    export = parser.parse_args(['export', '--backend', backend, '--output-dir', str(tmp_path)])
+    export.func(export)
+    assert json.loads(capsys.readouterr().out)['backend'] == backend
+
+    parity = parser.parse_args(['parity', '--backend', backend, '--output-dir', str(tmp_path),
+                                '--sample', '4'])
+    assert parity.func(parity) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report['passed'] and report['samples'] == 4
+    assert report['cosine_min'] >= 0.9999 and report['max_abs_diff'] <= 1e-3
@@ -0,0 +1,61 @@
+"""PCA stage stored inside the retrieval index"""
+
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('faiss')
+
+from retrieval.faiss_index import PortugalImageIndex
+from retrieval.index_factory import PARAMS_SUFFIX, describe_index, pca_report
+
+
+@pytest.fixture
+def low_rank():
+    """Factory for unit vectors near an 8-dimensional subspace of R^32"""
+    rng = np.random.default_rng(2)
+    basis = rng.normal(size=(8, 32))
+
+    def make(n: int) -> np.ndarray:
+        vectors = rng.normal(size=(n, 8)) @ basis + 0.01 * rng.normal(size=(n, 32))
+        return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+    return make
+
+
+@pytest.mark.parametrize('whiten', [False, True])
+def test_pca_survives_save_and_load(tmp_path, low_rank, whiten):
+    vectors = low_rank(500)
+    paths = str(tmp_path / 'index.faiss'), str(tmp_path / 'meta.cols')
+    index = PortugalImageIndex(*paths)
+    index.create_index(vectors, [{'lat': 38.7, 'lon': -9.1}] * 500, index_type='flat',
+                       pca_dim=8, whiten=whiten)
+    report = index.spec['pca']
+    assert (report['dimension_in'], report['dimension_out'], report['whiten']) == (32, 8, whiten)
+    assert report['retained_variance'] > 0.99
+    index.save()
+
+    reloaded = PortugalImageIndex(*paths, mmap=True)
+    assert reloaded.index.d == 32
+    assert pca_report(reloaded.index) == report
+    assert reloaded.spec['pca'] == report
+    found = reloaded.search_many(vectors[:10], top_k=1, rerank=0)
+    assert [int(hits.ids[0]) for hits in found] == list(range(10))
+
+    # Later adds and queries are projected with the stored components
+    added = low_rank(3)
+    assert list(reloaded.add(added, [{'lat': 41.1, 'lon': -8.6}] * 3)) == [500, 501, 502]
+    assert [int(hits.ids[0]) for hits in reloaded.search_many(added, top_k=1)] == [500, 501, 502]
+
+
+def test_pca_is_described_without_a_params_file(tmp_path, low_rank):
+    paths = str(tmp_path / 'index.faiss'), str(tmp_path / 'meta.cols')
+    index = PortugalImageIndex(*paths)
+    index.create_index(low_rank(300), [{'lat': 38.7, 'lon': -9.1}] * 300, index_type='flat', pca_dim=8)
+    index.save()
+    os.remove(paths[0] + PARAMS_SUFFIX)
+
+    reloaded = PortugalImageIndex(*paths)
+    assert describe_index(reloaded.index)['pca_dim'] == 8
+    assert reloaded.spec['type'] == 'flat' and reloaded.spec['pca_dim'] == 8
@@ -0,0 +1,62 @@
+"""Location prototypes and per-photo drill-down (retrieval.prototype_index)"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('faiss')
+
+from retrieval.prototype_index import PrototypeImageIndex
+
+
+def unit(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+@pytest.fixture
+def places():
+    """
+    Two places of 8 photos each in 16 dimensions, queried with e0.
+
+    Place A's photos all sit at cosine 0.8 from the query. Place B holds one
+    photo equal to the query among unrelated ones, so its centroid scores
+    lower than A's but its best photo scores 1.
+    """
+    basis = np.eye(16, dtype=np.float32)
+    a = [unit(0.8 * basis[0] + 0.6 * basis[1])] * 8
+    b = [basis[0]] + [basis[j] for j in range(2, 9)]
+    records = ([{'lat': 38.7223, 'lon': -9.1393, 'photo': f'a{i}'} for i in range(8)] +
+               [{'lat': 41.1579, 'lon': -8.6291, 'photo': f'b{i}'} for i in range(8)])
+    return np.vstack(a + b), records, basis[0]
+
+
+def test_one_prototype_per_place(places):
+    vectors, records, _ = places
+    index = PrototypeImageIndex.build(vectors, records, max_prototypes=1, index_type='flat')
+    assert index.manifest['places'] == 2 and index.manifest['prototypes'] == 2
+    assert list(index.members(0)) == list(range(8))
+    assert [photo['photo'] for photo in index.photos(1)] == [f'b{i}' for i in range(8)]
+    assert index.prototypes.metadata.record(1)['photo_count'] == 8
+
+
+def test_drill_down_rescores_hits_as_their_best_photo(tmp_path, places):
+    vectors, records, query = places
+    PrototypeImageIndex.build(vectors, records, index_dir=str(tmp_path), max_prototypes=1, index_type='flat')
+    index = PrototypeImageIndex(str(tmp_path), drill_down=True)
+
+    centroids = index.search(query, top_k=2, drill_down=False)
+    assert list(centroids.ids) == [0, 1]
+    assert centroids.similarity[0] == pytest.approx(0.8, abs=1e-3)
+    assert centroids.similarity[1] == pytest.approx(8 ** -0.5, abs=1e-3)
+
+    photos = index.search(query, top_k=2)
+    assert list(photos.ids) == [1, 0]
+    assert photos.similarity == pytest.approx([1.0, 0.8], abs=1e-3)
+    assert photos[0]['location_key'] == '41.1579,-8.6291'
+
+
+def test_without_kept_photos_drill_down_is_skipped(places):
+    vectors, records, query = places
+    index = PrototypeImageIndex.build(vectors, records, max_prototypes=1, keep_photos=False, index_type='flat')
+    assert list(index.search(query, top_k=2, drill_down=True).ids) == [0, 1]
+    assert index.photos(0) == []
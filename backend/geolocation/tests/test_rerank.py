@@ -0,0 +1,54 @@
+"""Exact float16 re-ranking of compressed-index candidates"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('faiss')
+
+from retrieval.faiss_index import PortugalImageIndex
+from retrieval.vector_store import vectors_path
+
+
+@pytest.fixture(scope='module')
+def pq_index(tmp_path_factory):
+    """Saved IVF-PQ index with coarse 2-byte codes over 1000 vectors (trained once)"""
+    vectors = np.random.default_rng(3).normal(size=(1000, 16)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    directory = tmp_path_factory.mktemp('pq')
+    paths = str(directory / 'index.faiss'), str(directory / 'meta.cols')
+    index = PortugalImageIndex(*paths)
+    index.create_index(vectors, [{'lat': 38.7, 'lon': -9.1}] * len(vectors), index_type='ivf_pq', pq_m=2)
+    index.save()
+    return paths, vectors
+
+
+def test_rerank_restores_exact_order(pq_index, unit_vectors):
+    paths, vectors = pq_index
+    assert vectors_path(paths[0]).exists()
+    index = PortugalImageIndex(*paths, mmap=True, rerank=200)
+    assert index.has_exact_vectors
+
+    queries = unit_vectors(5)
+    exact = vectors @ queries.T
+    expected = np.argsort(-exact, axis=0, kind='stable')[:10].T
+    nlist = index.spec['nlist']
+
+    approximate = index.search_batch(queries, top_k=10, nprobe=nlist, rerank=0)
+    assert not np.array_equal(approximate.ids, expected)
+
+    reranked = index.search_batch(queries, top_k=10, nprobe=nlist)
+    assert np.array_equal(reranked.ids, expected)
+    expected_sims = np.take_along_axis(exact.T, expected, axis=1)
+    assert np.allclose(reranked.similarities, expected_sims, atol=2e-3)
+
+
+def test_rerank_covers_vectors_added_after_load(pq_index, unit_vectors):
+    paths, _ = pq_index
+    index = PortugalImageIndex(*paths, rerank=100)
+    added = unit_vectors(3)
+    index.add(added, [{'lat': 41.1, 'lon': -8.6}] * 3)
+    assert index.has_exact_vectors
+
+    hits = index.search_many(added, top_k=1, nprobe=index.spec['nlist'])
+    assert [int(h.ids[0]) for h in hits] == [1000, 1001, 1002]
+    assert np.allclose([h.similarity[0] for h in hits], 1.0, atol=2e-3)
@@ -0,0 +1,60 @@
+"""Vectorized batch search on PortugalImageIndex"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('faiss')
+
+from retrieval.faiss_index import PortugalImageIndex, SearchHits
+
+
+def located(n: int) -> list:
+    return [{'lat': 38.0 + i * 0.01, 'lon': -9.0} for i in range(n)]
+
+
+@pytest.fixture
+def index(unit_vectors):
+    vectors = unit_vectors(12)
+    index = PortugalImageIndex()
+    index.create_index(vectors, located(12), index_type='flat')
+    return index, vectors
+
+
+def test_short_rows_are_padded(index):
+    index, vectors = index
+    batch = index.search_batch(vectors[:3], top_k=15)
+    assert batch.ids.shape == batch.similarities.shape == batch.lat.shape == (3, 15)
+    assert list(batch.counts) == [12, 12, 12]
+    assert list(batch.ids[:, 0]) == [0, 1, 2]
+    assert (batch.ids[:, 12:] == -1).all()
+    assert np.isneginf(batch.similarities[:, 12:]).all()
+    assert np.isnan(batch.lat[:, 12:]).all() and np.isfinite(batch.lat[:, :12]).all()
+
+
+def test_matches_search_many(index):
+    index, vectors = index
+    batch = index.search_batch(vectors[3:6], top_k=4)
+    for row, hits in zip(range(3), index.search_many(vectors[3:6], top_k=4)):
+        assert isinstance(hits, SearchHits)
+        assert list(hits.ids) == list(batch.ids[row])
+        assert np.allclose(hits.similarity, batch.similarities[row])
+
+
+def test_removed_vectors_on_a_mapped_index_are_overfetched(tmp_path, index):
+    index, vectors = index
+    paths = str(tmp_path / 'index.faiss'), str(tmp_path / 'meta.cols')
+    index.save(*paths)
+
+    mapped = PortugalImageIndex(*paths, mmap=True)
+    nearest = [int(i) for i in mapped.search_batch(vectors[:1], top_k=12).ids[0]]
+    assert mapped.remove(nearest[:3]) == 3
+
+    batch = mapped.search_batch(vectors[:1], top_k=5)
+    assert mapped.memory_stats['mode'] == 'mmap'
+    assert list(batch.ids[0]) == nearest[3:8]
+    assert list(mapped.search_batch(vectors[:1], top_k=12).counts) == [9]
+
+
+def test_search_without_an_index_returns_empty_hits(unit_vectors):
+    hits = PortugalImageIndex().search(unit_vectors(1)[0], top_k=3)
+    assert isinstance(hits, SearchHits) and len(hits) == 0
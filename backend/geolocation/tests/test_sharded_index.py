@@ -0,0 +1,40 @@
+"""Scatter-gather search over ShardedImageIndex"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('faiss')
+
+from retrieval.sharded_index import ShardedImageIndex
+
+
+@pytest.fixture
+def sharded(tmp_path, unit_vectors):
+    """Two grid shards of 10 vectors each (around Lisbon and Porto)"""
+    vectors = unit_vectors(20)
+    records = [{'lat': (38.7 if i < 10 else 41.1) + i * 0.001, 'lon': -9.1 if i < 10 else -8.6}
+               for i in range(20)]
+    ShardedImageIndex.build(vectors, records, str(tmp_path / 'shards'), index_type='flat')
+    return ShardedImageIndex(str(tmp_path / 'shards')), vectors
+
+
+def test_merges_hits_across_shards(sharded):
+    index, vectors = sharded
+    found = index.search_many(vectors[[2, 15]], top_k=3)
+    assert [hits.shards[0] for hits in found] == ['grid_38.00_-10.00', 'grid_41.00_-9.00']
+    assert all(hits.missing == [] for hits in found)
+
+
+def test_failed_shard_is_reported_missing(sharded, monkeypatch):
+    index, vectors = sharded
+    shard = index.shard
+
+    def flaky(name):
+        if name == 'grid_41.00_-9.00':
+            raise OSError('shard unreadable')
+        return shard(name)
+
+    monkeypatch.setattr(index, 'shard', flaky)
+    found = index.search_many(vectors[[2, 15]], top_k=3)
+    assert [hits.missing for hits in found] == [['grid_41.00_-9.00']] * 2
+    assert set(found[1].shards) == {'grid_38.00_-10.00'}